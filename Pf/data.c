@@ -137,3 +137,21 @@ void bootstrapData(data *reference, data *toFill, const gsl_rng *gsl_rng)
 	}
 
 }
+
+void bootstrapPatternCounts(part *thePart, const gsl_rng *gsl_rng)
+{
+	// A bootstrap of thePart that only changes its patternCounts.
+	// The sites are drawn as in bootstrapData(), and each adds one
+	// to the count of its pattern.  The sequences and patterns are
+	// left alone, so resetPatternCounts() puts it back.
+	int     pos, ran;
+
+	for(pos = 0; pos < thePart->nPatterns; pos++) {
+		thePart->patternCounts[pos] = 0;
+	}
+	for(pos = 0; pos < thePart->nChar; pos++) {
+		ran = (int)gsl_rng_uniform_int(gsl_rng, (unsigned long int)(thePart->nChar));
+		thePart->patternCounts[thePart->sequencePositionPatternIndex[ran]]++;
+	}
+	thePart->patternCountsBootstrapped = 1;
+}
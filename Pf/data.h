@@ -3,3 +3,4 @@ void freeData(data *theData);
 void dumpData(data *theData);
 PyObject *rell(int nBoots, rellStuff *rStuff);
 void bootstrapData(data *reference, data *toFill, const gsl_rng *gsl_rng);
+void bootstrapPatternCounts(part *thePart, const gsl_rng *gsl_rng);
@@ -56,6 +56,16 @@
 #define BRLEN_MIN 1.0e-8  // changed apr02 from 1e-18
 #define BRLEN_MAX 3.0
 
+// Per-pattern likelihood scaling.  When the largest conditional
+// likelihood for a pattern at a node falls below this, the cl for
+// that pattern is multiplied up by a power of 2 (so it is exact), and
+// the log of that is kept in clScalers.
+#define CL_SCALE_THRESHOLD 1.0e-100
+// The same, for when the cl's are stored as floats (see
+// aTree->clFloat), which keeps them well away from float underflow.
+#define CL_SCALE_THRESHOLD_FLOAT 1.0e-20
+#define LN_2 0.69314718055994530942
+
 
 #define OPT_PIVEC      0
 #define OPT_RMATRIX    1
@@ -109,6 +119,21 @@
 //#define SOME       1
 #define NO_ORDER   -10000
 
+// Alignment, in bytes, of the cl slabs, enough for AVX-512.
+#define P4_ALIGNMENT 64
+
+// With OpenMP, a part with fewer patterns than this has its cl's
+// done in one thread, as it is not worth starting more.
+#define MIN_PATTERNS_FOR_THREADS 128
+
+// The cl's are done this many patterns at a time, one child after
+// another, which keeps the block of the parent cl in cache.
+#define CL_PATTERN_BLOCK 32
+
+// The default number of eigensystems kept in the cache, see
+// p4_eigCache.c, and var.eigCacheSize.
+#define EIG_CACHE_SIZE 64
+
 #define PF_MALLOC malloc
 #define PF_FREE free
 
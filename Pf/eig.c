@@ -222,6 +222,81 @@ void matrixExpTimesBranchLength(eig *anEig, double branchLength, double **result
 
 }
 
+void eigvecProducts(eig *anEig, double *prods)
+{
+	// prods[(((i * dim) + j) * dim) + k] = eigvecs[i][k] * inverseEigvecs[k][j],
+	// the bits of exp(Qt) that do not depend on t.  Real eigensystems only.
+	int	i, j, k, dim;
+	double *p;
+
+	dim = anEig->dim;
+	p = prods;
+	for(i = 0; i < dim; i++) {
+		for(j = 0; j < dim; j++) {
+			for(k = 0; k < dim; k++) {
+				p[k] = anEig->eigvecs[i][k] * anEig->inverseEigvecs[k][j];
+			}
+			p += dim;
+		}
+	}
+}
+
+#define EXP_BATCH_BLOCK 8
+
+void matrixExpTimesBranchLengths(eig *anEig, double *prods, int nMats, double *branchLengths, double ***results)
+{
+	// Like matrixExpTimesBranchLength(), but for nMats branch lengths
+	// at once, putting exp(Q * branchLengths[m]) in results[m].  The
+	// prods are from eigvecProducts(), and the exp's are done only
+	// once per eigenvalue per branch length.  Then it is a matrix
+	// multiply of the prods (dim * dim rows of dim) by the exp's
+	// (nMats columns of dim), done EXP_BATCH_BLOCK branch lengths at
+	// a time.  The sums are done in the same order as in
+	// matrixExpTimesBranchLength(), so the numbers are the same.  For
+	// complex eigensystems it just does them one at a time.
+	int	i, j, k, m, mStart, mEnd, dim;
+	double *expLT, *p, *e, sum;
+
+	if(anEig->complexEig) {
+		for(m = 0; m < nMats; m++) {
+			matrixExpTimesBranchLength(anEig, branchLengths[m], results[m]);
+		}
+		return;
+	}
+	dim = anEig->dim;
+	expLT = (double *)malloc(nMats * dim * sizeof(double));
+	if(!expLT) {
+		printf("Failed to malloc expLT.\n");
+		exit(1);
+	}
+	for(m = 0; m < nMats; m++) {
+		for(k = 0; k < dim; k++) {
+			expLT[(m * dim) + k] = SAFE_EXP(anEig->eigvals[k] * branchLengths[m]);
+		}
+	}
+	for(mStart = 0; mStart < nMats; mStart += EXP_BATCH_BLOCK) {
+		mEnd = mStart + EXP_BATCH_BLOCK;
+		if(mEnd > nMats) {
+			mEnd = nMats;
+		}
+		p = prods;
+		for(i = 0; i < dim; i++) {
+			for(j = 0; j < dim; j++) {
+				for(m = mStart; m < mEnd; m++) {
+					e = expLT + (m * dim);
+					sum = 0.0;
+					for(k = 0; k < dim; k++) {
+						sum = sum + (p[k] * e[k]);
+					}
+					results[m][i][j] = sum;
+				}
+				p += dim;
+			}
+		}
+	}
+	free(expLT);
+}
+
 //- (void) matrixLogInto: (double **) result;
 // this could be speeded up lots by taking the logs of the eigsvals first and re-using them
 void matrixLog(eig *anEig, double **result)
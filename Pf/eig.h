@@ -3,6 +3,8 @@ void allocComplexStuff(eig *anEig);
 void freeEig(eig *anEig);
 int eigensystem(eig *anEig);
 void matrixExpTimesBranchLength(eig *anEig, double branchLength, double **result);
+void eigvecProducts(eig *anEig, double *prods);
+void matrixExpTimesBranchLengths(eig *anEig, double *prods, int nMats, double *branchLengths, double ***results);
 void matrixLog(eig *anEig, double **result);
 void matrixPower(eig *anEig, double pow, double **result);
 void firstDerivativeOfMatrixExpTimesBranchLength(eig *anEig, double branchLength, double **result, double rate);
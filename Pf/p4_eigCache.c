@@ -0,0 +1,207 @@
+#include "pftypes.h"
+#include "p4_eigCache.h"
+#include "defines.h"
+#include <stdio.h>
+#include <stdlib.h>
+#include <string.h>
+
+/*
+  A cache of eigensystems of bigQ's, keyed by the contents of the comp
+  and the rMatrix that make the bigQ.  The same comp and rMatrix values
+  come up again and again in an mcmc, eg in the cur and prop trees of
+  a chain, in the different chains, and after rejected proposals, and
+  an eigensystem that has been done before can be copied rather than
+  worked out again.  There is one cache for the process, so it is
+  shared by all trees and chains.
+
+  It holds up to p4_eigCacheMaxSize entries, and when it is full the
+  least recently used entry is replaced.  Entries are found by a hash
+  of the key, and then the whole key is compared.  A copy is exactly
+  the same as what eigensystem() would give for the same bigQ.
+
+  Only real eigensystems are cached.  Complex ones (which need a
+  non-reversible model) are done as before.
+
+  This is not thread-safe, but the eigensystems are only done outside
+  of the threaded parts of the likelihood calculation.
+*/
+
+typedef struct {
+    unsigned long long hash;
+    int                dim;
+    double            *key;       // comp, then bigR, dim + (dim * dim)
+    double            *vals;      // bigQ, eigvecs, inverseEigvecs, eigvals
+    long               lastUsed;
+} p4_eigCacheEntry;
+
+static p4_eigCacheEntry *entries = NULL;
+static int  maxEntries = EIG_CACHE_SIZE;
+static int  nEntries = 0;
+static long useCounter = 0;
+static long nHits = 0;
+static long nMisses = 0;
+
+
+static double *p4_eigCacheMakeKey(int dim, double *comp, double **bigR, unsigned long long *hash)
+{
+    // FNV-1a, over the bytes of the key.
+    double *key;
+    int i, keySize;
+    unsigned char *p;
+
+    keySize = dim + (dim * dim);
+    key = malloc(keySize * sizeof(double));
+    if(!key) {
+        printf("Failed to malloc eig cache key.\n");
+        exit(1);
+    }
+    memcpy(key, comp, dim * sizeof(double));
+    for(i = 0; i < dim; i++) {
+        memcpy(key + dim + (i * dim), bigR[i], dim * sizeof(double));
+    }
+    *hash = 14695981039346656037ULL;
+    p = (unsigned char *)key;
+    for(i = 0; i < (int)(keySize * sizeof(double)); i++) {
+        *hash ^= p[i];
+        *hash *= 1099511628211ULL;
+    }
+    return key;
+}
+
+static p4_eigCacheEntry *p4_eigCacheFind(int dim, double *key, unsigned long long hash)
+{
+    int i;
+
+    for(i = 0; i < nEntries; i++) {
+        if(entries[i].hash == hash && entries[i].dim == dim &&
+           !memcmp(entries[i].key, key, (dim + (dim * dim)) * sizeof(double))) {
+            return &entries[i];
+        }
+    }
+    return NULL;
+}
+
+int p4_eigCacheLookup(int dim, double *comp, double **bigR, double **bigQ, eig *anEig)
+{
+    // If the eigensystem for comp and bigR is in the cache, copy it to
+    // bigQ and anEig and return 1.  Otherwise return 0.
+    double *key, *v;
+    unsigned long long hash;
+    p4_eigCacheEntry *entry;
+    int i, sqSize;
+
+    if(!maxEntries || anEig->complexEig) {
+        return 0;
+    }
+    key = p4_eigCacheMakeKey(dim, comp, bigR, &hash);
+    entry = p4_eigCacheFind(dim, key, hash);
+    free(key);
+    if(!entry) {
+        nMisses++;
+        return 0;
+    }
+    nHits++;
+    useCounter++;
+    entry->lastUsed = useCounter;
+    sqSize = dim * dim * sizeof(double);
+    v = entry->vals;
+    memcpy(bigQ[0], v, sqSize);
+    memcpy(anEig->eigvecs[0], v + (dim * dim), sqSize);
+    memcpy(anEig->inverseEigvecs[0], v + (2 * dim * dim), sqSize);
+    memcpy(anEig->eigvals, v + (3 * dim * dim), dim * sizeof(double));
+    for(i = 0; i < dim; i++) {
+        anEig->eigvalsImag[i] = 0.0;
+    }
+    return 1;
+}
+
+void p4_eigCacheStore(int dim, double *comp, double **bigR, double **bigQ, eig *anEig)
+{
+    // Add a newly done eigensystem to the cache, replacing the least
+    // recently used entry if it is full.
+    double *key, *v;
+    unsigned long long hash;
+    p4_eigCacheEntry *entry;
+    int i, sqSize;
+
+    if(!maxEntries || anEig->complexEig) {
+        return;
+    }
+    key = p4_eigCacheMakeKey(dim, comp, bigR, &hash);
+    if(p4_eigCacheFind(dim, key, hash)) {
+        free(key);
+        return;
+    }
+    if(!entries) {
+        entries = malloc(maxEntries * sizeof(p4_eigCacheEntry));
+        if(!entries) {
+            printf("Failed to malloc eig cache.\n");
+            exit(1);
+        }
+    }
+    if(nEntries < maxEntries) {
+        entry = &entries[nEntries];
+        nEntries++;
+    } else {
+        entry = &entries[0];
+        for(i = 1; i < nEntries; i++) {
+            if(entries[i].lastUsed < entry->lastUsed) {
+                entry = &entries[i];
+            }
+        }
+        free(entry->key);
+        free(entry->vals);
+    }
+    entry->hash = hash;
+    entry->dim = dim;
+    entry->key = key;
+    entry->vals = malloc(((3 * dim * dim) + dim) * sizeof(double));
+    if(!entry->vals) {
+        printf("Failed to malloc eig cache entry.\n");
+        exit(1);
+    }
+    useCounter++;
+    entry->lastUsed = useCounter;
+    sqSize = dim * dim * sizeof(double);
+    v = entry->vals;
+    memcpy(v, bigQ[0], sqSize);
+    memcpy(v + (dim * dim), anEig->eigvecs[0], sqSize);
+    memcpy(v + (2 * dim * dim), anEig->inverseEigvecs[0], sqSize);
+    memcpy(v + (3 * dim * dim), anEig->eigvals, dim * sizeof(double));
+}
+
+void p4_eigCacheClear(void)
+{
+    int i;
+
+    for(i = 0; i < nEntries; i++) {
+        free(entries[i].key);
+        free(entries[i].vals);
+    }
+    if(entries) {
+        free(entries);
+    }
+    entries = NULL;
+    nEntries = 0;
+    nHits = 0;
+    nMisses = 0;
+}
+
+void p4_eigCacheSetMaxSize(int maxSize)
+{
+    // Zero turns the cache off.  The cache is emptied.
+    p4_eigCacheClear();
+    maxEntries = maxSize;
+}
+
+int p4_eigCacheGetMaxSize(void)
+{
+    return maxEntries;
+}
+
+void p4_eigCacheStats(long *hits, long *misses, int *n)
+{
+    *hits = nHits;
+    *misses = nMisses;
+    *n = nEntries;
+}
@@ -0,0 +1,6 @@
+int p4_eigCacheLookup(int dim, double *comp, double **bigR, double **bigQ, eig *anEig);
+void p4_eigCacheStore(int dim, double *comp, double **bigR, double **bigQ, eig *anEig);
+void p4_eigCacheSetMaxSize(int maxSize);
+int p4_eigCacheGetMaxSize(void);
+void p4_eigCacheClear(void);
+void p4_eigCacheStats(long *hits, long *misses, int *nEntries);
@@ -2,8 +2,10 @@
 #include <Python.h>
 #include <numpy/arrayobject.h>
 #include "p4_model.h"
+#include "p4_node.h"
 #include "pmatrices.h"
 #include "eig.h"
+#include "p4_eigCache.h"
 #include "proteinModels.h"
 #include "defines.h"
 #include "util.h"
@@ -177,6 +179,8 @@ void p4_newModelPart(p4_model *aModel, int pNum, int dim, int nComps, int nRMatr
         for(j = 0; j < nRMatrices; j++) {
             mp->bigQAndEigThing[i][j]->bigQ = NULL;
             mp->bigQAndEigThing[i][j]->qEig = NULL;
+            mp->bigQAndEigThing[i][j]->eigvecProducts = NULL;
+            mp->bigQAndEigThing[i][j]->eigvecProductsNeedReset = 1;
             //mp->bigQAndEigThing[i][j]->needsReset = bQETneedsReset;
         }
     }
@@ -275,6 +279,10 @@ void p4_freeModelPart(p4_modelPart *mp)
                     freeEig(mp->bigQAndEigThing[i][j]->qEig);
                     mp->bigQAndEigThing[i][j]->qEig = NULL;
                 }
+                if(mp->bigQAndEigThing[i][j]->eigvecProducts) {
+                    free(mp->bigQAndEigThing[i][j]->eigvecProducts);
+                    mp->bigQAndEigThing[i][j]->eigvecProducts = NULL;
+                }
                 free(mp->bigQAndEigThing[i][j]);
                 mp->bigQAndEigThing[i][j] = NULL;
             }
@@ -504,19 +512,42 @@ void p4_resetBQET(p4_model *aModel, int pNum, int compNum, int rMatrixNum)
 
     if(!aQE->bigQ) {
         aQE->bigQ = psdmatrix(mp->dim);
-        setBigQFromRMatrixDotCharFreq(aQE->bigQ, r->bigR, c->val, mp->dim);
-        normalizeBigQ(aQE->bigQ, c->val, mp->dim);
         aQE->qEig = allocEig(mp->dim, aQE->bigQ);
     }
-    else {
+    // The same comp and rMatrix values may have been done before.
+    if(!p4_eigCacheLookup(mp->dim, c->val, r->bigR, aQE->bigQ, aQE->qEig)) {
         setBigQFromRMatrixDotCharFreq(aQE->bigQ, r->bigR, c->val, mp->dim);
         normalizeBigQ(aQE->bigQ, c->val, mp->dim);
+        ret = eigensystem(aQE->qEig);
+        p4_countWork(&p4_nEigSolves, 1);
+        if(ret) {
+            printf("p4_resetBQET()  There is a problem with the eigensystem.\n");
+            exit(1);
+        }
+        p4_eigCacheStore(mp->dim, c->val, r->bigR, aQE->bigQ, aQE->qEig);
     }
-    ret = eigensystem(aQE->qEig);
-    if(ret) {
-        printf("p4_resetBQET()  There is a problem with the eigensystem.\n");
-        exit(1);
-    }
+    aQE->eigvecProductsNeedReset = 1;
     mp->bQETneedsReset[(compNum * mp->nRMatrices) + rMatrixNum] = 0;
 	
 }
+
+void p4_expBQET(p4_model *aModel, int pNum, int compNum, int rMatrixNum, int nMats, double *brLens, double ***bigPs)
+{
+    // Make the nMats bigP matrices exp(Q * brLens[m]) for the bigQ of
+    // compNum and rMatrixNum, all at once.  The eigenvector products
+    // are kept, to be re-used until the eigensystem changes.
+    p4_modelPart   *mp;
+    p4_bigQAndEig  *aQE;
+
+    mp = aModel->parts[pNum];
+    aQE = mp->bigQAndEigThing[compNum][rMatrixNum];
+    if(!aQE->qEig->complexEig && aQE->eigvecProductsNeedReset) {
+        if(!aQE->eigvecProducts) {
+            aQE->eigvecProducts = pdvector(mp->dim * mp->dim * mp->dim);
+        }
+        eigvecProducts(aQE->qEig, aQE->eigvecProducts);
+        aQE->eigvecProductsNeedReset = 0;
+    }
+    matrixExpTimesBranchLengths(aQE->qEig, aQE->eigvecProducts, nMats, brLens, bigPs);
+    p4_countWork(&p4_nBigPRecalcs, nMats);
+}
@@ -10,4 +10,5 @@ void p4_newComp(p4_model *aModel, int pNum, int mNum, int free, PyArrayObject *v
 void p4_newRMatrix(p4_model *aModel, int pNum, int mNum, int free, int spec);
 p4_gdasrv *p4_newGdasrv(p4_model *aModel, int pNum, int mNum, int nCat, int free, PyArrayObject *val, PyArrayObject *freqs, PyArrayObject *rates);
 void p4_resetBQET(p4_model *aModel, int pNum, int compNum, int rMatrixNum);
+void p4_expBQET(p4_model *aModel, int pNum, int compNum, int rMatrixNum, int nMats, double *brLens, double ***bigPs);
 
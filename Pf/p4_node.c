@@ -1,10 +1,32 @@
+#include <Python.h>
 #include "pftypes.h"
 #include "p4_node.h"
 #include "p4_model.h"
 #include "pmatrices.h"
 #include "eig.h"
 #include "defines.h"
+#include "part.h"
 #include <math.h> //For fabs
+#include <string.h> //For memcpy
+
+int p4_nThreads = 1;
+
+// Tallies of the likelihood work, for profiling Mcmc proposals.  See
+// pf.p4WorkCounters().  They only go up.
+long long p4_nCLRecalcs = 0;
+long long p4_nBigPRecalcs = 0;
+long long p4_nEigSolves = 0;
+long long p4_nCopyBytes = 0;
+
+
+void p4_countWork(long long *counter, long long n)
+{
+    // The parts may be done in parallel, see p4_tree.c.
+#ifdef _OPENMP
+#pragma omp atomic
+#endif
+    *counter += n;
+}
 
 
 p4_node *p4_newNode(int nodeNum, p4_tree *aTree, int seqNum, int isLeaf, int inTree)
@@ -72,14 +94,16 @@ p4_node *p4_newNode(int nodeNum, p4_tree *aTree, int seqNum, int isLeaf, int inT
         exit(1);
     }
     for(i = 0; i < aNode->nParts; i++) {
-        aNode->bigPDecks[i] = (double ***)malloc(aNode->tree->model->parts[i]->nCat * sizeof(double **));
-        if(!aNode->bigPDecks[i]) {
-            printf("Failed to allocate memory for bigPDecks[i].\n");
-            exit(1);
-        }
-        for(j = 0; j < aNode->tree->model->parts[i]->nCat; j++) {
-            aNode->bigPDecks[i][j] = psdmatrix(aNode->tree->model->parts[i]->dim);
-        }
+        // All the nCat decks for a part are in one slab.
+        aNode->bigPDecks[i] = psddecks(aNode->tree->model->parts[i]->nCat, aNode->tree->model->parts[i]->dim);
+    }
+    aNode->bigPDecksOwn = (double ****)malloc(aNode->nParts * sizeof(double ***));
+    if(!aNode->bigPDecksOwn) {
+        printf("Failed to allocate memory for bigPDecksOwn.\n");
+        exit(1);
+    }
+    for(i = 0; i < aNode->nParts; i++) {
+        aNode->bigPDecksOwn[i] = aNode->bigPDecks[i];
     }
 
 
@@ -89,27 +113,58 @@ p4_node *p4_newNode(int nodeNum, p4_tree *aTree, int seqNum, int isLeaf, int inT
 
     // cl  conditionalLikelihoods
     if(!aNode->isLeaf) {
-        aNode->cl = (double ****)malloc(aNode->nParts * sizeof(double ***));
+        // One contiguous slab per part, laid out [pattern][category][state].
+        // They are floats if aTree->clFloat is set.
+        aNode->cl = (double **)malloc(aNode->nParts * sizeof(double *));
         if(!aNode->cl) {
             printf("Failed to allocate memory for cl.\n");
             exit(1);
         }
         for(i = 0; i < aNode->nParts; i++) {
-            aNode->cl[i] = (double ***)malloc(aNode->tree->model->parts[i]->nCat * sizeof(double **));
-            if(!aNode->cl[i]) {
-                printf("Failed to allocate memory for cl[i].\n");
+            aNode->cl[i] = p4_newCLSlab(aNode->tree, 
+                                        aNode->tree->data->parts[i]->nChar * 
+                                        aNode->tree->model->parts[i]->nCat * 
+                                        aNode->tree->model->parts[i]->dim);
+        }
+
+        // clScalers, one per pattern.  Zero means no scaling.
+        aNode->clScalers = (double **)malloc(aNode->nParts * sizeof(double *));
+        if(!aNode->clScalers) {
+            printf("Failed to allocate memory for clScalers.\n");
+            exit(1);
+        }
+        for(i = 0; i < aNode->nParts; i++) {
+            aNode->clScalers[i] = (double *)malloc(aNode->tree->data->parts[i]->nChar * sizeof(double));
+            if(!aNode->clScalers[i]) {
+                printf("Failed to allocate memory for clScalers[i].\n");
                 exit(1);
             }
-            for(j = 0; j < aNode->tree->model->parts[i]->nCat; j++) {
-                aNode->cl[i][j] = pdmatrix(aNode->tree->model->parts[i]->dim, aNode->tree->data->parts[i]->nChar);
+            for(j = 0; j < aNode->tree->data->parts[i]->nChar; j++) {
+                aNode->clScalers[i][j] = 0.0;
             }
         }
 
+        aNode->clOwn = (double **)malloc(aNode->nParts * sizeof(double *));
+        aNode->clScalersOwn = (double **)malloc(aNode->nParts * sizeof(double *));
+        if(!aNode->clOwn || !aNode->clScalersOwn) {
+            printf("Failed to allocate memory for clOwn.\n");
+            exit(1);
+        }
+        for(i = 0; i < aNode->nParts; i++) {
+            aNode->clOwn[i] = aNode->cl[i];
+            aNode->clScalersOwn[i] = aNode->clScalers[i];
+        }
+
     } else {
         aNode->cl = NULL;
+        aNode->clScalers = NULL;
+        aNode->clOwn = NULL;
+        aNode->clScalersOwn = NULL;
     }
+    aNode->twin = NULL;
 
     aNode->cl2 = NULL;
+    aNode->cl2Scalers = NULL;
     aNode->pickerDecks = NULL;
     if(aNode->isLeaf) {
         aNode->clNeedsUpdating = 0; // init
@@ -163,6 +218,9 @@ void p4_freeNode(p4_node *aNode)
     }
     //printf("    x2 freeing node %i.\n", aNode->nodeNum);
 
+    // Leave the twin with the buffers it is using, and take the others.
+    p4_unpairNode(aNode, 0);
+
     // bigPDecks
     if(aNode->bigPDecks) {
         //printf("    x2.1 nParts %i.\n", aNode->nParts);
@@ -172,15 +230,13 @@ void p4_freeNode(p4_node *aNode)
         //printf("    x2.5 nCat %i.\n", aNode->tree->model->parts[0]->nCat);
 
         for(i = 0; i < aNode->nParts; i++) {
-            for(j = 0; j < aNode->tree->model->parts[i]->nCat; j++) {
-                free_psdmatrix(aNode->bigPDecks[i][j]);
-                aNode->bigPDecks[i][j] = NULL;
-            }
-            free(aNode->bigPDecks[i]);
+            free_psddecks(aNode->bigPDecksOwn[i]);
             aNode->bigPDecks[i] = NULL;
         }
         free(aNode->bigPDecks);
+        free(aNode->bigPDecksOwn);
         aNode->bigPDecks = NULL;
+        aNode->bigPDecksOwn = NULL;
     }
 
     //printf("    x3 freeing node %i.\n", aNode->nodeNum);
@@ -188,11 +244,7 @@ void p4_freeNode(p4_node *aNode)
     // bigPDecks_1stD
     if(aNode->bigPDecks_1stD) {
         for(i = 0; i < aNode->nParts; i++) {
-            for(j = 0; j < aNode->tree->model->parts[i]->nCat; j++) {
-                free_psdmatrix(aNode->bigPDecks_1stD[i][j]);
-                aNode->bigPDecks_1stD[i][j] = NULL;
-            }
-            free(aNode->bigPDecks_1stD[i]);
+            free_psddecks(aNode->bigPDecks_1stD[i]);
             aNode->bigPDecks_1stD[i] = NULL;
         }
         free(aNode->bigPDecks_1stD);
@@ -202,11 +254,7 @@ void p4_freeNode(p4_node *aNode)
     // bigPDecks_2ndD
     if(aNode->bigPDecks_2ndD) {
         for(i = 0; i < aNode->nParts; i++) {
-            for(j = 0; j < aNode->tree->model->parts[i]->nCat; j++) {
-                free_psdmatrix(aNode->bigPDecks_2ndD[i][j]);
-                aNode->bigPDecks_2ndD[i][j] = NULL;
-            }
-            free(aNode->bigPDecks_2ndD[i]);
+            free_psddecks(aNode->bigPDecks_2ndD[i]);
             aNode->bigPDecks_2ndD[i] = NULL;
         }
         free(aNode->bigPDecks_2ndD);
@@ -216,24 +264,30 @@ void p4_freeNode(p4_node *aNode)
     // cl
     if(aNode->cl) {
         for(i = 0; i < aNode->nParts; i++) {
-            for(j = 0; j < aNode->tree->model->parts[i]->nCat; j++) {
-                free_pdmatrix(aNode->cl[i][j]);
-                aNode->cl[i][j] = NULL;
-            }
-            free(aNode->cl[i]);
+            free(aNode->clOwn[i]);
             aNode->cl[i] = NULL;
         }
         free(aNode->cl);
+        free(aNode->clOwn);
         aNode->cl = NULL;
+        aNode->clOwn = NULL;
+    }
+
+    // clScalers
+    if(aNode->clScalers) {
+        for(i = 0; i < aNode->nParts; i++) {
+            free(aNode->clScalersOwn[i]);
+            aNode->clScalers[i] = NULL;
+        }
+        free(aNode->clScalers);
+        free(aNode->clScalersOwn);
+        aNode->clScalers = NULL;
+        aNode->clScalersOwn = NULL;
     }
 		
     // cl2
     if(aNode->cl2) {
         for(i = 0; i < aNode->nParts; i++) {
-            for(j = 0; j < aNode->tree->model->parts[i]->nCat; j++) {
-                free_pdmatrix(aNode->cl2[i][j]);
-                aNode->cl2[i][j] = NULL;
-            }
             free(aNode->cl2[i]);
             aNode->cl2[i] = NULL;
         }
@@ -241,6 +295,16 @@ void p4_freeNode(p4_node *aNode)
         aNode->cl2 = NULL;
     }
 
+    // cl2Scalers, malloc'd in p4_newtSetup()
+    if(aNode->cl2Scalers) {
+        for(i = 0; i < aNode->nParts; i++) {
+            free(aNode->cl2Scalers[i]);
+            aNode->cl2Scalers[i] = NULL;
+        }
+        free(aNode->cl2Scalers);
+        aNode->cl2Scalers = NULL;
+    }
+
     // pickerDecks, malloc'd in p4_calculatePickerDecks()
     if(aNode->pickerDecks) {
         for(i = 0; i < aNode->nParts; i++) {
@@ -293,18 +357,37 @@ void p4_calculateBigPDecks(p4_node *aNode)
 }
 
 
+double p4_bigPBrLen(p4_node *aNode, int pNum, int rate)
+{
+    // The branch length that goes into the bigP of aNode for
+    // category rate, allowing for the gamma rate, the relRate, and
+    // pInvar.
+    p4_modelPart  *mp;
+    double brLen;
+	
+    mp = aNode->tree->model->parts[pNum];
+    if(mp->nGdasrvs) {
+        brLen = aNode->brLen[0] * mp->gdasrvs[aNode->gdasrvNums[pNum]]->rates[rate] * mp->relRate[0];
+    } else { // no gdasrvs, nCat must be 1
+        brLen = aNode->brLen[0] * mp->relRate[0];
+    }
+    if(mp->pInvar->val[0] != 0.0) {
+        brLen = brLen / (1.0 - mp->pInvar->val[0]);
+    }
+    return brLen;
+}
+
 void p4_calculateBigPDecksPart(p4_node *aNode, int pNum)
 {
     int cNum, rNum, rate;
     p4_modelPart  *mp;
-    p4_bigQAndEig *aQE;
-    p4_gdasrv     *aGdasrv=NULL;
+    double        *brLens;
 	
     mp = aNode->tree->model->parts[pNum];
     cNum = aNode->compNums[pNum];
     rNum = aNode->rMatrixNums[pNum];
+    p4_detachBigPDecks(aNode, pNum);
     //printf("p4_calculateBigPDecksPart()  b  pNum=%i, cNum=%i, rNum=%i\n", pNum, cNum, rNum);
-    aQE = mp->bigQAndEigThing[cNum][rNum];
 
     // This should not happen, but it might.
     if(mp->bQETneedsReset[(cNum * mp->nRMatrices) + rNum]) {
@@ -315,36 +398,13 @@ void p4_calculateBigPDecksPart(p4_node *aNode, int pNum)
     }
 			
     //printf("p4_calculateBigPDecksPart()  c\n");
-    if(mp->nGdasrvs) {
-        aGdasrv = mp->gdasrvs[aNode->gdasrvNums[pNum]];
-    }
+    // All the categories at once.  See also p4_calculateBigPDecksAllNodesPart().
+    brLens = pdvector(mp->nCat);
     for(rate = 0; rate < mp->nCat; rate++) {
-        if(mp->pInvar->val[0] == 0.0) {
-            if(mp->nGdasrvs) {
-                matrixExpTimesBranchLength(aQE->qEig,
-                                           (aNode->brLen[0] * aGdasrv->rates[rate] * mp->relRate[0]),
-                                           aNode->bigPDecks[pNum][rate]);
-            } else { // no gdasrvs, nCat must be 1
-                matrixExpTimesBranchLength(aQE->qEig,
-                                           (aNode->brLen[0] * mp->relRate[0]),
-                                           aNode->bigPDecks[pNum][rate]);
-            }
-            //dump_psdmatrix(aNode->bigPDecks[pNum][rate], 4);
-				
-        } else { // so pInvar is more than zero
-            if(mp->nGdasrvs) {
-                matrixExpTimesBranchLength(aQE->qEig,
-                                           (aNode->brLen[0] * aGdasrv->rates[rate] * mp->relRate[0]) / 
-                                           (1.0 - mp->pInvar->val[0]),
-                                           aNode->bigPDecks[pNum][rate]);
-            } else { // no gdasrvs, nCat must be 1
-                matrixExpTimesBranchLength(aQE->qEig,
-                                           (aNode->brLen[0] * mp->relRate[0]) / (1.0 - mp->pInvar->val[0]),
-                                           aNode->bigPDecks[pNum][rate]);
-            }
-        }
+        brLens[rate] = p4_bigPBrLen(aNode, pNum, rate);
     }
-    
+    p4_expBQET(aNode->tree->model, pNum, cNum, rNum, mp->nCat, brLens, aNode->bigPDecks[pNum]);
+    free(brLens);
 }
 
 
@@ -518,210 +578,372 @@ void p4_setConditionalLikelihoodsOfInteriorNode(p4_node *aNode)
 
 }
 
+// The interior cl kernels.  Each multiplies the contribution of an
+// interior child into the cl of the parent, for nPats patterns, using
+// the cl of the child, chCl.  The cl and chCl pointers point to the
+// first of those patterns.  The dim=4 kernel is unrolled, and the
+// dim=20 kernel does 4 rows at a time.  The sums are done in the same
+// order in all of them, so they all give the same numbers.
+
+static inline void p4_clMult4(double *c, double **P, double *x)
+{
+    double x0 = x[0], x1 = x[1], x2 = x[2], x3 = x[3];
+
+    c[0] *= P[0][0] * x0 + P[0][1] * x1 + P[0][2] * x2 + P[0][3] * x3;
+    c[1] *= P[1][0] * x0 + P[1][1] * x1 + P[1][2] * x2 + P[1][3] * x3;
+    c[2] *= P[2][0] * x0 + P[2][1] * x1 + P[2][2] * x2 + P[2][3] * x3;
+    c[3] *= P[3][0] * x0 + P[3][1] * x1 + P[3][2] * x2 + P[3][3] * x3;
+}
+
+static inline void p4_clMult20(double *c, double **P, double *x)
+{
+    int symb, chSymb;
+    double s0, s1, s2, s3;
+    double *r0, *r1, *r2, *r3;
+
+    for(symb = 0; symb < 20; symb += 4) {
+        r0 = P[symb];
+        r1 = P[symb + 1];
+        r2 = P[symb + 2];
+        r3 = P[symb + 3];
+        s0 = s1 = s2 = s3 = 0.0;
+        for(chSymb = 0; chSymb < 20; chSymb++) {
+            s0 += r0[chSymb] * x[chSymb];
+            s1 += r1[chSymb] * x[chSymb];
+            s2 += r2[chSymb] * x[chSymb];
+            s3 += r3[chSymb] * x[chSymb];
+        }
+        c[symb] *= s0;
+        c[symb + 1] *= s1;
+        c[symb + 2] *= s2;
+        c[symb + 3] *= s3;
+    }
+}
+
+static inline void p4_clMultGeneric(double *c, double **P, double *x, int dim)
+{
+    int symb, chSymb;
+    double sum;
+
+    for(symb = 0; symb < dim; symb++) {
+        sum = 0.0;
+        for(chSymb = 0; chSymb < dim; chSymb++) {
+            sum += P[symb][chSymb] * x[chSymb];
+        }
+        c[symb] *= sum;
+    }
+}
+
+static void p4_clInterior4(double *cl, double ***bigP, double *chCl, int nCat, int dim, int nPats)
+{
+    int i;
+
+    for(i = 0; i < nPats * nCat; i++) {
+        p4_clMult4(cl + (i * 4), bigP[i % nCat], chCl + (i * 4));
+    }
+}
+
+static void p4_clInterior20(double *cl, double ***bigP, double *chCl, int nCat, int dim, int nPats)
+{
+    int i;
+
+    for(i = 0; i < nPats * nCat; i++) {
+        p4_clMult20(cl + (i * 20), bigP[i % nCat], chCl + (i * 20));
+    }
+}
+
+static void p4_clInteriorGeneric(double *cl, double ***bigP, double *chCl, int nCat, int dim, int nPats)
+{
+    int i;
+
+    for(i = 0; i < nPats * nCat; i++) {
+        p4_clMultGeneric(cl + (i * dim), bigP[i % nCat], chCl + (i * dim), dim);
+    }
+}
+
+typedef void (*p4_clInteriorKernel)(double *cl, double ***bigP, double *chCl, int nCat, int dim, int nPats);
+
+typedef struct {
+    int dim;  // zero matches any dim
+    p4_clInteriorKernel interior;
+} p4_clKernels;
+
+// Looked up by mp->dim.  The generic kernel must be last.
+static const p4_clKernels p4_clKernelTable[] = {
+    {4, p4_clInterior4},
+    {20, p4_clInterior20},
+    {0, p4_clInteriorGeneric}
+};
+
+static p4_clInteriorKernel p4_clInteriorKernelForDim(int dim)
+{
+    const p4_clKernels *kern = p4_clKernelTable;
+
+    while(kern->dim && kern->dim != dim) {
+        kern++;
+    }
+    return kern->interior;
+}
+
+static void p4_setTipCodeLikes(double *tcl, double ***bigP, part *dp, int nCat, int dim)
+{
+    // The contribution of a leaf child for each of its possible tip
+    // codes, laid out [tipCode][category][state], so that for a
+    // pattern it lines up with the parent cl.  For a state it is a
+    // column of the bigP, for an equate it is the sum of the columns
+    // for the states that it allows, and for the n-like tip code it
+    // is exactly 1.0.
+    int tipCode, rate, symb;
+    double *t;
+
+    t = tcl;
+    for(tipCode = 0; tipCode < dp->nTipCodes - 1; tipCode++) {
+        for(rate = 0; rate < nCat; rate++) {
+            for(symb = 0; symb < dim; symb++) {
+                t[symb] = 1.0;
+            }
+            p4_clMultGeneric(t, bigP[rate], dp->tipCodeVecs + (tipCode * dim), dim);
+            t += dim;
+        }
+    }
+    for(symb = 0; symb < nCat * dim; symb++) {
+        t[symb] = 1.0;
+    }
+}
+
+static void p4_clTip(double *cl, double *tcl, int *tipCodes, int patSize, int nPats)
+{
+    // The leaf counterpart of the interior kernels, with cl and
+    // tipCodes pointing to the first of the nPats patterns.
+    int pat, i;
+    double *c, *t;
+
+    for(pat = 0; pat < nPats; pat++) {
+        c = cl + (pat * patSize);
+        t = tcl + (tipCodes[pat] * patSize);
+        for(i = 0; i < patSize; i++) {
+            c[i] *= t[i];
+        }
+    }
+}
+
+// With aTree->clFloat set, the cl's are stored as floats, to halve
+// the memory and the memory traffic.  The pointers in aNode->cl are
+// still double *, and get cast.  All the arithmetic is done in
+// double: a block of patterns is converted to double, worked on, and
+// converted back to float when it is stored.
+
+static void p4_clToDouble(double *d, float *f, int n)
+{
+    int i;
+
+    for(i = 0; i < n; i++) {
+        d[i] = (double)f[i];
+    }
+}
+
+static void p4_clToFloat(float *f, double *d, int n)
+{
+    int i;
+
+    for(i = 0; i < n; i++) {
+        f[i] = (float)d[i];
+    }
+}
+
+double *p4_newCLSlab(p4_tree *aTree, int n)
+{
+    // A cl slab of n numbers, doubles or floats depending on aTree->clFloat
+    if(aTree->clFloat) {
+        return pdaligned((n + 1) / 2);
+    }
+    return pdaligned(n);
+}
+
+size_t p4_clSlabBytes(p4_tree *aTree, int n)
+{
+    if(aTree->clFloat) {
+        return n * sizeof(float);
+    }
+    return n * sizeof(double);
+}
+
+double *p4_clPattern(p4_node *aNode, int pNum, int seqPos, int patSize, double *buf)
+{
+    // The patSize numbers of the cl of aNode for pattern seqPos, as
+    // doubles.  If the cl is stored as doubles, this points into it,
+    // and otherwise the numbers are converted into buf, which is
+    // returned.
+    if(aNode->tree->clFloat) {
+        p4_clToDouble(buf, (float *)aNode->cl[pNum] + (seqPos * patSize), patSize);
+        return buf;
+    }
+    return aNode->cl[pNum] + (seqPos * patSize);
+}
+
+double p4_clValue(p4_node *aNode, int pNum, int i)
+{
+    // One number of the cl of aNode, as a double.
+    if(aNode->tree->clFloat) {
+        return (double)((float *)aNode->cl[pNum])[i];
+    }
+    return aNode->cl[pNum][i];
+}
+
+static double *p4_clBlockBuf(int patSize)
+{
+    double *buf;
+
+    buf = malloc(CL_PATTERN_BLOCK * patSize * sizeof(double));
+    if(!buf) {
+        printf("Failed to malloc a cl block buffer.\n");
+        exit(1);
+    }
+    return buf;
+}
+
 void p4_setConditionalLikelihoodsOfInteriorNodePart(p4_node *aNode, int pNum)
 {
-    int	seqPos, symb, chSymb;
+    int	seqPos, i, blk, nBlocks, firstPat, nPats, nLeafKids, clFloat;
     p4_node *child;
-    double	sum = 0.0;
-    int rate;
-    //int j;
-    int charCode;
-    int isN = 0;
-    int dim;
+    int dim, nCat, patSize, tclSize;
+    double *cl;         // the cl for this node
+    double *tcl;        // the tip code likes, for each leaf child
+    double *t;
+    double *c, *chCl;   // the block, of this node and of a child
+    double *blockBuf, *chBuf;
+    double lnScaler, threshold;
     part   *dp;         // a data part
     p4_modelPart  *mp;  // a modelPart
+    p4_clInteriorKernel interior;
 	
     dp = aNode->tree->data->parts[pNum];
     mp = aNode->tree->model->parts[pNum];
     dim = mp->dim;
-    for(seqPos = 0; seqPos < dp->nPatterns; seqPos++) {			
-        for(rate = 0; rate < mp->nCat; rate++){
-            for(symb = 0; symb < dim; symb++) {
-                //printf("part %i, seqPos %i, rate %i, symb %i\n", pNum, seqPos, rate, symb);
-                //printf("symbolPos %i\n", symb);
-					
-                // first, do the leftChild...
-
-                if(aNode->leftChild->isLeaf) {   // If its a leaf, don't use conditionalLikelihoods of leftChild
-
-                    // The charCode is one of:
-                    // - a regular unambiguous character, from zero to dim-1
-                    // - a gap or a question mark, -1 or -2
-                    // - an equate, ie well less than zero.
-                    //     - an n, or n-like character, which would be treated like a gap
-                    //     - a less general equate, eg "y".
-
-                    charCode = dp->patterns[aNode->leftChild->seqNum][seqPos];
-                    //printf("  Got charCode = %i\n", charCode);
-                    if(charCode >= 0) {
-#if 0
-                        if(charCode >= dp->dim) {
-                            printf("0 Got charCode = %i\n", charCode);
-                            printf("part=%i, seqPos=%i, rate=%i, symb=%i\n", pNum,seqPos,rate,symb);
-                            printf("nPatterns=%i, nCat=%i, data dim=%i, sequenceNum=%i\n", 
-                                   dp->nPatterns, 
-                                   mp->nCat, 
-                                   dp->dim,
-                                   aNode->leftChild->seqNum);
-                            exit(1);
-                        }
-#endif
-                        //printf("  Setting cl[%i] to %f\n", 
-                        //symb, aNode->leftChild->bigPDecks[pNum][rate][symb][charCode]);
-                        aNode->cl[pNum][rate][symb][seqPos] = 
-                            aNode->leftChild->bigPDecks[pNum][rate][symb][charCode];
-                    }
-                    else if (charCode == GAP_CODE || charCode == QMARK_CODE) {
-                        aNode->cl[pNum][rate][symb][seqPos] = 1.0;
-                    }
-                    else if(charCode >= EQUATES_BASE && 
-                            charCode < EQUATES_BASE + dp->nEquates) {
-                        // If we get this to this point, most
-                        // usually, it will be an "n" or n-like
-                        // character (eg x).  Assume it is so unless
-                        // datapart->equates says otherwise.
-                        isN = 1;
-                        for(chSymb = 0; chSymb < dp->dim; chSymb++) {
-                            if(!dp->equates[charCode - EQUATES_BASE][chSymb]) {
-                                isN = 0;
-                                break;
-                            }
-                        }
-                        //printf("isN = %i\n", isN);
-                        if(isN) {
-                            aNode->cl[pNum][rate][symb][seqPos] = 1.0;
-                        }
-                        else {
-                            sum = 0.0;
-                            for(chSymb = 0; chSymb < dp->dim; chSymb++) {
-                                if(dp->equates[charCode - EQUATES_BASE][chSymb]) {
-                                    sum += aNode->leftChild->bigPDecks[pNum][rate][symb][chSymb];
-                                }
-                            }
-                            aNode->cl[pNum][rate][symb][seqPos] = sum;
-                        }
-                    }
+    nCat = mp->nCat;
+    patSize = nCat * dim;
+    p4_detachCL(aNode, pNum);
+    p4_countWork(&p4_nCLRecalcs, 1);
+    interior = p4_clInteriorKernelForDim(dim);
+    if(!dp->tipCodes) {
+        makeTipCodes(dp);
+    }
+    cl = aNode->cl[pNum];
+    clFloat = aNode->tree->clFloat;
+    if(clFloat) {
+        threshold = CL_SCALE_THRESHOLD_FLOAT;
+    } else {
+        threshold = CL_SCALE_THRESHOLD;
+    }
 
-                    else {
-                        printf("node %i: setConditionalLikelihoodsOfInteriorNodes:\n", aNode->nodeNum);
-                        printf("   Programming error.  This shouldn't happen\n");
-                        exit(1);
-                    }
-						
-                }
-                else {  // The leftChild is not terminal, and so use conditionalLikelihoods
-                    sum = 0.0;
-                    for(chSymb = 0; chSymb < dim; chSymb++) {
+    // A leaf child contributes one of only a few different things,
+    // one for each tip code, so those are worked out first, and the
+    // leaf contributions become lookups.
+    nLeafKids = 0;
+    for(child = aNode->leftChild; child != NULL; child = child->sibling) {
+        if(child->isLeaf) {
+            nLeafKids++;
+        }
+    }
+    tcl = NULL;
+    tclSize = dp->nTipCodes * patSize;
+    if(nLeafKids && dp->nPatterns) {
+        tcl = malloc(nLeafKids * tclSize * sizeof(double));
+        if(!tcl) {
+            printf("Failed to malloc tcl.\n");
+            exit(1);
+        }
+        t = tcl;
+        for(child = aNode->leftChild; child != NULL; child = child->sibling) {
+            if(child->isLeaf) {
+                p4_setTipCodeLikes(t, child->bigPDecks[pNum], dp, nCat, dim);
+                t += tclSize;
+            }
+        }
+    }
 
-#if 0
-                        printf("   %f = %f + (prob[%i]=%f * condLike[%i]=%f)\n",
-                               sum + (aNode->leftChild->bigPDecks[pNum][rate][symb][chSymb] * 
-                                      aNode->leftChild->cl[pNum][rate][chSymb][seqPos]),
-                               sum,
-                               chSymb,
-                               aNode->leftChild->bigPDecks[pNum][rate][symb][chSymb],
-                               chSymb,
-                               aNode->leftChild->cl[pNum][rate][chSymb][seqPos]);
+    // The cl is laid out [pattern][category][state], so all the
+    // numbers for a pattern are together.  It is done a block of
+    // patterns at a time: the block is set to 1.0, the children are
+    // multiplied into it one after another, and then it is rescaled
+    // pattern by pattern.  Blocks are independent, so they can be
+    // done in threads, and the result does not depend on the number
+    // of threads.  When this is called from within a parallel
+    // region, eg from p4_treeLogLike() doing the parts in threads, it
+    // is done in the one thread.  If the cl's are floats, the block
+    // is done in double in blockBuf, and each thread has its own.
+    nBlocks = (dp->nPatterns + CL_PATTERN_BLOCK - 1) / CL_PATTERN_BLOCK;
+#ifdef _OPENMP
+#pragma omp parallel if(p4_nThreads > 1 && dp->nPatterns >= MIN_PATTERNS_FOR_THREADS) \
+    num_threads(p4_nThreads) \
+    private(blk, firstPat, nPats, i, child, t, c, chCl, blockBuf, chBuf, seqPos, lnScaler)
 #endif
-                        sum = sum + (aNode->leftChild->bigPDecks[pNum][rate][symb][chSymb] * 
-                                     aNode->leftChild->cl[pNum][rate][chSymb][seqPos]);
-                    }		
-                    aNode->cl[pNum][rate][symb][seqPos] = sum;
-                }
-                //printf("                                  after leftChild, cl[%i] = %f\n", 
-                //	   symb, aNode->cl[pNum][rate][symb][seqPos]);
-
-
-
-                // then do the rest of the children until they run out
-                child = aNode->leftChild->sibling;
-                while(child != NULL) {
-                    if(child->isLeaf) {   // don't use conditionalLikelihoods of child
-                        //if(0) {
-                        charCode = dp->patterns[child->seqNum][seqPos];
-                        //printf("leaf sibs Got charCode = %i\n", charCode);
-                        if(charCode >= 0) {
-#if 0
-                            printf("node %i, adding cl for leaf node %i, charCode=%i, bigP=%f\n",
-                                   aNode->nodeNum,
-                                   child->nodeNum,
-                                   charCode,
-                                   child->bigPDecks[pNum][rate][symb][charCode]);
-                            printf("   cl(before)=%f   %f * %f = ", 
-                                   aNode->cl[pNum][rate][symb][seqPos],
-                                   aNode->cl[pNum][rate][symb][seqPos],
-                                   child->bigPDecks[pNum][rate][symb][charCode]);
+    {
+        blockBuf = NULL;
+        chBuf = NULL;
+        if(clFloat && nBlocks) {
+            blockBuf = p4_clBlockBuf(patSize);
+            chBuf = p4_clBlockBuf(patSize);
+        }
+#ifdef _OPENMP
+#pragma omp for schedule(static)
 #endif
-                            aNode->cl[pNum][rate][symb][seqPos] *= child->bigPDecks[pNum][rate][symb][charCode];
-                            //printf("%f\n", aNode->cl[pNum][rate][symb][seqPos]);
-                        }
-                        else if (charCode == GAP_CODE || charCode == QMARK_CODE) {
-                            //aNode->cl[pNum][rate][symb][seqPos] *= 1.0;
-                        }
-                        else if(charCode >= EQUATES_BASE && 
-                                charCode < EQUATES_BASE + dp->nEquates) {
-                            isN = 1;
-                            for(chSymb = 0; chSymb < dp->dim; chSymb++) {
-                                if(!dp->equates[charCode - EQUATES_BASE][chSymb]) {
-                                    isN = 0;
-                                    break;
-                                }
-                            }
-                            if(isN) {
-                                //printf("x isN = %i\n", isN);
-                                //aNode->cl[pNum][rate][symb][seqPos] = 1.0;
-                            }
-                            else {
-                                //printf("x isN = %i\n", isN);
-                                sum = 0.0;
-                                for(chSymb = 0; chSymb < dp->dim; chSymb++) {
-                                    if(dp->equates[charCode - EQUATES_BASE][chSymb]) {
-                                        sum = sum + child->bigPDecks[pNum][rate][symb][chSymb];
-                                    }
-                                }
-                                aNode->cl[pNum][rate][symb][seqPos] *= sum;
-                            }
-                        }
-
-                        else {
-                            printf("node %i: setConditionalLikelihoodsOfInteriorNodes:\n", aNode->nodeNum);
-                            printf("x   Programming error.  This shouldn't happen\n");
-                            exit(1);
-                        }
-                        //printf("                                  after sib, cl[%i] = %f\n", 
-                        //	   symb, aNode->cl[pNum][rate][symb][seqPos]);
-							
-						
+        for(blk = 0; blk < nBlocks; blk++) {
+            firstPat = blk * CL_PATTERN_BLOCK;
+            nPats = CL_PATTERN_BLOCK;
+            if(firstPat + nPats > dp->nPatterns) {
+                nPats = dp->nPatterns - firstPat;
+            }
+            if(clFloat) {
+                c = blockBuf;
+            } else {
+                c = cl + (firstPat * patSize);
+            }
+            for(i = 0; i < nPats * patSize; i++) {
+                c[i] = 1.0;
+            }
+            t = tcl;
+            for(child = aNode->leftChild; child != NULL; child = child->sibling) {
+                if(child->isLeaf) {
+                    p4_clTip(c, t, dp->tipCodes[child->seqNum] + firstPat, patSize, nPats);
+                    t += tclSize;
+                }
+                else {
+                    if(clFloat) {
+                        p4_clToDouble(chBuf, (float *)child->cl[pNum] + (firstPat * patSize), nPats * patSize);
+                        chCl = chBuf;
+                    } else {
+                        chCl = child->cl[pNum] + (firstPat * patSize);
                     }
-                    else {  // child is not terminal, so use conditionalLikelihoods of child
-                        sum = 0.0;
-                        for(chSymb = 0; chSymb < dim; chSymb++) {
-
-#if 0
-                            printf("   %f = %f + (prob=%f * cl=%f)\n",
-                                   sum + (child->bigPDecks[pNum][rate][symb][chSymb] * 
-                                          child->cl[pNum][rate][chSymb][seqPos]),
-                                   sum,
-                                   child->bigPDecks[pNum][rate][symb][chSymb],
-                                   child->cl[pNum][rate][chSymb][seqPos]);
-#endif
+                    interior(c, child->bigPDecks[pNum], chCl, nCat, dim, nPats);
+                }
+            }
 
-                            sum = sum + (child->bigPDecks[pNum][rate][symb][chSymb] * 
-                                         child->cl[pNum][rate][chSymb][seqPos]);
-                        }		
-#if 0					
-                        printf("                                after sibling, cl[%i] = (%f * %f) = %f\n",
-                               symb,
-                               aNode->cl[pNum][rate][symb][seqPos],
-                               sum,
-                               aNode->cl[pNum][rate][symb][seqPos] * sum);
-#endif
-                        aNode->cl[pNum][rate][symb][seqPos] *= sum;
+            // Per-pattern scaling.  The scalers are cumulative, so it is
+            // the sum of the scalers of the interior children, plus
+            // whatever scaling is done here.  The scalers are always
+            // doubles.
+            for(seqPos = firstPat; seqPos < firstPat + nPats; seqPos++) {
+                lnScaler = 0.0;
+                for(child = aNode->leftChild; child != NULL; child = child->sibling) {
+                    if(!child->isLeaf) {
+                        lnScaler += child->clScalers[pNum][seqPos];
                     }
-                    child = child->sibling;
-                } // while(child != NULL)
-            } // for symb
-        } // for rate
+                }
+                lnScaler += p4_rescaleCLPattern(c + ((seqPos - firstPat) * patSize), patSize, threshold);
+                aNode->clScalers[pNum][seqPos] = lnScaler;
+            }
+            if(clFloat) {
+                p4_clToFloat((float *)cl + (firstPat * patSize), c, nPats * patSize);
+            }
+        }
+        if(blockBuf) {
+            free(blockBuf);
+            free(chBuf);
+        }
+    }
+    if(tcl) {
+        free(tcl);
     }
 #if 0
     printf("   node %i condLikes: \n", aNode->nodeNum);
@@ -729,7 +951,7 @@ void p4_setConditionalLikelihoodsOfInteriorNodePart(p4_node *aNode, int pNum)
         for(rate = 0; rate < 2; rate++){
             printf("seqPos %i, rate %i: ", seqPos, rate);
             for(symb = 0; symb < mp->dim; symb++) {
-                printf(" %6g", aNode->cl[pNum][rate][symb][seqPos]);
+                printf(" %6g", p4_clValue(aNode, pNum, (((seqPos * nCat) + rate) * dim) + symb));
             }
             printf("\n");
         }
@@ -739,9 +961,39 @@ void p4_setConditionalLikelihoodsOfInteriorNodePart(p4_node *aNode, int pNum)
 }
 
 
+double p4_rescaleCLPattern(double *theCL, int n, double threshold)
+{
+    // theCL is the n (ie nCat * dim) numbers of a cl or cl2 for one
+    // pattern.  If the biggest is smaller than threshold, usually
+    // CL_SCALE_THRESHOLD, then multiply the lot by a power of 2 so
+    // that the biggest is between 0.5 and 1.  Multiplying by a power
+    // of 2 is exact.  Returns the log of the scaling, or zero if
+    // there was none.
+    int i, expon;
+    double maxCL, factor;
+
+    maxCL = 0.0;
+    for(i = 0; i < n; i++) {
+        if(theCL[i] > maxCL) {
+            maxCL = theCL[i];
+        }
+    }
+    if(maxCL > 0.0 && maxCL < threshold) {
+        frexp(maxCL, &expon);
+        factor = ldexp(1.0, -expon);
+        for(i = 0; i < n; i++) {
+            theCL[i] *= factor;
+        }
+        return expon * LN_2;
+    }
+    return 0.0;
+}
+
+
 void p4_initializeCL2ToRootComp(p4_node *aNode)
 {
     int	pNum, seqPos, symb, rate, dim, rootCompNum;
+    double *cl2;
     part   *dp;         // a data part
     p4_modelPart  *mp;  // a modelPart
 
@@ -752,9 +1004,11 @@ void p4_initializeCL2ToRootComp(p4_node *aNode)
         dim = mp->dim; 
         rootCompNum = aNode->tree->root->compNums[pNum];
         for(seqPos = 0; seqPos < dp->nPatterns; seqPos++) {			
+            aNode->cl2Scalers[pNum][seqPos] = 0.0;
+            cl2 = aNode->cl2[pNum] + (seqPos * mp->nCat * dim);
             for(rate = 0; rate < mp->nCat; rate++){
                 for(symb = 0; symb < dim; symb++) {
-                    aNode->cl2[pNum][rate][symb][seqPos] = mp->comps[rootCompNum]->val[symb];
+                    cl2[(rate * dim) + symb] = mp->comps[rootCompNum]->val[symb];
                 }
             }
         }
@@ -765,9 +1019,11 @@ void p4_initializeCL2ToRootComp(p4_node *aNode)
 void p4_setCL2Up(p4_node *cl2Node)
 {
     p4_node  *aNode = cl2Node->parent;
-    int	pNum, seqPos, symb, rate, dim, from;
+    int	pNum, seqPos, symb, rate, dim, from, patSize;
     //int charCode, isN;
     double sum;
+    double **bigP;
+    double *cl2, *pCl2;
     part   *dp;         // a data part
     p4_modelPart  *mp;  // a modelPart
 
@@ -789,8 +1045,6 @@ void p4_setCL2Up(p4_node *cl2Node)
 
     */
 
-    //printf("node %i cl2\n", aNode->nodeNum);
-    //dumpCl(aNode->cl2);
     //printf("node %i bigP\n", aNode->nodeNum);
     //dump_psdmatrix(aNode->bigPDecks[0][0], 4);
 
@@ -803,24 +1057,24 @@ void p4_setCL2Up(p4_node *cl2Node)
         dp = aNode->tree->data->parts[pNum];
         mp = aNode->tree->model->parts[pNum];
         dim = mp->dim;
+        patSize = mp->nCat * dim;
         for(seqPos = 0; seqPos < dp->nPatterns; seqPos++) {			
+            cl2Node->cl2Scalers[pNum][seqPos] = aNode->cl2Scalers[pNum][seqPos];
             for(rate = 0; rate < mp->nCat; rate++){
+                bigP = aNode->bigPDecks[pNum][rate];
+                cl2 = cl2Node->cl2[pNum] + (seqPos * patSize) + (rate * dim);
+                pCl2 = aNode->cl2[pNum] + (seqPos * patSize) + (rate * dim);
                 for(symb = 0; symb < dim; symb++) {
                     // aNode is not aLeaf.  So use cond likes
                     sum = 0.0;
                     for(from = 0; from < dim; from++) {
-                        sum += (aNode->bigPDecks[pNum][rate][from][symb] * 
-                                aNode->cl2[pNum][rate][from][seqPos]);
+                        sum += bigP[from][symb] * pCl2[from];
                     }
-                    cl2Node->cl2[pNum][rate][symb][seqPos] = sum;
-					
+                    cl2[symb] = sum;
                 }
             }
         }
     }
-    //printf("node %i cl2\n", cl2Node->nodeNum);
-    //dumpCl(cl2Node->cl2);
-	
 }
 
 
@@ -828,86 +1082,69 @@ void p4_setCL2Up(p4_node *cl2Node)
 
 void p4_setCL2Down(p4_node *cl2Node, p4_node *aNode)
 {
-    int	pNum, seqPos, symb, rate, dim, chSymb, charCode, isN;
-    double sum;
+    int	pNum, seqPos, patSize, firstPat, nPats;
+    double *tcl, *chBuf;
+    p4_clInteriorKernel interior;
     part   *dp;         // a data part
     p4_modelPart  *mp;  // a modelPart
 	
-    //if(cl2Node->nodeNum == 3) {
-    //	printf("node %i cl2 before p4_setCL2Down()\n", cl2Node->nodeNum);
-    //	p4_dumpCL(cl2Node->cl2);
-    //}
-
     //printf("p4_setCL2Down(), cl2Node=%i, node %i\n", cl2Node->nodeNum, aNode->nodeNum);
     for(pNum = 0; pNum < aNode->nParts; pNum++) {
         dp = aNode->tree->data->parts[pNum];
         mp = aNode->tree->model->parts[pNum];
-        dim = mp->dim;
-        for(seqPos = 0; seqPos < dp->nPatterns; seqPos++) {			
-            for(rate = 0; rate < mp->nCat; rate++){
-                for(symb = 0; symb < dim; symb++) {
-                    if(aNode->isLeaf) {
-                        charCode = dp->patterns[aNode->seqNum][seqPos];
-                        if(charCode >= 0) {
-                            cl2Node->cl2[pNum][rate][symb][seqPos] *= 
-                                aNode->bigPDecks[pNum][rate][symb][charCode];
-                        }
-                        else if(charCode == GAP_CODE || charCode == QMARK_CODE) {
-                            //cl2Node->cl2[pNum][rate][symb][seqPos] *= 1.0;
-                        }
-                        else if(charCode >= EQUATES_BASE && charCode < EQUATES_BASE + dp->nEquates) {
-                            isN = 1;
-                            for(chSymb = 0; chSymb < dp->dim; chSymb++) {
-                                if(!dp->equates[charCode - EQUATES_BASE][chSymb]) {
-                                    isN = 0;
-                                    break;
-                                }
-                            }
-                            if(isN) {
-                                //cl2Node->cl2[pNum][rate][symb][seqPos] *= 1.0;
-                            }
-                            else {
-                                sum = 0.0;
-                                for(chSymb = 0; chSymb < dp->dim; chSymb++) {
-                                    if(dp->equates[charCode - EQUATES_BASE][chSymb]) {
-                                        sum += aNode->bigPDecks[pNum][rate][symb][chSymb];
-                                    }
-                                }
-                                cl2Node->cl2[pNum][rate][symb][seqPos] *= sum;
-                            }
-                        }
-                        else {
-                            printf("p4_setCL2down().  Programming error.\n");
-                            exit(1);
-                        }
-                    }
-                    else { // aNode is not aLeaf.  So use cond likes
-                        sum = 0.0;
-                        for(chSymb = 0; chSymb < dim; chSymb++) {
-                            sum += (aNode->bigPDecks[pNum][rate][symb][chSymb] * 
-                                    aNode->cl[pNum][rate][chSymb][seqPos]);
-                        }
-                        cl2Node->cl2[pNum][rate][symb][seqPos] *= sum;
+        patSize = mp->nCat * mp->dim;
+        if(!dp->nPatterns) {
+            continue;
+        }
+        if(aNode->isLeaf) {
+            if(!dp->tipCodes) {
+                makeTipCodes(dp);
+            }
+            tcl = malloc(dp->nTipCodes * patSize * sizeof(double));
+            if(!tcl) {
+                printf("Failed to malloc tcl.\n");
+                exit(1);
+            }
+            p4_setTipCodeLikes(tcl, aNode->bigPDecks[pNum], dp, mp->nCat, mp->dim);
+            p4_clTip(cl2Node->cl2[pNum], tcl, dp->tipCodes[aNode->seqNum], patSize, dp->nPatterns);
+            free(tcl);
+        }
+        else { // aNode is not aLeaf.  So use cond likes
+            interior = p4_clInteriorKernelForDim(mp->dim);
+            if(aNode->tree->clFloat) {
+                // The cl2's are doubles, so the cl is converted a block at a time.
+                chBuf = p4_clBlockBuf(patSize);
+                for(firstPat = 0; firstPat < dp->nPatterns; firstPat += CL_PATTERN_BLOCK) {
+                    nPats = CL_PATTERN_BLOCK;
+                    if(firstPat + nPats > dp->nPatterns) {
+                        nPats = dp->nPatterns - firstPat;
                     }
+                    p4_clToDouble(chBuf, (float *)aNode->cl[pNum] + (firstPat * patSize), nPats * patSize);
+                    interior(cl2Node->cl2[pNum] + (firstPat * patSize), aNode->bigPDecks[pNum], chBuf,
+                             mp->nCat, mp->dim, nPats);
                 }
+                free(chBuf);
+            } else {
+                interior(cl2Node->cl2[pNum], aNode->bigPDecks[pNum], aNode->cl[pNum], 
+                         mp->nCat, mp->dim, dp->nPatterns);
+            }
+            for(seqPos = 0; seqPos < dp->nPatterns; seqPos++) {			
+                cl2Node->cl2Scalers[pNum][seqPos] += aNode->clScalers[pNum][seqPos];
             }
         }
     }
-    //if(cl2Node->nodeNum == 3) {
-    //	printf("node %i cl2\n", cl2Node->nodeNum);
-    //	p4_dumpCL(cl2Node->cl2);
-    //}
 }
 
 
-void p4_dumpCL(double ****theCL)
+void p4_dumpCL(double **theCL, int nCat, int dim)
 {
+    // The first pattern of the first part, category zero.
     int i, j;
 
     for(i = 0; i < 1; i++) {
         printf("    pos %i: ", i);
-        for(j = 0; j < 4; j++) {
-            printf(" %8.6f", theCL[0][0][j][i]);
+        for(j = 0; j < dim; j++) {
+            printf(" %8.6f", theCL[0][(i * nCat * dim) + j]);
         }
         printf("\n");
     }
@@ -1249,71 +1486,209 @@ void calculateObservedCharFreq(p4_node *aNode, int verbose)
 ////
 ////===========================================
 
-void p4_copyCondLikesFromNodeToNode(p4_node *nA, p4_node *nB)
+void p4_pairNodes(p4_node *nA, p4_node *nB)
 {
-    int partNum, catNum, stateNum, patNum;
-	
     /*
-      cl:
-      aNode->nParts
-      aNode->model->parts[partNum]->nCat
-      aNode->model->parts[partNum]->dim, 
-      aNode->tree->data->parts[partNum]->nChar
+      Make nA and nB twins, so that p4_copyCondLikesFromNodeToNode() and
+      p4_copyBigPDecksFromNodeToNode() between them can share buffers
+      rather than copy.  The nodes should be the same node in two trees
+      with the same data and model, as in an mcmc chain.
+    */
+
+    if(nA->twin == nB) {
+        return;
+    }
+    p4_unpairNode(nA, 1);
+    p4_unpairNode(nB, 1);
+    nA->twin = nB;
+    nB->twin = nA;
+}
+
 
-      but for the latter, we can use nPatterns
+void p4_unpairNode(p4_node *aNode, int keepData)
+{
+    int partNum, nChar;
+    p4_node *nA, *nB;
+    p4_modelPart *mp;
+    double *spare, ***spareDecks;
+
+    /*
+      Undo p4_pairNodes().  Afterwards each of the two nodes owns the
+      buffers that it uses.  The twin keeps what it has.  Where the
+      two were sharing, aNode takes the spare, and if keepData is set
+      the shared numbers are copied into it.  When aNode is about to
+      be freed keepData need not be set, and then the data and model
+      are not looked at.
     */
 
-    //printf("copyCondLikesFromNodeToNode.  nParts=%i\n", nA->nParts);
+    if(!aNode->twin) {
+        return;
+    }
+    nA = aNode;
+    nB = aNode->twin;
+
     for(partNum = 0; partNum < nA->nParts; partNum++) {
-        for(catNum = 0; catNum < nA->tree->model->parts[partNum]->nCat; catNum++) {
-            for(stateNum = 0; stateNum < nA->tree->model->parts[partNum]->dim; stateNum++) {
-                for(patNum = 0; patNum < nA->tree->data->parts[partNum]->nPatterns; patNum++) {
-                    nB->cl[partNum][catNum][stateNum][patNum] = 
-                        nA->cl[partNum][catNum][stateNum][patNum];
+        if(nA->cl) {
+            if(nA->cl[partNum] == nB->cl[partNum]) {
+                spare = (nA->clOwn[partNum] == nB->cl[partNum]) ? nB->clOwn[partNum] : nA->clOwn[partNum];
+                if(keepData) {
+                    mp = nA->tree->model->parts[partNum];
+                    nChar = nA->tree->data->parts[partNum]->nChar;
+                    memcpy(spare, nB->cl[partNum], p4_clSlabBytes(nA->tree, nChar * mp->nCat * mp->dim));
                 }
+                nA->cl[partNum] = spare;
             }
+            nA->clOwn[partNum] = nA->cl[partNum];
+            nB->clOwn[partNum] = nB->cl[partNum];
+
+            if(nA->clScalers[partNum] == nB->clScalers[partNum]) {
+                spare = (nA->clScalersOwn[partNum] == nB->clScalers[partNum]) ? 
+                    nB->clScalersOwn[partNum] : nA->clScalersOwn[partNum];
+                if(keepData) {
+                    nChar = nA->tree->data->parts[partNum]->nChar;
+                    memcpy(spare, nB->clScalers[partNum], nChar * sizeof(double));
+                }
+                nA->clScalers[partNum] = spare;
+            }
+            nA->clScalersOwn[partNum] = nA->clScalers[partNum];
+            nB->clScalersOwn[partNum] = nB->clScalers[partNum];
+        }
+
+        if(nA->bigPDecks[partNum] == nB->bigPDecks[partNum]) {
+            spareDecks = (nA->bigPDecksOwn[partNum] == nB->bigPDecks[partNum]) ? 
+                nB->bigPDecksOwn[partNum] : nA->bigPDecksOwn[partNum];
+            if(keepData) {
+                mp = nA->tree->model->parts[partNum];
+                memcpy(spareDecks[0][0], nB->bigPDecks[partNum][0][0], mp->nCat * mp->dim * mp->dim * sizeof(double));
+            }
+            nA->bigPDecks[partNum] = spareDecks;
         }
-        nB->tree->data->parts[partNum]->nPatterns = nA->tree->data->parts[partNum]->nPatterns;
+        nA->bigPDecksOwn[partNum] = nA->bigPDecks[partNum];
+        nB->bigPDecksOwn[partNum] = nB->bigPDecks[partNum];
     }
-	
+    nA->twin = NULL;
+    nB->twin = NULL;
+}
+
+
+void p4_detachCL(p4_node *aNode, int pNum)
+{
+    /*
+      Call this before writing to aNode->cl[pNum].  If the cl is shared
+      with the twin, point it at the other, spare, buffer instead.
+      The spare is stale, so it must then be written in full.
+    */
 
+    if(!aNode->twin) {
+        return;
+    }
+    if(aNode->cl[pNum] == aNode->twin->cl[pNum]) {
+        if(aNode->cl[pNum] == aNode->clOwn[pNum]) {
+            aNode->cl[pNum] = aNode->twin->clOwn[pNum];
+        } else {
+            aNode->cl[pNum] = aNode->clOwn[pNum];
+        }
+    }
+    if(aNode->clScalers[pNum] == aNode->twin->clScalers[pNum]) {
+        if(aNode->clScalers[pNum] == aNode->clScalersOwn[pNum]) {
+            aNode->clScalers[pNum] = aNode->twin->clScalersOwn[pNum];
+        } else {
+            aNode->clScalers[pNum] = aNode->clScalersOwn[pNum];
+        }
+    }
 }
 
 
-int p4_verifyCondLikesFromNodeToNode(p4_node *nA, p4_node *nB)
+void p4_detachBigPDecks(p4_node *aNode, int pNum)
 {
-    int partNum, catNum, stateNum, patNum;
-    double epsilon, diff;
+    // As p4_detachCL(), for the bigPDecks.
+    if(!aNode->twin) {
+        return;
+    }
+    if(aNode->bigPDecks[pNum] == aNode->twin->bigPDecks[pNum]) {
+        if(aNode->bigPDecks[pNum] == aNode->bigPDecksOwn[pNum]) {
+            aNode->bigPDecks[pNum] = aNode->twin->bigPDecksOwn[pNum];
+        } else {
+            aNode->bigPDecks[pNum] = aNode->bigPDecksOwn[pNum];
+        }
+    }
+}
 
-    epsilon = 1.e-15;
+
+void p4_copyCondLikesFromNodeToNode(p4_node *nA, p4_node *nB)
+{
+    int partNum, nPatterns;
+    p4_modelPart *mp;
 	
     /*
       cl:
       aNode->nParts
-      aNode->tree->model->parts[partNum]->nCat
-      aNode->tree->model-parts[partNum]->dim, 
-      aNode->tree->data->parts[partNum]->nChar
+      aNode->tree->data->parts[partNum]->nChar, but we can use nPatterns
+      aNode->model->parts[partNum]->nCat
+      aNode->model->parts[partNum]->dim
 
-      but for the latter, we can use nPatterns
+      Each part is one contiguous slab, so it can be memcpy'd.
     */
 
+    //printf("copyCondLikesFromNodeToNode.  nParts=%i\n", nA->nParts);
     for(partNum = 0; partNum < nA->nParts; partNum++) {
-        for(catNum = 0; catNum < nA->tree->model->parts[partNum]->nCat; catNum++) {
-            for(stateNum = 0; stateNum < nA->tree->model->parts[partNum]->dim; stateNum++) {
-                for(patNum = 0; patNum < nA->tree->data->parts[partNum]->nPatterns; patNum++) {
-                    if(fabs(nB->cl[partNum][catNum][stateNum][patNum] - nA->cl[partNum][catNum][stateNum][patNum]) > epsilon) {
+        mp = nA->tree->model->parts[partNum];
+        nPatterns = nA->tree->data->parts[partNum]->nPatterns;
+        if(nA->twin == nB) {
+            // Twins share buffers, so no numbers need to be moved.
+            // Only a node that was recalculated since the last copy
+            // points somewhere different.
+            nB->cl[partNum] = nA->cl[partNum];
+            nB->clScalers[partNum] = nA->clScalers[partNum];
+        } else {
+            p4_detachCL(nB, partNum);
+            memcpy(nB->cl[partNum], nA->cl[partNum], p4_clSlabBytes(nA->tree, nPatterns * mp->nCat * mp->dim));
+            memcpy(nB->clScalers[partNum], nA->clScalers[partNum], nPatterns * sizeof(double));
+            p4_countWork(&p4_nCopyBytes, p4_clSlabBytes(nA->tree, nPatterns * mp->nCat * mp->dim) + nPatterns * sizeof(double));
+        }
+        nB->tree->data->parts[partNum]->nPatterns = nPatterns;
+    }
+}
+
+
+int p4_verifyCondLikesFromNodeToNode(p4_node *nA, p4_node *nB)
+{
+    int partNum, catNum, stateNum, patNum, i, nCat, dim;
+    double epsilon, diff, clA, clB;
+
+    epsilon = 1.e-15;
+	
+    for(partNum = 0; partNum < nA->nParts; partNum++) {
+        nCat = nA->tree->model->parts[partNum]->nCat;
+        dim = nA->tree->model->parts[partNum]->dim;
+        for(patNum = 0; patNum < nA->tree->data->parts[partNum]->nPatterns; patNum++) {
+            for(catNum = 0; catNum < nCat; catNum++) {
+                for(stateNum = 0; stateNum < dim; stateNum++) {
+                    i = (((patNum * nCat) + catNum) * dim) + stateNum;
+                    clA = p4_clValue(nA, partNum, i);
+                    clB = p4_clValue(nB, partNum, i);
+                    if(fabs(clB - clA) > epsilon) {
                         printf("  p4_verifyCondLikesFromNodeToNode().  part=%i, category=%i, charState=%i, patNum=%i\n",
                                partNum, catNum, stateNum, patNum);
-                        diff = fabs(nB->cl[partNum][catNum][stateNum][patNum] - nA->cl[partNum][catNum][stateNum][patNum]);
+                        diff = fabs(clB - clA);
                         printf("  Nodes %i and %i: %g and %g.  diff = %f (%g)\n", 
                                nA->nodeNum, 
                                nB->nodeNum, 
-                               nB->cl[partNum][catNum][stateNum][patNum], 
-                               nA->cl[partNum][catNum][stateNum][patNum], diff, diff);
+                               clB, 
+                               clA, diff, diff);
                         return DIFFERENT;
                     }
                 }
             }
+            if(nB->clScalers[partNum][patNum] != nA->clScalers[partNum][patNum]) {
+                printf("  p4_verifyCondLikesFromNodeToNode().  part=%i, patNum=%i\n", partNum, patNum);
+                printf("  Nodes %i and %i: clScalers %g and %g.\n", 
+                       nA->nodeNum, 
+                       nB->nodeNum, 
+                       nB->clScalers[partNum][patNum], 
+                       nA->clScalers[partNum][patNum]);
+                return DIFFERENT;
+            }
         }
         if(nB->tree->data->parts[partNum]->nPatterns != nA->tree->data->parts[partNum]->nPatterns) {
             return DIFFERENT;
@@ -1326,7 +1701,8 @@ int p4_verifyCondLikesFromNodeToNode(p4_node *nA, p4_node *nB)
 
 void p4_copyBigPDecksFromNodeToNode(p4_node *nA, p4_node *nB)
 {
-    int partNum, catNum, i, j;
+    int partNum;
+    p4_modelPart *mp;
 	
     /*
       bigPDecks:
@@ -1334,15 +1710,18 @@ void p4_copyBigPDecksFromNodeToNode(p4_node *nA, p4_node *nB)
       aNode->tree->model->parts[partNum]->nCat
       aNode->tree->model->parts[partNum]->dim, 
       aNode->tree->model->parts[partNum]->dim 
+
+      The decks for a part are in one slab, see psddecks().
     */
 
     for(partNum = 0; partNum < nA->nParts; partNum++) {
-        for(catNum = 0; catNum < nA->tree->model->parts[partNum]->nCat; catNum++) {
-            for(i = 0; i < nA->tree->model->parts[partNum]->dim; i++) {
-                for(j = 0; j < nA->tree->model->parts[partNum]->dim; j++) {
-                    nB->bigPDecks[partNum][catNum][i][j] = nA->bigPDecks[partNum][catNum][i][j];
-                }
-            }
+        if(nA->twin == nB) {
+            nB->bigPDecks[partNum] = nA->bigPDecks[partNum];
+        } else {
+            mp = nA->tree->model->parts[partNum];
+            p4_detachBigPDecks(nB, partNum);
+            memcpy(nB->bigPDecks[partNum][0][0], nA->bigPDecks[partNum][0][0], mp->nCat * mp->dim * mp->dim * sizeof(double));
+            p4_countWork(&p4_nCopyBytes, mp->nCat * mp->dim * mp->dim * sizeof(double));
         }
     }	
 }
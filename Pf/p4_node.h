@@ -1,21 +1,41 @@
+// The number of OpenMP threads to use, see var.nThreads.  It is 1
+// unless pf is built with OpenMP.
+extern int p4_nThreads;
+// Tallies of the likelihood work, see pf.p4WorkCounters().
+extern long long p4_nCLRecalcs;
+extern long long p4_nBigPRecalcs;
+extern long long p4_nEigSolves;
+extern long long p4_nCopyBytes;
+void p4_countWork(long long *counter, long long n);
+
 p4_node *p4_newNode(int nodeNum, p4_tree *aTree, int seqNum, int isLeaf, int inTree);
 void p4_freeNode(p4_node *aNode);
 void p4_calculateBigPDecks(p4_node *aNode);
+double p4_bigPBrLen(p4_node *aNode, int pNum, int rate);
 void p4_calculateBigPDecksPart(p4_node *aNode, int pNum);
 void p4_calculateBigPDecks_1stD(p4_node *aNode);
 void p4_calculateBigPDecks_2ndD(p4_node *aNode);
 void p4_calculatePickerDecks(p4_node *aNode);
 void p4_setConditionalLikelihoodsOfInteriorNode(p4_node *aNode);
 void p4_setConditionalLikelihoodsOfInteriorNodePart(p4_node *aNode, int pNum);
+double p4_rescaleCLPattern(double *theCL, int n, double threshold);
+double *p4_newCLSlab(p4_tree *aTree, int n);
+size_t p4_clSlabBytes(p4_tree *aTree, int n);
+double *p4_clPattern(p4_node *aNode, int pNum, int seqPos, int patSize, double *buf);
+double p4_clValue(p4_node *aNode, int pNum, int i);
 void p4_initializeCL2ToRootComp(p4_node *aNode);
 void p4_setCL2Up(p4_node *cl2Node);
 void p4_setCL2Down(p4_node *cl2Node, p4_node *aNode);
-void p4_dumpCL(double ****theCL);
+void p4_dumpCL(double **theCL, int nCat, int dim);
 
 void p4_calculateExpectedComp(p4_node *aNode);
 //void p4_calculateObservedCharFreq(p4_node *aNode, int verbose);
 
 
+void p4_pairNodes(p4_node *nA, p4_node *nB);
+void p4_unpairNode(p4_node *aNode, int keepData);
+void p4_detachCL(p4_node *aNode, int pNum);
+void p4_detachBigPDecks(p4_node *aNode, int pNum);
 void p4_copyCondLikesFromNodeToNode(p4_node *nA, p4_node *nB);
 int p4_verifyCondLikesFromNodeToNode(p4_node *nA, p4_node *nB);
 void p4_copyBigPDecksFromNodeToNode(p4_node *nA, p4_node *nB);
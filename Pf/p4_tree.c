@@ -1,6 +1,7 @@
 #include "pftypes.h"
 #include "p4_tree.h"
 #include "p4_node.h"
+#include "p4_model.h"
 #include "gamma.h"    // Yang funcs, DiscreteGamma et al.
 #include "defines.h"
 #include "util.h"
@@ -12,7 +13,7 @@
 
 //static  int anInt = 0;  // for a recursion, below.
 
-p4_tree *p4_newTree(int nNodes, int nLeaves, int *preOrder, int *postOrder, double *partLikes, data *aData, p4_model *aModel)
+p4_tree *p4_newTree(int nNodes, int nLeaves, int *preOrder, int *postOrder, double *partLikes, data *aData, p4_model *aModel, int clFloat)
 {
     p4_tree	*aTree;
     int		i;
@@ -30,6 +31,7 @@ p4_tree *p4_newTree(int nNodes, int nLeaves, int *preOrder, int *postOrder, doub
     aTree->root = NULL;
     aTree->data = aData;
     aTree->model = aModel;
+    aTree->clFloat = clFloat;
     if(aData) {
         aTree->nParts = aData->nParts;
     } else {  // should never happen.
@@ -454,40 +456,17 @@ void p4_setPramsPart(p4_tree *aTree, int pNum)
 	
 
     mp = aTree->model->parts[pNum];
-    dim = mp->dim;
     for(nNum = 0; nNum < aTree->nNodes; nNum++) {
         n = aTree->nodes[nNum];
         if(n != aTree->root) {
             cNum = n->compNums[pNum];
             rNum = n->rMatrixNums[pNum];
             //printf("cNum = %i, rNum = %i\n", cNum, rNum);
-            c = mp->comps[cNum];
-            r = mp->rMatrices[rNum];
-            aQE = aTree->model->parts[pNum]->bigQAndEigThing[cNum][rNum];
             if(mp->bQETneedsReset[(cNum * mp->nRMatrices) + rNum]) {
                 //printf("Doing comp %i, rMatrix %i\n", cNum, rNum);
-                if(!aQE->bigQ) {
-                    aQE->bigQ = psdmatrix(dim);
-                    setBigQFromRMatrixDotCharFreq(aQE->bigQ, r->bigR, c->val, dim);
-                    normalizeBigQ(aQE->bigQ, c->val, dim);
-                    aQE->qEig = allocEig(dim, aQE->bigQ);
-                }
-                else {
-                    //dump_psdmatrix(r->bigR, dim);
-                    //setBigQFromRMatrixDotCharFreq(m->bigQ, theRMatrix, theCharFreq, m->dim);
-                    setBigQFromRMatrixDotCharFreq(aQE->bigQ, r->bigR, c->val, dim);
-                    //dump_psdmatrix(aQE->bigQ, dim);
-                    //normalizeBigQ(m->bigQ, theCharFreq, m->dim);
-                    normalizeBigQ(aQE->bigQ, c->val, dim);
-                    //dump_psdmatrix(aQE->bigQ, dim);
-                }
-                ret = eigensystem(aQE->qEig);
-                if(ret) {
-                    printf("There is a problem with the eigensystem.\n");
-                    exit(1);
-                }
-                mp->bQETneedsReset[(cNum * mp->nRMatrices) + rNum] = 0;  // No need to do it again for this 
-                // combination of cNum and rNum on another node.
+                // This unsets needsReset, so it is not done again for
+                // this combination of cNum and rNum on another node.
+                p4_resetBQET(aTree->model, pNum, cNum, rNum);
             }
         }
     }
@@ -752,10 +731,12 @@ void p4_setPramsPartTest(p4_tree *aTree, int pNum)
                     //dump_psdmatrix(aQE->bigQ, dim);
                 }
                 ret = eigensystem(aQE->qEig);
+                p4_countWork(&p4_nEigSolves, 1);
                 if(ret) {
                     printf("There is a problem with the eigensystem.\n");
                     exit(1);
                 }
+                aQE->eigvecProductsNeedReset = 1;
                 mp->bQETneedsReset[(cNum * mp->nRMatrices) + rNum] = 0;  // No need to do it again for this 
                 // combination of cNum and rNum on another node.
             }
@@ -783,15 +764,8 @@ void p4_setPramsPartTest(p4_tree *aTree, int pNum)
   
 #if 1
     //printf("about to set bigP\n");
-    // for each node except the root, "calculateBigPDecks()"
-    for(nNum = 0; nNum < aTree->nNodes; nNum++) {
-        if(nNum != NO_ORDER) {
-            n = aTree->nodes[nNum];
-            if(n != aTree->root) {
-                p4_calculateBigPDecksPart(n, pNum);
-            }
-        }
-    }
+    // for each node except the root
+    p4_calculateBigPDecksAllNodesPart(aTree, pNum);
 #endif
 
 #if 0
@@ -806,19 +780,56 @@ void p4_setPramsPartTest(p4_tree *aTree, int pNum)
 
 void p4_calculateAllBigPDecksAllParts(p4_tree *aTree)
 {
-    int pNum, nNum;
-    p4_node *n;
+    int pNum;
 
     for(pNum = 0; pNum < aTree->model->nParts; pNum++) {
-        for(nNum = 0; nNum < aTree->nNodes; nNum++) {
-            if(nNum != NO_ORDER) {
+        p4_calculateBigPDecksAllNodesPart(aTree, pNum);
+    }
+}
+
+void p4_calculateBigPDecksAllNodesPart(p4_tree *aTree, int pNum)
+{
+    // The bigPDecks of all the nodes except the root, for part pNum.
+    // The nodes that use the same comp and rMatrix share an
+    // eigensystem, so all their bigP's (all branches times all
+    // categories) are done together, by p4_expBQET().
+    int cNum, rNum, nNum, rate, nMats;
+    double *brLens;
+    double ***bigPs;
+    p4_modelPart *mp;
+    p4_node *n;
+
+    mp = aTree->model->parts[pNum];
+    brLens = pdvector(aTree->nNodes * mp->nCat);
+    bigPs = (double ***)malloc(aTree->nNodes * mp->nCat * sizeof(double **));
+    if(!bigPs) {
+        printf("Failed to malloc bigPs.\n");
+        exit(1);
+    }
+    for(cNum = 0; cNum < mp->nComps; cNum++) {
+        for(rNum = 0; rNum < mp->nRMatrices; rNum++) {
+            nMats = 0;
+            for(nNum = 0; nNum < aTree->nNodes; nNum++) {
                 n = aTree->nodes[nNum];
-                if(n != aTree->root) {
-                    p4_calculateBigPDecksPart(n, pNum);
+                if(n != aTree->root && n->compNums[pNum] == cNum && n->rMatrixNums[pNum] == rNum) {
+                    p4_detachBigPDecks(n, pNum);
+                    for(rate = 0; rate < mp->nCat; rate++) {
+                        brLens[nMats] = p4_bigPBrLen(n, pNum, rate);
+                        bigPs[nMats] = n->bigPDecks[pNum][rate];
+                        nMats++;
+                    }
+                }
+            }
+            if(nMats) {
+                if(mp->bQETneedsReset[(cNum * mp->nRMatrices) + rNum]) {
+                    p4_resetBQET(aTree->model, pNum, cNum, rNum);
                 }
+                p4_expBQET(aTree->model, pNum, cNum, rNum, nMats, brLens, bigPs);
             }
         }
     }
+    free(brLens);
+    free(bigPs);
 }
 
 
@@ -837,7 +848,7 @@ void p4_calculateAllBigPDecksAllParts(p4_tree *aTree)
    need updating from there down to the
    root, but not above.  This flag says
    which cl's to update.
-   It does not seem to be used except by newt.
+   It is used by newt, and by p4_updateLogLike().
 
    setPrams()
   
@@ -863,26 +874,41 @@ double p4_treeLogLike(p4_tree *aTree, int getSiteLikes)
     int    i, j, pNum;
     p4_node *aNode;
     part   *dp;
-	
-    for(j = 0; j < aTree->nNodes; j++) {
-        i = aTree->postOrder[j];
-        if(i != NO_ORDER) {
-            aNode = aTree->nodes[i];
-            if(!aNode->isLeaf) {
-                p4_setConditionalLikelihoodsOfInteriorNode(aNode);
+
+    // The parts are independent, so with more than one they can be
+    // done in threads, each part going down the whole tree.  The
+    // partLikes are added up afterwards in order, so the result does
+    // not depend on the number of threads.
+#ifdef _OPENMP
+#pragma omp parallel for if(p4_nThreads > 1 && aTree->nParts > 1) \
+    num_threads(p4_nThreads) schedule(dynamic) private(i, j, aNode, dp)
+#endif
+    for(pNum = 0; pNum < aTree->nParts; pNum++) {
+        for(j = 0; j < aTree->nNodes; j++) {
+            i = aTree->postOrder[j];
+            if(i != NO_ORDER) {
+                aNode = aTree->nodes[i];
+                if(!aNode->isLeaf) {
+                    p4_setConditionalLikelihoodsOfInteriorNodePart(aNode, pNum);
+                }
             }
         }
+        dp = aTree->data->parts[pNum];
+        aTree->partLikes[pNum] = p4_partLogLike(aTree, dp, pNum, getSiteLikes);
+    }
+    for(j = 0; j < aTree->nNodes; j++) {
+        aTree->nodes[j]->clNeedsUpdating = 0;
     }
 		
 
 #if 0
     //printf("cl for node 1\n");
-    //p4_dumpCL(aTree->nodes[1]->cl);
+    //p4_dumpCL(aTree->nodes[1]->cl, aTree->model->parts[0]->nCat, aTree->model->parts[0]->dim);
     printf("cl for node 0\n");
-    p4_dumpCL(aTree->nodes[0]->cl);
+    p4_dumpCL(aTree->nodes[0]->cl, aTree->model->parts[0]->nCat, aTree->model->parts[0]->dim);
     lnL = 0.0;
     for(i = 0; i < 4; i++) {
-        lnL += (aTree->nodes[0]->cl[0][0][i][0] * aTree->model->parts[0]->comps[0]->val[i]);
+        lnL += (aTree->nodes[0]->cl[0][i] * aTree->model->parts[0]->comps[0]->val[i]);
     }
     printf("got likelihood=%f, %g\n", lnL, lnL);
     lnL = log(lnL);
@@ -900,21 +926,127 @@ double p4_treeLogLike(p4_tree *aTree, int getSiteLikes)
 	
 
     for(pNum = 0; pNum < aTree->nParts; pNum++) {
-        dp = aTree->data->parts[pNum];
-        lnL += p4_partLogLike(aTree, dp, pNum, getSiteLikes);
-
+        lnL += aTree->partLikes[pNum];
     }
     //printf("p4_treeLogLike. got lnL = %f\n", lnL);
     aTree->logLike = lnL;
     return lnL;
 }
 
+double p4_updateLogLike(p4_tree *aTree, int *brLenChanged, int nBrLenChanged, int *flagged, int nFlagged, int pNum, int allNodes)
+{
+    /*
+      Recalculate what needs it after a change to the tree or model, and
+      return the new logLike.  This is for the mcmc, which otherwise
+      would need to do it node by node from Python.
+
+      - brLenChanged is nBrLenChanged node numbers of nodes with changed
+        branch lengths.  Those nodes get new bigPDecks for all parts,
+        and the cl's of their ancestors need updating.
+      - flagged is nFlagged node numbers of nodes that need their cl's
+        updated, eg because the topology changed.  Their ancestors need
+        updating as well.
+      - If allNodes is set, all the cl's need updating, as after a
+        change in model parameters.  In that case the bigPDecks should
+        already have been done, eg by p4_setPrams().
+
+      Cl's are recalculated for part pNum, or for all parts if pNum is
+      -1, and then so are the partLikes.  The node clNeedsUpdating flags
+      are used and left unset.
+    */
+
+    int i, j, firstPart, lastPart;
+    double lnL = 0.0;
+    p4_node *aNode;
+
+    if(pNum < 0) {
+        firstPart = 0;
+        lastPart = aTree->nParts - 1;
+    } else {
+        firstPart = pNum;
+        lastPart = pNum;
+    }
+
+    for(i = 0; i < nBrLenChanged; i++) {
+        aNode = aTree->nodes[brLenChanged[i]];
+        p4_calculateBigPDecks(aNode);
+        aNode = aNode->parent;
+        while(aNode) {
+            aNode->clNeedsUpdating = 1;
+            aNode = aNode->parent;
+        }
+    }
+    for(i = 0; i < nFlagged; i++) {
+        aNode = aTree->nodes[flagged[i]];
+        while(aNode) {
+            if(!aNode->isLeaf) {
+                aNode->clNeedsUpdating = 1;
+            }
+            aNode = aNode->parent;
+        }
+    }
+
+    // As in p4_treeLogLike(), the parts can be done in threads.
+#ifdef _OPENMP
+#pragma omp parallel for if(p4_nThreads > 1 && lastPart > firstPart) \
+    num_threads(p4_nThreads) schedule(dynamic) private(i, j, aNode)
+#endif
+    for(pNum = firstPart; pNum <= lastPart; pNum++) {
+        for(j = 0; j < aTree->nNodes; j++) {
+            i = aTree->postOrder[j];
+            if(i != NO_ORDER) {
+                aNode = aTree->nodes[i];
+                if(!aNode->isLeaf && (allNodes || aNode->clNeedsUpdating)) {
+                    p4_setConditionalLikelihoodsOfInteriorNodePart(aNode, pNum);
+                }
+            }
+        }
+        aTree->partLikes[pNum] = p4_partLogLike(aTree, aTree->data->parts[pNum], pNum, 0);
+    }
+    for(j = 0; j < aTree->nNodes; j++) {
+        aTree->nodes[j]->clNeedsUpdating = 0;
+    }
+    for(pNum = 0; pNum < aTree->nParts; pNum++) {
+        lnL += aTree->partLikes[pNum];
+    }
+    aTree->logLike = lnL;
+    return lnL;
+}
+
+double p4_logScaledSum(double scaledLike, double lnScaler, double unscaledLike)
+{
+    // Returns log(scaledLike * exp(lnScaler) + unscaledLike), without
+    // under- or overflow.  The scaledLike comes from scaled cl's, and
+    // the unscaledLike is from pInvar.  It is assumed that the sum is
+    // more than zero.
+    double a, b;
+
+    if(scaledLike <= 0.0) {
+        return log(unscaledLike);
+    }
+    a = log(scaledLike) + lnScaler;
+    if(unscaledLike <= 0.0) {
+        return a;
+    }
+    b = log(unscaledLike);
+    if(a > b) {
+        return a + log1p(exp(b - a));
+    }
+    return b + log1p(exp(a - b));
+}
+
 double p4_partLogLike(p4_tree *aTree, part *dp, int pNum, int getSiteLikes)
 {
+    double *rootCl = NULL;  // the root cl for one pattern
+    double *rootClBuf = NULL;  // for when the cl's are floats
     double lnL = 0.0;
     double like = 0.0;
+    double invarLike = 0.0;
+    double lnScaler = 0.0;
+    double logLike = 0.0;
     int    i, seqPos, rate;
     double *patternLikes = NULL;
+    double *patternLogLikes = NULL;
     double  oneMinusPInvar = 1.0;
     p4_modelPart   *mp = aTree->model->parts[pNum];
 
@@ -930,13 +1062,26 @@ double p4_partLogLike(p4_tree *aTree, part *dp, int pNum, int getSiteLikes)
                 exit(1);
             }
         }
+        if(dp->siteLogLikes == NULL) {
+            dp->siteLogLikes = malloc(dp->nChar * sizeof(double));
+            if(!dp->siteLogLikes) {
+                printf("Failed to malloc siteLogLikes.\n");
+                exit(1);
+            }
+        }
         patternLikes = malloc(dp->nPatterns * sizeof(double));
         if(!patternLikes) {
             printf("Failed to malloc patternLikes.\n");
             exit(1);
         }
+        patternLogLikes = malloc(dp->nPatterns * sizeof(double));
+        if(!patternLogLikes) {
+            printf("Failed to malloc patternLogLikes.\n");
+            exit(1);
+        }
         for(seqPos = 0; seqPos < dp->nChar; seqPos++) {
             dp->siteLikes[seqPos] = 0.0;
+            dp->siteLogLikes[seqPos] = 0.0;
         }
     }
 
@@ -947,7 +1092,7 @@ double p4_partLogLike(p4_tree *aTree, part *dp, int pNum, int getSiteLikes)
         for(rate = 0; rate < mp->nCat; rate++) {
             printf("            Rate %i: ", rate);
             for(i = 0; i < mp->dim; i++) {
-                printf("  %g", aTree->root->cl[pNum][rate][i][seqPos]);
+                printf("  %g", p4_clValue(aTree->root, pNum, (((seqPos * mp->nCat) + rate) * mp->dim) + i));
             }
             printf("\n");
         }
@@ -970,8 +1115,19 @@ double p4_partLogLike(p4_tree *aTree, part *dp, int pNum, int getSiteLikes)
         mp->freqsTimesOneMinusPInvar[rate] = oneMinusPInvar / (double)(mp->nCat);
     }
 
+    if(aTree->clFloat) {
+        rootClBuf = malloc(mp->nCat * mp->dim * sizeof(double));
+        if(!rootClBuf) {
+            printf("Failed to malloc rootClBuf.\n");
+            exit(1);
+        }
+    }
+
     for(seqPos = 0; seqPos < dp->nPatterns; seqPos++) {
         like = 0.0;
+        invarLike = 0.0;
+        lnScaler = aTree->root->clScalers[pNum][seqPos];
+        rootCl = p4_clPattern(aTree->root, pNum, seqPos, mp->nCat * mp->dim, rootClBuf);
 
         // Either do pInvar or not
         if(mp->pInvar->val[0]) { // do pInvar
@@ -979,16 +1135,16 @@ double p4_partLogLike(p4_tree *aTree, part *dp, int pNum, int getSiteLikes)
 
             for(rate = 0; rate < mp->nCat; rate++) {
                 for(i = 0; i < mp->dim; i++) {
-                    like += mp->comps[aTree->root->compNums[pNum]]->val[i] * aTree->root->cl[pNum][rate][i][seqPos];
+                    like += mp->comps[aTree->root->compNums[pNum]]->val[i] * rootCl[(rate * mp->dim) + i];
 #if 0
                     printf("a comp[%i]=%f, cl[%i]=%f;   comp*cl=%f * %f = %f; cumLike=%f\n", 
                            i,
                            mp->comps[aTree->root->compNums[pNum]]->val[i],
                            i,
-                           aTree->root->cl[pNum][rate][i][seqPos],
+                           rootCl[(rate * mp->dim) + i],
                            mp->comps[aTree->root->compNums[pNum]]->val[i],
-                           aTree->root->cl[pNum][rate][i][seqPos],
-                           mp->comps[aTree->root->compNums[pNum]]->val[i] * aTree->root->cl[pNum][rate][i][seqPos],
+                           rootCl[(rate * mp->dim) + i],
+                           mp->comps[aTree->root->compNums[pNum]]->val[i] * rootCl[(rate * mp->dim) + i],
                            like
                         );
 #endif
@@ -1010,7 +1166,7 @@ double p4_partLogLike(p4_tree *aTree, part *dp, int pNum, int getSiteLikes)
                 // The globalInvarSitesArray goes to dp->dim
                 for(i = 0; i < dp->dim; i++) {
                     if(dp->globalInvarSitesArray[i][seqPos]) {
-                        like += mp->comps[aTree->root->compNums[pNum]]->val[i] * mp->pInvar->val[0];
+                        invarLike += mp->comps[aTree->root->compNums[pNum]]->val[i] * mp->pInvar->val[0];
 #if 0
                         printf("b comp[%i]=%f, pInvar=%f;   comp*pInvar=%f * %f = %f; cumLike=%f\n", 
                                i,
@@ -1019,7 +1175,7 @@ double p4_partLogLike(p4_tree *aTree, part *dp, int pNum, int getSiteLikes)
                                mp->comps[aTree->root->compNums[pNum]]->val[i],
                                mp->pInvar->val[0],
                                mp->comps[aTree->root->compNums[pNum]]->val[i] * mp->pInvar->val[0],
-                               like
+                               invarLike
                             );
 #endif
 
@@ -1033,17 +1189,17 @@ double p4_partLogLike(p4_tree *aTree, part *dp, int pNum, int getSiteLikes)
             for(rate = 0; rate < mp->nCat; rate++) {
                 //rateLike = 0.0;
                 for(i = 0; i < mp->dim; i++) {
-                    like += mp->comps[aTree->root->compNums[pNum]]->val[i] * aTree->root->cl[pNum][rate][i][seqPos];
-                    //rateLike += mp->comps[aTree->root->compNums[pNum]]->val[i] * aTree->root->cl[pNum][rate][i][seqPos];
+                    like += mp->comps[aTree->root->compNums[pNum]]->val[i] * rootCl[(rate * mp->dim) + i];
+                    //rateLike += mp->comps[aTree->root->compNums[pNum]]->val[i] * rootCl[(rate * mp->dim) + i];
 #if 0
                     printf("d comp[%i]=%f, cl[%i]=%f;   comp*cl=%f * %f = %f; cumLike=%f\n", 
                            i,
                            mp->comps[aTree->root->compNums[pNum]]->val[i],
                            i,
-                           aTree->root->cl[pNum][rate][i][seqPos],
+                           rootCl[(rate * mp->dim) + i],
                            mp->comps[aTree->root->compNums[pNum]]->val[i],
-                           aTree->root->cl[pNum][rate][i][seqPos],
-                           mp->comps[aTree->root->compNums[pNum]]->val[i] * aTree->root->cl[pNum][rate][i][seqPos],
+                           rootCl[(rate * mp->dim) + i],
+                           mp->comps[aTree->root->compNums[pNum]]->val[i] * rootCl[(rate * mp->dim) + i],
                            like
                         );
 #endif
@@ -1059,7 +1215,7 @@ double p4_partLogLike(p4_tree *aTree, part *dp, int pNum, int getSiteLikes)
             }
         }
 
-        if(like <= 0.0) {
+        if(like + invarLike <= 0.0) {
             //printf("p4_tree.c: treeLogLike: (zero-based) seqPos %i, site like %g\n", seqPos, like);
             //printf("    Its <= 0.0, so returning -1.0e99\n");
             //printf("    dp->globalInvarSitesVec[%i] = %i\n", seqPos, dp->globalInvarSitesVec[seqPos]);
@@ -1067,21 +1223,38 @@ double p4_partLogLike(p4_tree *aTree, part *dp, int pNum, int getSiteLikes)
                 if(patternLikes) {
                     free(patternLikes);
                     patternLikes = NULL;
+                    free(patternLogLikes);
+                    patternLogLikes = NULL;
                     printf("Site likelihoods requested, but one likelihood is zero or less,\n");
                     printf("    so getSiteLikes is not on.\n");
                 }
             }
 
+            if(rootClBuf) {
+                free(rootClBuf);
+            }
             return -1.0e99;
         }
         //printf("finished rate cats: seqPos = %i, lnL = %7.4f, like = %7.4f\n", seqPos, lnL, like);
         //printf("site=%i, like=%f, logLike=%f\n", seqPos, like, log(like));
-        lnL = lnL + (dp->patternCounts[seqPos] * log(like));
+        // The cl at the root is scaled by lnScaler, but invarLike is not.
+        if(lnScaler == 0.0) {
+            like += invarLike;
+            logLike = log(like);
+        }
+        else {
+            logLike = p4_logScaledSum(like, lnScaler, invarLike);
+            like = exp(logLike);
+        }
+        lnL = lnL + (dp->patternCounts[seqPos] * logLike);
         //printf("  seqPos %i   patCount %i  like %f  logLike %f  timesPatCount %f     total lnL %f\n",
         //		seqPos, dp->patternCounts[seqPos], like, log(like), 
         //		dp->patternCounts[seqPos] * log(like), lnL);
 		
-        if(getSiteLikes) patternLikes[seqPos] = like;
+        if(getSiteLikes) {
+            patternLikes[seqPos] = like;
+            patternLogLikes[seqPos] = logLike;
+        }
     }
 
     if(0) {
@@ -1097,8 +1270,14 @@ double p4_partLogLike(p4_tree *aTree, part *dp, int pNum, int getSiteLikes)
         // I have the pattern likes, so now figure out the siteLikes, using sequencePositionPatternIndex
         for(seqPos = 0; seqPos < dp->nChar; seqPos++) {
             dp->siteLikes[seqPos] = patternLikes[dp->sequencePositionPatternIndex[seqPos]];
+            dp->siteLogLikes[seqPos] = patternLogLikes[dp->sequencePositionPatternIndex[seqPos]];
         }
         free(patternLikes);
+        free(patternLogLikes);
+    }
+
+    if(rootClBuf) {
+        free(rootClBuf);
     }
 
     //printf("p4_tree.p4_partLogLike().  %.6f\n", lnL);
@@ -1111,10 +1290,16 @@ double p4_partLogLike(p4_tree *aTree, part *dp, int pNum, int getSiteLikes)
 
 double p4_partLogLikeSiteRates(p4_tree *aTree, part *dp, int pNum, int getSiteLikes, double *siteRates, int *gammaCats, double *work)
 {
+    double *rootCl = NULL;  // the root cl for one pattern
+    double *rootClBuf = NULL;  // for when the cl's are floats
     double lnL = 0.0;
     double like = 0.0;
+    double invarLike = 0.0;
+    double lnScaler = 0.0;
+    double logLike = 0.0;
     int    i, seqPos, rate;
     double *patternLikes = NULL;
+    double *patternLogLikes = NULL;
     double  oneMinusPInvar = 1.0;
     double  temp;
     double *tempRates = NULL;
@@ -1131,13 +1316,26 @@ double p4_partLogLikeSiteRates(p4_tree *aTree, part *dp, int pNum, int getSiteLi
                 exit(1);
             }
         }
+        if(dp->siteLogLikes == NULL) {
+            dp->siteLogLikes = malloc(dp->nChar * sizeof(double));
+            if(!dp->siteLogLikes) {
+                printf("Failed to malloc siteLogLikes.\n");
+                exit(1);
+            }
+        }
         patternLikes = malloc(dp->nPatterns * sizeof(double));
         if(!patternLikes) {
             printf("Failed to malloc patternLikes.\n");
             exit(1);
         }
+        patternLogLikes = malloc(dp->nPatterns * sizeof(double));
+        if(!patternLogLikes) {
+            printf("Failed to malloc patternLogLikes.\n");
+            exit(1);
+        }
         for(seqPos = 0; seqPos < dp->nChar; seqPos++) {
             dp->siteLikes[seqPos] = 0.0;
+            dp->siteLogLikes[seqPos] = 0.0;
         }
     }
 
@@ -1164,7 +1362,7 @@ double p4_partLogLikeSiteRates(p4_tree *aTree, part *dp, int pNum, int getSiteLi
         for(rate = 0; rate < mp->nCat; rate++) {
             printf("            Rate %i: ", rate);
             for(i = 0; i < mp->dim; i++) {
-                printf("  %g", aTree->root->cl[pNum][rate][i][seqPos]);
+                printf("  %g", p4_clValue(aTree->root, pNum, (((seqPos * mp->nCat) + rate) * mp->dim) + i));
             }
             printf("\n");
         }
@@ -1187,8 +1385,19 @@ double p4_partLogLikeSiteRates(p4_tree *aTree, part *dp, int pNum, int getSiteLi
         mp->freqsTimesOneMinusPInvar[rate] = oneMinusPInvar / (double)(mp->nCat);
     }
 
+    if(aTree->clFloat) {
+        rootClBuf = malloc(mp->nCat * mp->dim * sizeof(double));
+        if(!rootClBuf) {
+            printf("Failed to malloc rootClBuf.\n");
+            exit(1);
+        }
+    }
+
     for(seqPos = 0; seqPos < dp->nPatterns; seqPos++) {
         like = 0.0;
+        invarLike = 0.0;
+        lnScaler = aTree->root->clScalers[pNum][seqPos];
+        rootCl = p4_clPattern(aTree->root, pNum, seqPos, mp->nCat * mp->dim, rootClBuf);
 
         // Either do pInvar or not
         if(mp->pInvar->val[0]) { // do pInvar
@@ -1197,17 +1406,17 @@ double p4_partLogLikeSiteRates(p4_tree *aTree, part *dp, int pNum, int getSiteLi
             for(rate = 0; rate < mp->nCat; rate++) {
                 work[rate] = 0.0;
                 for(i = 0; i < mp->dim; i++) {
-                    like += mp->comps[aTree->root->compNums[pNum]]->val[i] * aTree->root->cl[pNum][rate][i][seqPos];
-                    work[rate] += mp->comps[aTree->root->compNums[pNum]]->val[i] * aTree->root->cl[pNum][rate][i][seqPos];
+                    like += mp->comps[aTree->root->compNums[pNum]]->val[i] * rootCl[(rate * mp->dim) + i];
+                    work[rate] += mp->comps[aTree->root->compNums[pNum]]->val[i] * rootCl[(rate * mp->dim) + i];
 #if 0
                     printf("a comp[%i]=%f, cl[%i]=%f;   comp*cl=%f * %f = %f; cumLike=%f\n", 
                            i,
                            mp->comps[aTree->root->compNums[pNum]]->val[i],
                            i,
-                           aTree->root->cl[pNum][rate][i][seqPos],
+                           rootCl[(rate * mp->dim) + i],
                            mp->comps[aTree->root->compNums[pNum]]->val[i],
-                           aTree->root->cl[pNum][rate][i][seqPos],
-                           mp->comps[aTree->root->compNums[pNum]]->val[i] * aTree->root->cl[pNum][rate][i][seqPos],
+                           rootCl[(rate * mp->dim) + i],
+                           mp->comps[aTree->root->compNums[pNum]]->val[i] * rootCl[(rate * mp->dim) + i],
                            like
                         );
 #endif
@@ -1229,7 +1438,7 @@ double p4_partLogLikeSiteRates(p4_tree *aTree, part *dp, int pNum, int getSiteLi
                 // The globalInvarSitesArray goes to dp->dim
                 for(i = 0; i < dp->dim; i++) {
                     if(dp->globalInvarSitesArray[i][seqPos]) {
-                        like += mp->comps[aTree->root->compNums[pNum]]->val[i] * mp->pInvar->val[0];
+                        invarLike += mp->comps[aTree->root->compNums[pNum]]->val[i] * mp->pInvar->val[0];
 #if 0
                         printf("b comp[%i]=%f, pInvar=%f;   comp*pInvar=%f * %f = %f; cumLike=%f\n", 
                                i,
@@ -1238,7 +1447,7 @@ double p4_partLogLikeSiteRates(p4_tree *aTree, part *dp, int pNum, int getSiteLi
                                mp->comps[aTree->root->compNums[pNum]]->val[i],
                                mp->pInvar->val[0],
                                mp->comps[aTree->root->compNums[pNum]]->val[i] * mp->pInvar->val[0],
-                               like
+                               invarLike
                             );
 #endif
 
@@ -1252,17 +1461,17 @@ double p4_partLogLikeSiteRates(p4_tree *aTree, part *dp, int pNum, int getSiteLi
             for(rate = 0; rate < mp->nCat; rate++) {
                 work[rate] = 0.0;
                 for(i = 0; i < mp->dim; i++) {
-                    like += mp->comps[aTree->root->compNums[pNum]]->val[i] * aTree->root->cl[pNum][rate][i][seqPos];
-                    work[rate] += mp->comps[aTree->root->compNums[pNum]]->val[i] * aTree->root->cl[pNum][rate][i][seqPos];
+                    like += mp->comps[aTree->root->compNums[pNum]]->val[i] * rootCl[(rate * mp->dim) + i];
+                    work[rate] += mp->comps[aTree->root->compNums[pNum]]->val[i] * rootCl[(rate * mp->dim) + i];
 #if 0
                     printf("d comp[%i]=%f, cl[%i]=%f;   comp*cl=%f * %f = %f; cumLike=%f\n", 
                            i,
                            mp->comps[aTree->root->compNums[pNum]]->val[i],
                            i,
-                           aTree->root->cl[pNum][rate][i][seqPos],
+                           rootCl[(rate * mp->dim) + i],
                            mp->comps[aTree->root->compNums[pNum]]->val[i],
-                           aTree->root->cl[pNum][rate][i][seqPos],
-                           mp->comps[aTree->root->compNums[pNum]]->val[i] * aTree->root->cl[pNum][rate][i][seqPos],
+                           rootCl[(rate * mp->dim) + i],
+                           mp->comps[aTree->root->compNums[pNum]]->val[i] * rootCl[(rate * mp->dim) + i],
                            like
                         );
 #endif
@@ -1276,7 +1485,7 @@ double p4_partLogLikeSiteRates(p4_tree *aTree, part *dp, int pNum, int getSiteLi
             }
         }
 
-        if(like <= 0.0) {
+        if(like + invarLike <= 0.0) {
             //printf("p4_tree.c: treeLogLike: (zero-based) seqPos %i, site like %g\n", seqPos, like);
             //printf("    Its <= 0.0, so returning -1.0e99\n");
             //printf("    dp->globalInvarSitesVec[%i] = %i\n", seqPos, dp->globalInvarSitesVec[seqPos]);
@@ -1284,21 +1493,45 @@ double p4_partLogLikeSiteRates(p4_tree *aTree, part *dp, int pNum, int getSiteLi
                 if(patternLikes) {
                     free(patternLikes);
                     patternLikes = NULL;
+                    free(patternLogLikes);
+                    patternLogLikes = NULL;
                     printf("Site likelihoods requested, but one likelihood is zero or less,\n");
                     printf("    so getSiteLikes is not on.\n");
                 }
             }
 
+            if(rootClBuf) {
+                free(rootClBuf);
+            }
             return -1.0e99;
         }
         //printf("finished rate cats: seqPos = %i, lnL = %7.4f, like = %7.4f\n", seqPos, lnL, like);
         //printf("site=%i, like=%f, logLike=%f\n", seqPos, like, log(like));
-        lnL = lnL + (dp->patternCounts[seqPos] * log(like));
+        // The cl at the root is scaled by lnScaler, but invarLike is
+        // not.  The like used for the site rate below needs to be on
+        // the same scale as work[].
+        if(lnScaler == 0.0) {
+            like += invarLike;
+            logLike = log(like);
+        }
+        else {
+            logLike = p4_logScaledSum(like, lnScaler, invarLike);
+            like = exp(logLike - lnScaler);
+        }
+        lnL = lnL + (dp->patternCounts[seqPos] * logLike);
         //printf("  seqPos %i   patCount %i  like %f  logLike %f  timesPatCount %f     total lnL %f\n",
         //		seqPos, dp->patternCounts[seqPos], like, log(like), 
         //		dp->patternCounts[seqPos] * log(like), lnL);
 		
-        if(getSiteLikes) patternLikes[seqPos] = like;
+        if(getSiteLikes) {
+            if(lnScaler == 0.0) {
+                patternLikes[seqPos] = like;
+            }
+            else {
+                patternLikes[seqPos] = exp(logLike);
+            }
+            patternLogLikes[seqPos] = logLike;
+        }
 
         biggest = work[0];
         tempCategories[seqPos] = 0;
@@ -1331,8 +1564,10 @@ double p4_partLogLikeSiteRates(p4_tree *aTree, part *dp, int pNum, int getSiteLi
         // I have the pattern likes, so now figure out the siteLikes, using sequencePositionPatternIndex
         for(seqPos = 0; seqPos < dp->nChar; seqPos++) {
             dp->siteLikes[seqPos] = patternLikes[dp->sequencePositionPatternIndex[seqPos]];
+            dp->siteLogLikes[seqPos] = patternLogLikes[dp->sequencePositionPatternIndex[seqPos]];
         }
         free(patternLikes);
+        free(patternLogLikes);
     }
 
     //for(seqPos = 0; seqPos < 10; seqPos++) {
@@ -1346,6 +1581,9 @@ double p4_partLogLikeSiteRates(p4_tree *aTree, part *dp, int pNum, int getSiteLi
     }
     free(tempRates);
     free(tempCategories);
+    if(rootClBuf) {
+        free(rootClBuf);
+    }
 	
 
     //printf("p4_tree.p4_partLogLikeWinningGammaCats().  %f\n", lnL);
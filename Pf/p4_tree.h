@@ -1,15 +1,18 @@
 #include "Python.h"
 
 // p4_tree.c
-p4_tree *p4_newTree(int nNodes, int nLeaves, int *preOrder, int *postOrder, double *partLikes, data *aData, p4_model *aModel);
+p4_tree *p4_newTree(int nNodes, int nLeaves, int *preOrder, int *postOrder, double *partLikes, data *aData, p4_model *aModel, int clFloat);
 void p4_freeTree(p4_tree *aTree);
 void p4_dumpTree(p4_tree *aTree);
 void p4_setPrams(p4_tree *aTree);
 void p4_setPramsPart(p4_tree *aTree, int pNum);
 void p4_calculateAllBigPDecksAllParts(p4_tree *aTree);
+void p4_calculateBigPDecksAllNodesPart(p4_tree *aTree, int pNum);
 void p4_setPramsTest(p4_tree *aTree);
 void p4_setPramsPartTest(p4_tree *aTree, int pNum);
 double p4_treeLogLike(p4_tree *aTree, int getSiteLikes);
+double p4_updateLogLike(p4_tree *aTree, int *brLenChanged, int nBrLenChanged, int *flagged, int nFlagged, int pNum, int allNodes);
+double p4_logScaledSum(double scaledLike, double lnScaler, double unscaledLike);
 double p4_partLogLike(p4_tree *aTree, part *p, int partNum, int getSiteLikes);
 double p4_partLogLikeSiteRates(p4_tree *aTree, part *p, int pNum, int getSiteLikes, double *siteRates, int *gammaCats, double *work);
 void p4_getPreOrderNodeNumsAbove(p4_tree *aTree, p4_node *aNode);
@@ -32,6 +35,7 @@ void BracketMinimum(double *pA, double *pB, double (*func)(double []), double mi
 
 // p4_treeSim.c
 void p4_simulate(p4_tree *t, p4_tree *refTree);
+PyObject *p4_simulatePatternCounts(p4_tree *t, int pNum, int nReps);
 void p4_drawAncState(p4_tree *t, int partNum, int seqPos);
 void p4_drawAncStateP(p4_tree *t, int partNum, int seqPos, int *draw);
 PyObject *p4_expectedCompositionCounts(p4_tree *t, int partNum);
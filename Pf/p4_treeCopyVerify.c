@@ -4,6 +4,8 @@
 #include "p4_treeCopyVerify.h"
 #include "p4_node.h"
 
+// The nodes of the two trees are made twins (see p4_pairNodes()), and
+// after that copying is only pointer assignment.
 void p4_copyCondLikes(p4_tree *treeA, p4_tree *treeB, int doAll)
 {
     int   i, j;
@@ -15,6 +17,7 @@ void p4_copyCondLikes(p4_tree *treeA, p4_tree *treeB, int doAll)
             nA = treeA->nodes[i];
             if(!(nA->isLeaf)) {
                 nB = treeB->nodes[i];
+                p4_pairNodes(nA, nB);
                 if(doAll) {
                     p4_copyCondLikesFromNodeToNode(nA, nB);
                 }
@@ -45,6 +48,7 @@ void p4_copyBigPDecks(p4_tree *treeA, p4_tree *treeB, int doAll)
             nA = treeA->nodes[i];
             if(nA != treeA->root) {
                 nB = treeB->nodes[i];
+                p4_pairNodes(nA, nB);
                 //if(doAll) {
                 p4_copyBigPDecksFromNodeToNode(nA, nB);
                 //}
@@ -147,6 +151,7 @@ void p4_copyModelPrams(p4_tree *treeA, p4_tree *treeB)
                                 bV[i] = aV[i];
                             }
                         }
+                        bBQE->eigvecProductsNeedReset = 1;
                     }
                 }
             }
@@ -17,19 +17,31 @@ void p4_newtSetup(p4_tree *aTree)
     if(!aTree->root->cl2) {
         for(nNum = 0; nNum < aTree->nNodes; nNum++) {
             aNode = aTree->nodes[nNum];
-            aNode->cl2 = (double ****)malloc(aNode->nParts * sizeof(double ***));
+            // Laid out like cl, [pattern][category][state]
+            aNode->cl2 = (double **)malloc(aNode->nParts * sizeof(double *));
             if(!aNode->cl2) {
                 printf("Failed to allocate memory for cl2.\n");
                 exit(1);
             }
             for(i = 0; i < aNode->nParts; i++) {
-                aNode->cl2[i] = (double ***)malloc(aNode->tree->model->parts[i]->nCat * sizeof(double **));
-                if(!aNode->cl2[i]) {
-                    printf("Failed to allocate memory for cl2[i].\n");
+                aNode->cl2[i] = pdaligned(aNode->tree->data->parts[i]->nChar * 
+                                          aNode->tree->model->parts[i]->nCat * 
+                                          aNode->tree->model->parts[i]->dim);
+            }
+
+            aNode->cl2Scalers = (double **)malloc(aNode->nParts * sizeof(double *));
+            if(!aNode->cl2Scalers) {
+                printf("Failed to allocate memory for cl2Scalers.\n");
+                exit(1);
+            }
+            for(i = 0; i < aNode->nParts; i++) {
+                aNode->cl2Scalers[i] = (double *)malloc(aNode->tree->data->parts[i]->nChar * sizeof(double));
+                if(!aNode->cl2Scalers[i]) {
+                    printf("Failed to allocate memory for cl2Scalers[i].\n");
                     exit(1);
                 }
-                for(j = 0; j < aNode->tree->model->parts[i]->nCat; j++) {
-                    aNode->cl2[i][j] = pdmatrix(aNode->tree->model->parts[i]->dim, aNode->tree->data->parts[i]->nChar);
+                for(j = 0; j < aNode->tree->data->parts[i]->nChar; j++) {
+                    aNode->cl2Scalers[i][j] = 0.0;
                 }
             }
         }
@@ -46,14 +58,7 @@ void p4_newtSetup(p4_tree *aTree)
                 exit(1);
             }
             for(i = 0; i < aNode->nParts; i++) {
-                aNode->bigPDecks_1stD[i] = (double ***)malloc(aNode->tree->model->parts[i]->nCat * sizeof(double **));
-                if(!aNode->bigPDecks_1stD[i]) {
-                    printf("Failed to allocate memory for bigPDecks_1stD[i].\n");
-                    exit(1);
-                }
-                for(j = 0; j < aNode->tree->model->parts[i]->nCat; j++) {
-                    aNode->bigPDecks_1stD[i][j] = psdmatrix(aNode->tree->model->parts[i]->dim);
-                }
+                aNode->bigPDecks_1stD[i] = psddecks(aNode->tree->model->parts[i]->nCat, aNode->tree->model->parts[i]->dim);
             }
 
             aNode->bigPDecks_2ndD = (double ****)malloc(aNode->nParts * sizeof(double ***));
@@ -62,14 +67,7 @@ void p4_newtSetup(p4_tree *aTree)
                 exit(1);
             }
             for(i = 0; i < aNode->nParts; i++) {
-                aNode->bigPDecks_2ndD[i] = (double ***)malloc(aNode->tree->model->parts[i]->nCat * sizeof(double **));
-                if(!aNode->bigPDecks_2ndD[i]) {
-                    printf("Failed to allocate memory for bigPDecks_2ndD[i].\n");
-                    exit(1);
-                }
-                for(j = 0; j < aNode->tree->model->parts[i]->nCat; j++) {
-                    aNode->bigPDecks_2ndD[i][j] = psdmatrix(aNode->tree->model->parts[i]->dim);
-                }
+                aNode->bigPDecks_2ndD[i] = psddecks(aNode->tree->model->parts[i]->nCat, aNode->tree->model->parts[i]->dim);
             }
         }
     }
@@ -80,9 +78,17 @@ void p4_newtAround(p4_tree *aTree, double epsilon, double likeDelta)
 {
     int nNum, i, j;
     double thisLogLike, previousLogLike, diff;
+    double badNewtDiff = -1.0e-5;  // changed from -1.0e-6, which seemed to be too sensitive.
     p4_node *aNode, *p;
 
     previousLogLike = p4_treeLogLike(aTree, 0);
+    if(aTree->clFloat) {
+        // Float cl's make the logLike noisy, at float precision.
+        badNewtDiff = -1.0e-7 * fabs(previousLogLike);
+        if(badNewtDiff > -1.0e-3) {
+            badNewtDiff = -1.0e-3;
+        }
+    }
     //printf("Starting p4_newtAround with logLike=%f, epsilon=%f, likeDelta=%g\n", previousLogLike, epsilon, likeDelta);
     //getFirstLike = 1;
     //newtCount = 0;
@@ -181,7 +187,7 @@ void p4_newtAround(p4_tree *aTree, double epsilon, double likeDelta)
         printf("%i p4_newtAround() logLike = %f, diff=%f, newtCount=%i\n", i, thisLogLike, diff, newtCount);
         //exit(1);
 #endif
-        if(diff < -1.0e-5) {  // changed from -1.0e-6, which seemed to be too sensitive.
+        if(diff < badNewtDiff) {
             printf("Bad newt.  Likelihood decreased.  Diff=%f (%g) ...continuing anyway\n", diff, diff);
             //for(nNum = 0; nNum < aTree->nNodes; nNum++) {
             //	aNode = aTree->nodes[nNum];
@@ -210,6 +216,10 @@ void p4_newtNode(p4_node *aNode, double epsilon)
     double lnL, firstD, secondD;
     double like, first, second;    // for each rate
     double likeS, firstS, secondS; // S for site
+    double lnScaler, invarScale, firstRatio;
+    double *cl = NULL, *cl2 = NULL;   // for one pattern
+    double *clBuf = NULL;  // for when the cl's are floats
+    int clBufSize;
     //double oneMinusPInvar;
     double temp2;
     int from, to, charCode;
@@ -228,6 +238,21 @@ void p4_newtNode(p4_node *aNode, double epsilon)
 	
     like = first = second = 0.0;
 
+    if(aNode->tree->clFloat && !aNode->isLeaf) {
+        clBufSize = 0;
+        for(pNum = 0; pNum < aNode->nParts; pNum++) {
+            mp = aNode->tree->model->parts[pNum];
+            if(mp->nCat * mp->dim > clBufSize) {
+                clBufSize = mp->nCat * mp->dim;
+            }
+        }
+        clBuf = malloc(clBufSize * sizeof(double));
+        if(!clBuf) {
+            printf("Failed to malloc clBuf.\n");
+            exit(1);
+        }
+    }
+
 #if 0
     // only for debugging
     startingLike = p4_treeLogLike(aNode->tree, 0);
@@ -276,6 +301,18 @@ void p4_newtNode(p4_node *aNode, double epsilon)
                 //printf("        seqPos %i\n", seqPos);
                 likeS = firstS = secondS = 0.0;
 
+                // The like, first, and second for this site are all
+                // scaled by the cl2 scaler of aNode, and the cl
+                // scaler if it is not a leaf.  That does not matter
+                // for first / like and second / like, but the
+                // invariant site contribution below is not scaled.
+                cl2 = aNode->cl2[pNum] + (seqPos * mp->nCat * mp->dim);
+                lnScaler = aNode->cl2Scalers[pNum][seqPos];
+                if(!aNode->isLeaf) {
+                    cl = p4_clPattern(aNode, pNum, seqPos, mp->nCat * mp->dim, clBuf);
+                    lnScaler += aNode->clScalers[pNum][seqPos];
+                }
+
                 // Either do pInvar or not
                 if(mp->pInvar->val[0]) { // do pInvar
                     // First deal with the contribution due to the possibility that it is a variable site
@@ -286,7 +323,7 @@ void p4_newtNode(p4_node *aNode, double epsilon)
                             if(charCode >= 0) {
                                 for(from = 0; from < mp->dim; from++) {
                                     // Using temp2 speeds things up a tiny, tiny bit.
-                                    temp2 = aNode->cl2[pNum][rate][from][seqPos];
+                                    temp2 = cl2[(rate * mp->dim) + from];
                                     like += temp2 * aNode->bigPDecks[pNum][rate][from][charCode];
                                     first += temp2 * aNode->bigPDecks_1stD[pNum][rate][from][charCode];
                                     second += temp2 * aNode->bigPDecks_2ndD[pNum][rate][from][charCode];
@@ -295,7 +332,7 @@ void p4_newtNode(p4_node *aNode, double epsilon)
 
                             else if (charCode == GAP_CODE || charCode == QMARK_CODE) {
                                 for(from = 0; from < mp->dim; from++) {
-                                    temp2 = aNode->cl2[pNum][rate][from][seqPos];
+                                    temp2 = cl2[(rate * mp->dim) + from];
                                     like += temp2;
                                     // If it was just likes, I would
                                     // not have to do this following
@@ -325,7 +362,7 @@ void p4_newtNode(p4_node *aNode, double epsilon)
                                 //printf("isN = %i\n", isN);
                                 if(isN) {
                                     for(from = 0; from < mp->dim; from++) {
-                                        temp2 = aNode->cl2[pNum][rate][from][seqPos];
+                                        temp2 = cl2[(rate * mp->dim) + from];
                                         for(to = 0; to < mp->dim; to++) {
                                             like += temp2 * aNode->bigPDecks[pNum][rate][from][to];
                                             first += temp2 * aNode->bigPDecks_1stD[pNum][rate][from][to];
@@ -335,7 +372,7 @@ void p4_newtNode(p4_node *aNode, double epsilon)
                                 }
                                 else {
                                     for(from = 0; from < mp->dim; from++) {
-                                        temp2 = aNode->cl2[pNum][rate][from][seqPos];
+                                        temp2 = cl2[(rate * mp->dim) + from];
                                         for(to = 0; to < dp->dim; to++) {
                                             if(dp->equates[charCode - EQUATES_BASE][to]) {
                                                 like += temp2 * aNode->bigPDecks[pNum][rate][from][to];
@@ -359,7 +396,7 @@ void p4_newtNode(p4_node *aNode, double epsilon)
                         else {  // its not a leaf, use cond likes
                             for(from = 0; from < mp->dim; from++) {
                                 for(to = 0; to < mp->dim; to++) {
-                                    temp2 = aNode->cl2[pNum][rate][from][seqPos] * aNode->cl[pNum][rate][to][seqPos];
+                                    temp2 = cl2[(rate * mp->dim) + from] * cl[(rate * mp->dim) + to];
                                     like += temp2 * aNode->bigPDecks[pNum][rate][from][to];
                                     first += temp2 * aNode->bigPDecks_1stD[pNum][rate][from][to];
                                     second += temp2 * aNode->bigPDecks_2ndD[pNum][rate][from][to];
@@ -381,9 +418,22 @@ void p4_newtNode(p4_node *aNode, double epsilon)
                     // Now deal with the invariant site contribution
                     if(dp->globalInvarSitesVec[seqPos] > 0) {  // ie its an invar site
                         //printf("a non-varied sited.\n");
+                        // Put the invariant contribution on the same
+                        // scale.  If it is so much bigger that the
+                        // scaling would overflow, then first/like is
+                        // zero anyway, so capping it is ok.
+                        invarScale = 1.0;
+                        if(lnScaler != 0.0) {
+                            if(lnScaler < -700.0) {
+                                invarScale = exp(700.0);
+                            }
+                            else {
+                                invarScale = exp(-lnScaler);
+                            }
+                        }
                         for(from = 0; from < mp->dim; from++) {
                             if(dp->globalInvarSitesArray[from][seqPos]) {
-                                likeS += mp->comps[aNode->tree->root->compNums[pNum]]->val[from] * mp->pInvar->val[0];
+                                likeS += mp->comps[aNode->tree->root->compNums[pNum]]->val[from] * mp->pInvar->val[0] * invarScale;
                                 // first and second are not affected
                             }
                         }
@@ -399,7 +449,7 @@ void p4_newtNode(p4_node *aNode, double epsilon)
                             if(charCode >= 0) {
                                 for(from = 0; from < mp->dim; from++) {
                                     // Using temp2 speeds things up a tiny, tiny bit.
-                                    temp2 = aNode->cl2[pNum][rate][from][seqPos];
+                                    temp2 = cl2[(rate * mp->dim) + from];
                                     like += temp2 * aNode->bigPDecks[pNum][rate][from][charCode];
                                     first += temp2 * aNode->bigPDecks_1stD[pNum][rate][from][charCode];
                                     second += temp2 * aNode->bigPDecks_2ndD[pNum][rate][from][charCode];
@@ -408,7 +458,7 @@ void p4_newtNode(p4_node *aNode, double epsilon)
 
                             else if (charCode == GAP_CODE || charCode == QMARK_CODE) {
                                 for(from = 0; from < mp->dim; from++) {
-                                    temp2 = aNode->cl2[pNum][rate][from][seqPos];
+                                    temp2 = cl2[(rate * mp->dim) + from];
                                     like += temp2;
                                     // If it was just likes, I would
                                     // not have to do this following
@@ -438,7 +488,7 @@ void p4_newtNode(p4_node *aNode, double epsilon)
                                 //printf("isN = %i\n", isN);
                                 if(isN) {
                                     for(from = 0; from < mp->dim; from++) {
-                                        temp2 = aNode->cl2[pNum][rate][from][seqPos];
+                                        temp2 = cl2[(rate * mp->dim) + from];
                                         for(to = 0; to < mp->dim; to++) {
                                             like += temp2 * aNode->bigPDecks[pNum][rate][from][to];
                                             first += temp2 * aNode->bigPDecks_1stD[pNum][rate][from][to];
@@ -448,7 +498,7 @@ void p4_newtNode(p4_node *aNode, double epsilon)
                                 }
                                 else {
                                     for(from = 0; from < mp->dim; from++) {
-                                        temp2 = aNode->cl2[pNum][rate][from][seqPos];
+                                        temp2 = cl2[(rate * mp->dim) + from];
                                         for(to = 0; to < dp->dim; to++) {
                                             if(dp->equates[charCode - EQUATES_BASE][to]) {
                                                 like += temp2 * aNode->bigPDecks[pNum][rate][from][to];
@@ -472,7 +522,7 @@ void p4_newtNode(p4_node *aNode, double epsilon)
                         else {  // aNode is not aLeaf, so use aNode->cl
                             for(from = 0; from < mp->dim; from++) {
                                 for(to = 0; to < mp->dim; to++) {
-                                    temp2 = aNode->cl2[pNum][rate][from][seqPos] * aNode->cl[pNum][rate][to][seqPos];
+                                    temp2 = cl2[(rate * mp->dim) + from] * cl[(rate * mp->dim) + to];
                                     like += temp2 * aNode->bigPDecks[pNum][rate][from][to];
                                     first += temp2 * aNode->bigPDecks_1stD[pNum][rate][from][to];
                                     second += temp2 * aNode->bigPDecks_2ndD[pNum][rate][from][to];
@@ -505,17 +555,26 @@ void p4_newtNode(p4_node *aNode, double epsilon)
                     //lnL += dp->patternCounts[seqPos] * log(like);  // not really needed
                     //firstD += dp->patternCounts[seqPos] * (first / like);
                     //secondD += dp->patternCounts[seqPos] * ((second * like - first * first) / (like * like));
-                    lnL += dp->patternCounts[seqPos] * log(likeS);  // not really needed
+                    lnL += dp->patternCounts[seqPos] * (log(likeS) + lnScaler);  // not really needed
                     firstD += dp->patternCounts[seqPos] * (firstS / likeS);
-                    secondD += dp->patternCounts[seqPos] * ((secondS * likeS - firstS * firstS) / (likeS * likeS));
+                    if(lnScaler == 0.0) {
+                        secondD += dp->patternCounts[seqPos] * ((secondS * likeS - firstS * firstS) / (likeS * likeS));
+                    }
+                    else {
+                        // The same, but without squaring likeS, which
+                        // might be big if the invariant contribution
+                        // was scaled up.
+                        firstRatio = firstS / likeS;
+                        secondD += dp->patternCounts[seqPos] * ((secondS / likeS) - (firstRatio * firstRatio));
+                    }
                 }
             }  // for(seqPos)
 				
         } // for(pNum)
 #if 0
         printf("x    end newtNode(nodeNum %i)  logLike=%f \n", aNode->nodeNum, lnL);
-        //p4_dumpCL(aNode->cl);
-        //p4_dumpCL(aNode->cl2);
+        //p4_dumpCL(aNode->cl, aNode->tree->model->parts[0]->nCat, aNode->tree->model->parts[0]->dim);
+        //p4_dumpCL(aNode->cl2, aNode->tree->model->parts[0]->nCat, aNode->tree->model->parts[0]->dim);
         //break;
         exit(1);
 #endif
@@ -578,6 +637,9 @@ void p4_newtNode(p4_node *aNode, double epsilon)
     // it is needed for cl calcs and for brent.  We do not need to
     // worry about bigP_1stD and bigP_2ndD.
     p4_calculateBigPDecks(aNode);
+    if(clBuf) {
+        free(clBuf);
+    }
     //printf("      newtNode finishing. node %i, did %i loops, brLen=%f\n", aNode->nodeNum, iter + 1, aNode->brLen[0]);
     //printf(" %i", iter + 1);
 }
@@ -585,6 +647,7 @@ void p4_newtNode(p4_node *aNode, double epsilon)
 void p4_setNodeCL2(p4_tree *aTree, p4_node *aNode)
 {
     p4_node *p;
+    int pNum, seqPos, patSize;
 
     if(aNode->parent == aTree->root) {
         //printf("      initializing node %i\n", aNode->nodeNum);
@@ -604,6 +667,13 @@ void p4_setNodeCL2(p4_tree *aTree, p4_node *aNode)
         p = p->sibling;
     }
 
+    for(pNum = 0; pNum < aNode->nParts; pNum++) {
+        patSize = aTree->model->parts[pNum]->nCat * aTree->model->parts[pNum]->dim;
+        for(seqPos = 0; seqPos < aTree->data->parts[pNum]->nPatterns; seqPos++) {
+            aNode->cl2Scalers[pNum][seqPos] += p4_rescaleCLPattern(aNode->cl2[pNum] + (seqPos * patSize), patSize, CL_SCALE_THRESHOLD);
+        }
+    }
+
     aNode->cl2NeedsUpdating = 0;
 }
 
@@ -585,6 +585,127 @@ void p4_simulate(p4_tree *t, p4_tree *refTree)
     //printf("p4_treeSim.c: finished simulate\n");
 }
 
+
+PyObject *p4_simulatePatternCounts(p4_tree *t, int pNum, int nReps)
+{
+    /*
+      Simulate nReps alignments for part pNum, and return the pattern
+      counts of each, as a list of dicts.  The keys of the dicts are
+      the patterns, as bytes of char state numbers (not symbols), in
+      the order of the sequences, and the values are the counts.
+
+      The bigP and picker decks are made once, for all the reps.  It
+      goes site by site, rather than node by node as p4_simulate()
+      does, and only a site's worth of states is kept, so the
+      sequences are never made.  The model is as in p4_simulate()
+      without a refTree -- equal cat freqs, pInvar sites keep the root
+      state, and the root state is drawn from the root comp.
+    */
+
+    int rep, seqPos, nNum, tOrd, k, l, simCat, parentState, isInvar, nTax;
+    double theRanDoubleUpToOne;
+    double *rootPicker;
+    int *states;
+    char *key;
+    long count;
+    part *dp = t->data->parts[pNum];
+    p4_modelPart *mp = t->model->parts[pNum];
+    p4_node *n;
+    double *rootComp;
+    PyObject *theList, *theDict, *keyObj, *val, *newVal;
+
+    for(nNum = 0; nNum < t->nNodes; nNum++) {
+        n = t->nodes[nNum];
+        if(n != t->root) {
+            p4_calculateBigPDecks(n);
+            p4_calculatePickerDecks(n); // allocates if needed
+        }
+    }
+
+    nTax = dp->nTax;
+    rootPicker = pdvector(mp->dim);
+    states = pivector(t->nNodes);
+    key = malloc(nTax * sizeof(char));
+    if(!key) {
+        printf("p4_simulatePatternCounts().  Failed to allocate key.\n");
+        exit(1);
+    }
+    for(k = 0; k < nTax; k++) {
+        key[k] = 0;
+    }
+    rootComp = mp->comps[t->root->compNums[pNum]]->val;
+    rootPicker[0] = rootComp[0];
+    for(k = 1; k < mp->dim - 1; k++) {
+        rootPicker[k] = rootPicker[k - 1] + rootComp[k];
+    }
+    rootPicker[mp->dim - 1] = 1.0;
+
+    theList = PyList_New(nReps);
+    for(rep = 0; rep < nReps; rep++) {
+        theDict = PyDict_New();
+        for(seqPos = 0; seqPos < dp->nChar; seqPos++) {
+            if(mp->nCat > 1) {
+                simCat = (int)floor(((double)mp->nCat) * ranDoubleUpToOne());
+            } else {
+                simCat = 0;
+            }
+            theRanDoubleUpToOne = ranDoubleUpToOne();
+            for(k = 0; k < mp->dim; k++) {
+                if(theRanDoubleUpToOne < rootPicker[k]) {
+                    states[t->root->nodeNum] = k;
+                    break;
+                }
+            }
+            isInvar = 0;
+            if(mp->pInvar->val[0] > 0.0 && ranDoubleUpToOne() < mp->pInvar->val[0]) {
+                isInvar = 1;
+            }
+
+            for(nNum = 0; nNum < t->nNodes; nNum++) {
+                tOrd = t->preOrder[nNum];
+                if(tOrd != NO_ORDER) {
+                    n = t->nodes[tOrd];
+                    if(n != t->root) {
+                        parentState = states[n->parent->nodeNum];
+                        if(isInvar) {
+                            states[tOrd] = parentState;
+                        } else {
+                            theRanDoubleUpToOne = ranDoubleUpToOne();
+                            for(l = 0; l < mp->dim; l++) {
+                                if(theRanDoubleUpToOne < n->pickerDecks[pNum][simCat][parentState][l]) {
+                                    states[tOrd] = l;
+                                    break;
+                                }
+                            }
+                        }
+                        if(n->isLeaf) {
+                            key[n->seqNum] = (char)states[tOrd];
+                        }
+                    }
+                }
+            }
+
+            keyObj = PyBytes_FromStringAndSize(key, nTax);
+            val = PyDict_GetItem(theDict, keyObj);  // borrowed
+            if(val) {
+                count = PyLong_AsLong(val) + 1;
+            } else {
+                count = 1;
+            }
+            newVal = PyLong_FromLong(count);
+            PyDict_SetItem(theDict, keyObj, newVal);
+            Py_DECREF(newVal);
+            Py_DECREF(keyObj);
+        }
+        PyList_SET_ITEM(theList, rep, theDict);  // steals the reference
+    }
+
+    free(rootPicker);
+    free(states);
+    free(key);
+    return theList;
+}
+
 //==================================================
 //==================================================
 
@@ -597,6 +718,7 @@ void p4_drawAncState(p4_tree *t, int partNum, int seqPos)
     int gotIt, isInvar;
     //double diff;
     double sLike, sLikeC;
+    double lnScaler, invarScale;
     double mySum, mySum2, myPInvarSum;
     int i,k;
     //int j;
@@ -645,7 +767,7 @@ void p4_drawAncState(p4_tree *t, int partNum, int seqPos)
     // for(catNum = 0; catNum < mp->nCat; catNum++) {
     //     printf("cat %i:", catNum);
     //     for(chStNum = 0; chStNum < dp->dim; chStNum++) {
-    //         printf(" %8.5f", t->root->cl[partNum][catNum][chStNum][patNum]);
+    //         printf(" %8.5f", t->root->cl[partNum][(((patNum * mp->nCat) + catNum) * mp->dim) + chStNum]);
     //     }
     //     printf("\n");
     // }
@@ -670,7 +792,7 @@ void p4_drawAncState(p4_tree *t, int partNum, int seqPos)
     for(catNum = 0; catNum < mp->nCat; catNum++) {
         for(chStNum = 0; chStNum < dp->dim; chStNum++) {
             sLikeC = mp->comps[t->root->compNums[partNum]]->val[chStNum] * 
-                t->root->cl[partNum][catNum][chStNum][patNum];
+                p4_clValue(t->root, partNum, (((patNum * mp->nCat) + catNum) * mp->dim) + chStNum);
             sLikeC *= mp->freqsTimesOneMinusPInvar[catNum];
             sLike += sLikeC;
             mp->ancStPicker[i] = sLike;
@@ -680,9 +802,21 @@ void p4_drawAncState(p4_tree *t, int partNum, int seqPos)
         }
     }
     if(mp->pInvar->val[0]) { // do pInvar
+        // The root cl is scaled by the root clScaler, but the pInvar
+        // contribution is not, so put it on the same scale.
+        invarScale = 1.0;
+        lnScaler = t->root->clScalers[partNum][patNum];
+        if(lnScaler != 0.0) {
+            if(lnScaler < -700.0) {
+                invarScale = exp(700.0);
+            }
+            else {
+                invarScale = exp(-lnScaler);
+            }
+        }
         for(chStNum = 0; chStNum < dp->dim; chStNum++) {
             if(dp->globalInvarSitesArray[chStNum][patNum]) {
-                sLikeC = mp->comps[t->root->compNums[partNum]]->val[chStNum] * mp->pInvar->val[0];
+                sLikeC = mp->comps[t->root->compNums[partNum]]->val[chStNum] * mp->pInvar->val[0] * invarScale;
                 sLike += sLikeC;
                 mp->ancStPicker[i] = sLike;
             }
@@ -708,7 +842,7 @@ void p4_drawAncState(p4_tree *t, int partNum, int seqPos)
             mySum = 0.0;
             for(catNum = 0; catNum < mp->nCat; catNum++) {
                 sLikeC = mp->comps[t->root->compNums[partNum]]->val[chStNum] * 
-                    t->root->cl[partNum][catNum][chStNum][patNum];
+                    p4_clValue(t->root, partNum, (((patNum * mp->nCat) + catNum) * mp->dim) + chStNum);
                 sLikeC *= mp->freqsTimesOneMinusPInvar[catNum];
                 //printf("chStNum %2i, catNum %i, sLikeC = %10.8f \n", chStNum, catNum, sLikeC);
                 mySum += sLikeC;
@@ -737,7 +871,7 @@ void p4_drawAncState(p4_tree *t, int partNum, int seqPos)
             mySum = 0.0;
             for(chStNum = 0; chStNum < dp->dim; chStNum++) {
                 sLikeC = mp->comps[t->root->compNums[partNum]]->val[chStNum] * 
-                    t->root->cl[partNum][catNum][chStNum][patNum];
+                    p4_clValue(t->root, partNum, (((patNum * mp->nCat) + catNum) * mp->dim) + chStNum);
                 sLikeC *= mp->freqsTimesOneMinusPInvar[catNum];
                 //printf("chStNum %2i, catNum %i, sLikeC = %10.8f \n", chStNum, catNum, sLikeC);
                 mySum += sLikeC;
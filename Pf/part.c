@@ -42,6 +42,7 @@ part *newPart(int nTax, int nChar, char *equateSymbols, int nEquates, char *symb
     thePart->patternCounts = malloc(nChar * sizeof(int));
     thePart->sequencePositionPatternIndex = malloc(nChar * sizeof(int));
     thePart->nPatterns = 0;
+    thePart->patternCountsBootstrapped = 0;
     thePart->sequences = pimatrix(nTax, nChar);
     thePart->nEquates = nEquates;
     if(nEquates > 0) {
@@ -69,9 +70,13 @@ part *newPart(int nTax, int nChar, char *equateSymbols, int nEquates, char *symb
     //	thePart->siteLikes[i] = 0.0;
     //}
     thePart->siteLikes = NULL;
+    thePart->siteLogLikes = NULL;
 
     thePart->taxList = malloc(thePart->nTax * sizeof(int));
     thePart->simCats = NULL;
+    thePart->tipCodes = NULL;
+    thePart->nTipCodes = 0;
+    thePart->tipCodeVecs = NULL;
     thePart->drawAncStResults = NULL;
     return thePart;
 
@@ -104,6 +109,9 @@ void freePart(part *thePart)
     thePart->globalInvarSitesArray = NULL;
     if(thePart->siteLikes) free(thePart->siteLikes);
     thePart->siteLikes = NULL;
+    if(thePart->siteLogLikes) free(thePart->siteLogLikes);
+    thePart->siteLogLikes = NULL;
+    freeTipCodes(thePart);
 	
     free(thePart->taxList);
     thePart->taxList = NULL;
@@ -346,8 +354,12 @@ void makePatterns(part *thePart)
         printf("makePatterns: no memory allocated for sequencePositionPatternIndex!  bad!\n");
         return;
     }
+
+    // The tip codes are made from the patterns, so they are stale now.
+    freeTipCodes(thePart);
 		
     // alloc and init
+    thePart->patternCountsBootstrapped = 0;
     for(i = 0; i < thePart->nChar; i++) {
         thePart->patternCounts[i] = 0;
         thePart->sequencePositionPatternIndex[i] = 0;
@@ -448,6 +460,107 @@ void makePatterns(part *thePart)
 }
 
 
+void resetPatternCounts(part *thePart)
+{
+    // Put the patternCounts back the way makePatterns() left them,
+    // eg after bootstrapPatternCounts().
+    int i;
+
+    for(i = 0; i < thePart->nPatterns; i++) {
+        thePart->patternCounts[i] = 0;
+    }
+    for(i = 0; i < thePart->nChar; i++) {
+        thePart->patternCounts[thePart->sequencePositionPatternIndex[i]]++;
+    }
+    thePart->patternCountsBootstrapped = 0;
+}
+
+
+
+void makeTipCodes(part *thePart)
+{
+    // Recode the patterns of each sequence into a compact table of
+    // tip codes, so that the likelihood calculation does not need to
+    // decode character codes or equates.  The tip codes are
+    //   - the states, 0 to dim-1
+    //   - the equates, dim to dim + nEquates - 1
+    //   - the last one, for gaps, question marks, and n-like equates.
+    // The tipCodeVecs give dim numbers for each tip code, 1.0 for the
+    // states that the tip code allows and 0.0 for the rest.  These
+    // are made when they are first needed, and thrown away when the
+    // patterns change.
+    int seqNum, pat, i, charCode, isN;
+    int nLikeCode;
+    int *eqCodes;
+    double *vec;
+
+    freeTipCodes(thePart);
+    if(thePart->nPatterns <= 0) {
+        return;
+    }
+    thePart->nTipCodes = thePart->dim + thePart->nEquates + 1;
+    nLikeCode = thePart->nTipCodes - 1;
+    thePart->tipCodeVecs = pdvector(thePart->nTipCodes * thePart->dim);
+    for(i = 0; i < thePart->nTipCodes * thePart->dim; i++) {
+        thePart->tipCodeVecs[i] = 0.0;
+    }
+
+    eqCodes = pivector(thePart->nEquates + 1);
+    for(i = 0; i < thePart->dim; i++) {
+        thePart->tipCodeVecs[(i * thePart->dim) + i] = 1.0;
+    }
+    for(charCode = 0; charCode < thePart->nEquates; charCode++) {
+        vec = thePart->tipCodeVecs + ((thePart->dim + charCode) * thePart->dim);
+        isN = 1;
+        for(i = 0; i < thePart->dim; i++) {
+            if(thePart->equates[charCode][i]) {
+                vec[i] = 1.0;
+            } else {
+                isN = 0;
+            }
+        }
+        if(isN) {
+            eqCodes[charCode] = nLikeCode;
+        } else {
+            eqCodes[charCode] = thePart->dim + charCode;
+        }
+    }
+    vec = thePart->tipCodeVecs + (nLikeCode * thePart->dim);
+    for(i = 0; i < thePart->dim; i++) {
+        vec[i] = 1.0;
+    }
+
+    thePart->tipCodes = pimatrix(thePart->nTax, thePart->nPatterns);
+    for(seqNum = 0; seqNum < thePart->nTax; seqNum++) {
+        for(pat = 0; pat < thePart->nPatterns; pat++) {
+            charCode = thePart->patterns[seqNum][pat];
+            if(charCode >= 0) {
+                thePart->tipCodes[seqNum][pat] = charCode;
+            }
+            else if(charCode >= EQUATES_BASE && charCode < EQUATES_BASE + thePart->nEquates) {
+                thePart->tipCodes[seqNum][pat] = eqCodes[charCode - EQUATES_BASE];
+            }
+            else if(charCode == GAP_CODE || charCode == QMARK_CODE || charCode == N_LIKE) {
+                thePart->tipCodes[seqNum][pat] = nLikeCode;
+            }
+            else {
+                printf("makeTipCodes: seqNum %i, pattern %i: bad charCode %i\n", seqNum, pat, charCode);
+                exit(1);
+            }
+        }
+    }
+    free(eqCodes);
+}
+
+void freeTipCodes(part *thePart)
+{
+    if(thePart->tipCodes) free_pimatrix(thePart->tipCodes);
+    thePart->tipCodes = NULL;
+    if(thePart->tipCodeVecs) free(thePart->tipCodeVecs);
+    thePart->tipCodeVecs = NULL;
+    thePart->nTipCodes = 0;
+}
+
 
 void dumpPart(part *thePart)
 {
@@ -706,7 +819,10 @@ double unconstrainedLogLike(part *thePart)
 
     dsum = 0.0;
     for(i = 0; i < thePart->nPatterns; i++) {
-        dsum = dsum + (thePart->patternCounts[i] * log((double)(thePart->patternCounts[i])));
+        // A pattern can have a count of zero after bootstrapPatternCounts().
+        if(thePart->patternCounts[i]) {
+            dsum = dsum + (thePart->patternCounts[i] * log((double)(thePart->patternCounts[i])));
+        }
     }
     dsum = dsum - (thePart->nChar * log((double)(thePart->nChar)));
 	
@@ -852,10 +968,13 @@ void partCompositionC(part *thePart, double *theComp)
 
 // This can get comps of single, or multiple, sequences, as well
 // as the whole lot.  Which sequences are measured is determined
-// by the thePart->taxList vector.
+// by the thePart->taxList vector.  If the patternCounts are from
+// bootstrapPatternCounts(), it counts the patterns by those counts,
+// rather than the sequences.
 
 {
     int      i, j, k;
+    int      nSlots, theCode, weight;
     int      hasEquates = 0;
     double  *symbolFreq = NULL;
     double  *equateFreq = NULL;
@@ -916,19 +1035,29 @@ void partCompositionC(part *thePart, double *theComp)
                 equateFreq[k] = 0.0;
             }
 
-            for(j = 0; j < thePart->nChar; j++) {
-                //printf("%4i", thePart->sequences[i][j]);
-                if(thePart->sequences[seqNum][j] >= 0) {
-                    symbolFreq[thePart->sequences[seqNum][j]] = 
-                        symbolFreq[thePart->sequences[seqNum][j]] + 1.0;
+            if(thePart->patternCountsBootstrapped) {
+                nSlots = thePart->nPatterns;
+            } else {
+                nSlots = thePart->nChar;
+            }
+            for(j = 0; j < nSlots; j++) {
+                if(thePart->patternCountsBootstrapped) {
+                    theCode = thePart->patterns[seqNum][j];
+                    weight = thePart->patternCounts[j];
+                } else {
+                    theCode = thePart->sequences[seqNum][j];
+                    weight = 1;
+                }
+                //printf("%4i", theCode);
+                if(theCode >= 0) {
+                    symbolFreq[theCode] = symbolFreq[theCode] + (double)weight;
                 }
-                else if(thePart->sequences[seqNum][j] == QMARK_CODE || 
-                        thePart->sequences[seqNum][j] ==  GAP_CODE) {
-                    nGapsMissings += 1;
+                else if(theCode == QMARK_CODE || theCode ==  GAP_CODE) {
+                    nGapsMissings += weight;
                 }
                 else { // an equate
-                    //printf("(%i)", thePart->sequences[i][j] - EQUATES_BASE);
-                    equateFreq[thePart->sequences[seqNum][j] - EQUATES_BASE] += 1.0; 
+                    //printf("(%i)", theCode - EQUATES_BASE);
+                    equateFreq[theCode - EQUATES_BASE] += (double)weight; 
                 }
             }
             nSites = thePart->nChar - nGapsMissings;
@@ -3,6 +3,9 @@ void freePart(part *thePart);
 void pokeSequences(part *thePart, char *theString);
 void pokeEquatesTable(part *thePart, char *theString);
 void makePatterns(part *thePart);
+void resetPatternCounts(part *thePart);
+void makeTipCodes(part *thePart);
+void freeTipCodes(part *thePart);
 void dumpPart(part *thePart);
 PyObject *singleSequenceBaseCounts(part *thePart, int sequenceNum);
 PyObject *symbolSequences(part *thePart);
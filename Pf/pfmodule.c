@@ -22,6 +22,10 @@
 #include "p4_model.h"
 #include "p4_treeCopyVerify.h"
 #include "logDet.h"
+#include "p4_eigCache.h"
+#ifdef _OPENMP
+#include <omp.h>
+#endif
 
 
 static PyObject *
@@ -102,6 +106,35 @@ pf_bootstrapData(PyObject *self, PyObject *args)
     return Py_None;
 }
 
+static PyObject *
+pf_bootstrapPatternCounts(PyObject *self, PyObject *args)
+{
+    part    *thePart;
+    const gsl_rng  *gsl_rng;
+
+    if(!PyArg_ParseTuple(args, "ll", &thePart, &gsl_rng)) {
+        printf("Error pf_bootstrapPatternCounts: couldn't parse tuple\n");
+        return NULL;
+    }
+    bootstrapPatternCounts(thePart, gsl_rng);
+    Py_INCREF(Py_None);
+    return Py_None;
+}
+
+static PyObject *
+pf_resetPatternCounts(PyObject *self, PyObject *args)
+{
+    part    *thePart;
+
+    if(!PyArg_ParseTuple(args, "l", &thePart)) {
+        printf("Error pf_resetPatternCounts: couldn't parse tuple\n");
+        return NULL;
+    }
+    resetPatternCounts(thePart);
+    Py_INCREF(Py_None);
+    return Py_None;
+}
+
 
 
 
@@ -392,6 +425,25 @@ pf_getSiteLikes(PyObject *self, PyObject *args)
     return thePyList;
 }
 
+static PyObject *
+pf_getSiteLogLikes(PyObject *self, PyObject *args)
+{
+    part	 *thePart;
+    PyObject *thePyList;
+    int       i;
+	
+    if(!PyArg_ParseTuple(args, "l", &thePart)) {
+        printf("Error pf_getSiteLogLikes: couldn't parse tuple\n");
+        return NULL;
+    }
+
+    thePyList = PyList_New(thePart->nChar);
+    for(i = 0; i < thePart->nChar; i++) {
+        PyList_SetItem(thePyList, i, PyFloat_FromDouble(thePart->siteLogLikes[i]));
+    }
+    return thePyList;
+}
+
 static PyObject *
 pf_getSiteRates(PyObject *self, PyObject *args)
 {
@@ -466,6 +518,82 @@ pf_calcEmpiricalRMatrixViaMatrixLog(PyObject *self, PyObject *args)
 // #######################################################
 
 
+static PyObject *
+pf_setNThreads(PyObject *self, PyObject *args)
+{
+    int nThreads;
+	
+    if(!PyArg_ParseTuple(args, "i", &nThreads)) {
+        printf("Error pf_setNThreads: couldn't parse tuple\n");
+        return NULL;
+    }
+#ifdef _OPENMP
+    // Threads are used at one level only, either for parts or for
+    // patterns within a part.
+    omp_set_max_active_levels(1);
+    p4_nThreads = nThreads;
+#else
+    p4_nThreads = 1;
+#endif
+    Py_INCREF(Py_None);
+    return Py_None;
+}
+
+static PyObject *
+pf_haveOpenMP(PyObject *self, PyObject *args)
+{
+#ifdef _OPENMP
+    return Py_BuildValue("i", 1);
+#else
+    return Py_BuildValue("i", 0);
+#endif
+}
+
+static PyObject *
+pf_eigCacheSetMaxSize(PyObject *self, PyObject *args)
+{
+    int maxSize;
+	
+    if(!PyArg_ParseTuple(args, "i", &maxSize)) {
+        printf("Error pf_eigCacheSetMaxSize: couldn't parse tuple\n");
+        return NULL;
+    }
+    p4_eigCacheSetMaxSize(maxSize);
+    Py_INCREF(Py_None);
+    return Py_None;
+}
+
+static PyObject *
+pf_eigCacheGetMaxSize(PyObject *self, PyObject *args)
+{
+    return Py_BuildValue("i", p4_eigCacheGetMaxSize());
+}
+
+static PyObject *
+pf_eigCacheStats(PyObject *self, PyObject *args)
+{
+    long hits, misses;
+    int nEntries;
+
+    p4_eigCacheStats(&hits, &misses, &nEntries);
+    return Py_BuildValue("(lli)", hits, misses, nEntries);
+}
+
+static PyObject *
+pf_p4WorkCounters(PyObject *self, PyObject *args)
+{
+    // CL recalcs, bigP recalcs, eigen solves, and bytes copied.
+    return Py_BuildValue("(LLLL)", p4_nCLRecalcs, p4_nBigPRecalcs, p4_nEigSolves, p4_nCopyBytes);
+}
+
+static PyObject *
+pf_eigCacheClear(PyObject *self, PyObject *args)
+{
+    p4_eigCacheClear();
+    Py_INCREF(Py_None);
+    return Py_None;
+}
+
 static PyObject *
 pf_reseedCRandomizer(PyObject *self, PyObject *args)
 {
@@ -1180,6 +1308,7 @@ pf_p4_newTree(PyObject *self, PyObject *args)
 {
     int nNodes;
     int nLeaves;
+    int clFloat;
     data *aData;
     p4_model *aModel;
     PyArrayObject *oPreOrder, *oPostOrder, *oPartLikes;
@@ -1187,7 +1316,7 @@ pf_p4_newTree(PyObject *self, PyObject *args)
     double *partLikes;
     //int i;
 	
-    if(!PyArg_ParseTuple(args, "iiOOOll",&nNodes, &nLeaves, &oPreOrder, &oPostOrder, &oPartLikes, &aData, &aModel)) {
+    if(!PyArg_ParseTuple(args, "iiOOOlli",&nNodes, &nLeaves, &oPreOrder, &oPostOrder, &oPartLikes, &aData, &aModel, &clFloat)) {
         printf("Error pf_p4_newTree: couldn't parse tuple\n");
         return NULL;
     }
@@ -1202,7 +1331,7 @@ pf_p4_newTree(PyObject *self, PyObject *args)
     postOrder = (int *)(oPostOrder->data);
     partLikes = (double *)(oPartLikes->data);
     //printf("preOrder is %li\n", (long int)preOrder);
-    return Py_BuildValue("l", p4_newTree(nNodes, nLeaves, preOrder, postOrder, partLikes, aData, aModel));
+    return Py_BuildValue("l", p4_newTree(nNodes, nLeaves, preOrder, postOrder, partLikes, aData, aModel, clFloat));
 }
 
 
@@ -1891,6 +2020,23 @@ pf_p4_treeLogLike(PyObject *self, PyObject *args)
     return Py_BuildValue("d", p4_treeLogLike(aTree, getSiteLikes));
 }
 
+static PyObject *
+pf_p4_updateLogLike(PyObject *self, PyObject *args)
+{
+    p4_tree  *aTree;
+    PyArrayObject *oBrLenChanged, *oFlagged;
+    int       nBrLenChanged, nFlagged, pNum, allNodes;
+
+    if(!PyArg_ParseTuple(args, "lOiOiii", &aTree, &oBrLenChanged, &nBrLenChanged, &oFlagged, &nFlagged, &pNum, &allNodes)) {
+        printf("Error pf_p4_updateLogLike: couldn't parse tuple\n");
+        return NULL;
+    }
+    return Py_BuildValue("d", p4_updateLogLike(aTree, 
+                                               (int *)(oBrLenChanged->data), nBrLenChanged, 
+                                               (int *)(oFlagged->data), nFlagged, 
+                                               pNum, allNodes));
+}
+
 static PyObject *
 pf_p4_partLogLike(PyObject *self, PyObject *args)
 {
@@ -2067,6 +2213,20 @@ pf_p4_simulate(PyObject *self, PyObject *args)
     return Py_None;
 }
 
+static PyObject *
+pf_p4_simulatePatternCounts(PyObject *self, PyObject *args)
+{
+    p4_tree *aTree;
+    int pNum;
+    int nReps;
+
+    if(!PyArg_ParseTuple(args, "lii", &aTree, &pNum, &nReps)) {
+        printf("Error pf_p4_simulatePatternCounts: couldn't parse tuple\n");
+        return NULL;
+    }
+    return p4_simulatePatternCounts(aTree, pNum, nReps);
+}
+
 static PyObject *
 pf_p4_drawAncState(PyObject *self, PyObject *args)
 {
@@ -2526,6 +2686,8 @@ static PyMethodDef pfMethods[] = {
     {"dumpData", pf_dumpData, METH_VARARGS},
     {"pokePartInData", pf_pokePartInData, METH_VARARGS},
     {"bootstrapData", pf_bootstrapData, METH_VARARGS},
+    {"bootstrapPatternCounts", pf_bootstrapPatternCounts, METH_VARARGS},
+    {"resetPatternCounts", pf_resetPatternCounts, METH_VARARGS},
 
     {"newPart", pf_newPart, METH_VARARGS},
     {"freePart", pf_freePart, METH_VARARGS},
@@ -2544,6 +2706,14 @@ static PyMethodDef pfMethods[] = {
     {"partComposition", pf_partComposition, METH_VARARGS},
     {"partSequenceSitesCount", pf_partSequenceSitesCount, METH_VARARGS},
     {"getSiteLikes", pf_getSiteLikes, METH_VARARGS},
+    {"getSiteLogLikes", pf_getSiteLogLikes, METH_VARARGS},
+    {"setNThreads", pf_setNThreads, METH_VARARGS},
+    {"haveOpenMP", pf_haveOpenMP, METH_VARARGS},
+    {"eigCacheSetMaxSize", pf_eigCacheSetMaxSize, METH_VARARGS},
+    {"eigCacheGetMaxSize", pf_eigCacheGetMaxSize, METH_VARARGS},
+    {"eigCacheStats", pf_eigCacheStats, METH_VARARGS},
+    {"p4WorkCounters", pf_p4WorkCounters, METH_VARARGS},
+    {"eigCacheClear", pf_eigCacheClear, METH_VARARGS},
     {"getSiteRates", pf_getSiteRates, METH_VARARGS},
     {"getUnconstrainedLogLike", pf_getUnconstrainedLogLike, METH_VARARGS},
     {"calcEmpiricalRMatrixViaMatrixLog", pf_calcEmpiricalRMatrixViaMatrixLog, METH_VARARGS},
@@ -2629,6 +2799,7 @@ static PyMethodDef pfMethods[] = {
     {"p4_setPramsTest", pf_p4_setPramsTest, METH_VARARGS},
     {"p4_treeLogLike", pf_p4_treeLogLike, METH_VARARGS},
     {"p4_partLogLike", pf_p4_partLogLike, METH_VARARGS},
+    {"p4_updateLogLike", pf_p4_updateLogLike, METH_VARARGS},
     {"p4_calculateBigPDecks", pf_p4_calculateBigPDecks, METH_VARARGS},
     {"p4_calculateAllBigPDecksAllParts", pf_p4_calculateAllBigPDecksAllParts, METH_VARARGS},
     {"p4_setConditionalLikelihoodsOfInteriorNodePart", pf_p4_setConditionalLikelihoodsOfInteriorNodePart, METH_VARARGS},
@@ -2639,6 +2810,7 @@ static PyMethodDef pfMethods[] = {
     {"p4_getFreePrams", pf_p4_getFreePrams, METH_VARARGS},
     {"p4_getRelRate", pf_p4_getRelRate, METH_VARARGS},
     {"p4_simulate", pf_p4_simulate, METH_VARARGS},
+    {"p4_simulatePatternCounts", pf_p4_simulatePatternCounts, METH_VARARGS},
     {"p4_drawAncState", pf_p4_drawAncState, METH_VARARGS, doc_p4_drawAncState},
     {"p4_expectedCompositionCounts", pf_p4_expectedCompositionCounts, METH_VARARGS, doc_p4_expectedCompositionCounts},
     {"p4_expectedComposition", pf_p4_expectedComposition, METH_VARARGS, doc_p4_expectedComposition},
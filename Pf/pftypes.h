@@ -36,6 +36,7 @@ struct partStruct {
     int    *patternCounts;
     int    *sequencePositionPatternIndex;
     int		nPatterns;
+    int     patternCountsBootstrapped;  // see bootstrapPatternCounts()
     int	  **sequences;
     int     nEquates;
     int   **equates;
@@ -43,8 +44,12 @@ struct partStruct {
     int    *globalInvarSitesVec;
     int   **globalInvarSitesArray;
     double *siteLikes;
+    double *siteLogLikes;
     int    *taxList;
     int    *simCats;
+    int    **tipCodes;       // [seqNum][pattern], or NULL, see makeTipCodes()
+    int      nTipCodes;
+    double  *tipCodeVecs;    // [(tipCode * dim) + state]
     //double  logLike;
     p4_drawAncStResults *drawAncStResults;
     
@@ -104,6 +109,7 @@ struct p4_treeStruct {
     p4_node  **stack;
     double     logLike;
     double    *partLikes;
+    int        clFloat;  // cl's stored as floats, see p4_newCLSlab()
     int     ***simSequences;
     int     ***internalSequences;
 };
@@ -126,9 +132,20 @@ struct p4_nodeStruct {
     double     ****bigPDecks;
     double     ****bigPDecks_1stD;
     double     ****bigPDecks_2ndD;
-    double     ****cl;  // conditionalLikelihoods[partNum][nCats][dim][nChar]
-    double     ****cl2;
+    double       **cl;  // conditionalLikelihoods[partNum][((patNum * nCat) + catNum) * dim + state], one aligned slab per part
+    double       **cl2;
+    double       **clScalers;   // [partNum][nChar], log of the scaling applied to cl, cumulative from the leaves
+    double       **cl2Scalers;  // [partNum][nChar], the same for cl2
     double     ****pickerDecks;
+    // An mcmc chain has two trees, and their matching nodes are twins.
+    // Twins share two sets of cl and bigP buffers, so that accepting or
+    // rejecting a proposal is a pointer assignment, not a copy.  These
+    // are the buffers that this node allocated and will free; cl,
+    // clScalers, and bigPDecks may point to either its own or its twin's.
+    p4_node       *twin;
+    double       **clOwn;
+    double       **clScalersOwn;
+    double     ****bigPDecksOwn;
     int		       clNeedsUpdating;
     int            cl2NeedsUpdating;
     //int            brLenChanged;
@@ -201,6 +218,8 @@ struct p4_pInvarStruct {
 struct p4_bigQAndEigStruct {
     double    **bigQ;
     eig        *qEig;
+    double     *eigvecProducts;  // dim * dim * dim, see eigvecProducts() in eig.c
+    int         eigvecProductsNeedReset;
     //int         *needsReset;
 };
 
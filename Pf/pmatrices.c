@@ -1,6 +1,7 @@
 #include <stdio.h>	// for printf
 #include "pmatrices.h"
 #include <stdlib.h>	// for malloc and free
+#include "defines.h"
 
 
 double **psdmatrix(int dim) // square double
@@ -107,6 +108,55 @@ void free_pdmatrix(double **m)
 	free((char *) (m));
 }
 
+double ***psddecks(int nDecks, int dim)
+// allocate nDecks square double matrices, all in one contiguous slab,
+// so that m[0][0] points to nDecks * dim * dim doubles.  The decks
+// can be used as ordinary psdmatrix's, eg m[deckNum].
+{
+	int i, j;
+	double ***m;
+	double *slab;
+
+	m=(double ***) malloc(nDecks * sizeof(double**));
+	if (!m) {
+		printf("allocation error in psddecks 1.\n");
+		exit(1);
+	}
+	m[0]=(double **) malloc(nDecks * dim * sizeof(double*));
+	if (!m[0]) {
+		printf("allocation error in psddecks 2.\n");
+		exit(1);
+	}
+	slab=pdaligned(nDecks * dim * dim);
+	for(i=0;i<nDecks;i++) {
+		m[i]=m[0] + (i * dim);
+		for(j=0;j<dim;j++) {
+			m[i][j]=slab + (((i * dim) + j) * dim);
+		}
+	}
+	return m;
+}
+
+void free_psddecks(double ***m)
+{
+	free((char *) (m[0][0]));
+	free((char *) (m[0]));
+	free((char *) (m));
+}
+
+double *pdaligned(int n)
+// allocate a double vector aligned to P4_ALIGNMENT bytes, so that the
+// compiler can use aligned SIMD loads on it.  Free it with free().
+{
+	void *v = NULL;
+
+	if(posix_memalign(&v, P4_ALIGNMENT, n * sizeof(double))) {
+		printf("allocation error in pdaligned.\n");
+		exit(1);
+	}
+	return (double *) v;
+}
+
 
 
 int **psimatrix(int dim)
@@ -5,6 +5,9 @@ void copy_psdmatrix(double **from, double **to, int dim); // copies
 
 double **pdmatrix(int rows, int cols); // mallocs a rectangular matrix
 void free_pdmatrix(double **m); // frees the rectangular double matrix
+double ***psddecks(int nDecks, int dim); // mallocs nDecks square double matrices in one slab
+void free_psddecks(double ***m);
+double *pdaligned(int n);   // mallocs an aligned double vector
 int **psimatrix(int dim);	// mallocs a square int matrix
 void free_psimatrix(int **m); // frees the square int matrix
 void dump_psimatrix(int **m, int dim); // prints a square int matrix
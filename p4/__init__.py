@@ -46,6 +46,7 @@ from .data import Data
 from .model import Model
 from .mcmc import Mcmc
 from .mcmccheckpointreader import McmcCheckPointReader
+from .mcmcmultirun import McmcMultiRun
 from .chain import Chain
 from .stmcmc import STMcmc, STMcmcCheckPointReader
 from .distancematrix import DistanceMatrix
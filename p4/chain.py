@@ -6,14 +6,19 @@ import math
 import random
 import copy
 import numpy
-import scipy
-import scipy.stats
 from p4.p4exceptions import P4Error
 import sys
 
 #localCalls = 0
 
 
+def newChainNumpyRandom(seed):
+    """A NumPy random number generator for Chain.numpyRandom"""
+    if hasattr(numpy.random, 'default_rng'):
+        return numpy.random.default_rng(seed)
+    return numpy.random.RandomState(seed)
+
+
 class Chain(object):
 
     from p4.chain_topol import proposeRoot3, proposeBrLen, proposeAllBrLens, proposeLocal, proposeETBR_Blaise, proposeESPR_Blaise, proposeETBR, proposeESPR, proposePolytomy, proposeAddEdge, _getCandidateNodesForDeleteEdge, proposeDeleteEdge
@@ -23,6 +28,14 @@ class Chain(object):
         self.mcmc = aMcmc
         #self.num = -1
         self.tempNum = -1  # 'temp'erature, not 'temp'orary
+        # The state of this chain's own stream of python random
+        # numbers, set in Mcmc.run().  Each chain has its own so that
+        # a run does not depend on whether the chains are done one
+        # after another or in parallel.
+        self.randomState = None
+        # And its own NumPy generator, for the Dirichlet proposals,
+        # also set in Mcmc.run().
+        self.numpyRandom = None
 
         self.curTree = aMcmc.tree.dupe()
         self.curTree.data = aMcmc.tree.data
@@ -63,6 +76,26 @@ class Chain(object):
             raise P4Error(
                 "Chain.init().  Programming error. The prop tree should be identical to the cur tree, and it is not.")
 
+    def installTrees(self, curTree, propTree):
+        """Replace self.curTree and self.propTree.
+
+        The new trees are copies without data or c-structs, eg from a
+        worker process of Mcmc.run(parallelChains=True).  They are
+        given the data and set up as in __init__().
+        """
+
+        self.curTree.deleteCStuff()
+        self.propTree.deleteCStuff()
+        self.curTree = curTree
+        self.curTree.data = self.mcmc.tree.data
+        self.curTree.calcLogLike(verbose=0, resetEmpiricalComps=False)
+        self.propTree = propTree
+        self.propTree.data = self.mcmc.tree.data
+        self.propTree.calcLogLike(verbose=0, resetEmpiricalComps=False)
+        pf.p4_copyCondLikes(self.curTree.cTree, self.propTree.cTree, 1)
+        pf.p4_copyBigPDecks(self.curTree.cTree, self.propTree.cTree, 1)
+        pf.p4_copyModelPrams(self.curTree.cTree, self.propTree.cTree)
+
     def propose(self, theProposal):
         gm = ['Chain.propose()']
         # print "propose().  gen %i, About to propose %s" % (self.mcmc.gen,
@@ -241,6 +274,34 @@ class Chain(object):
             # print "logLikeRatio = %f" % logLikeRatio
             return theSum
 
+    def _updatePropTreeLogLike(self, pNum=-1, allNodes=False):
+        """Recalculate bigP's, cond likes, and part likes of the propTree.
+
+        This is done in one call to pf.p4_updateLogLike().  Nodes with
+        n.br.lenChanged get new bigP's, and they and nodes with n.flag
+        set have the cond likes of their ancestors recalculated.  Then
+        the n.br.lenChanged and n.flag are un-set.  If allNodes is set
+        all cond likes are recalculated, and the flags are not looked
+        at.  Only part pNum is done, or all parts if pNum is -1.  The
+        propTree.partLikes are set."""
+
+        brLenChanged = []
+        flagged = []
+        if not allNodes:
+            for n in self.propTree.iterNodesNoRoot():
+                if n.br.lenChanged:
+                    brLenChanged.append(n.nodeNum)
+                    n.br.lenChanged = False
+            for n in self.propTree.iterNodes():
+                if n.flag:
+                    flagged.append(n.nodeNum)
+                    n.flag = 0
+        brLenChanged = numpy.array(brLenChanged, numpy.int32)
+        flagged = numpy.array(flagged, numpy.int32)
+        pf.p4_updateLogLike(self.propTree.cTree,
+                            brLenChanged, len(brLenChanged),
+                            flagged, len(flagged), pNum, int(allNodes))
+
     def proposeSp(self, theProposal):
         gm = ['Chain.proposeSp()']
         # if self.mcmc.gen > 1300:
@@ -252,26 +313,14 @@ class Chain(object):
             self.proposeCompWithSlider(theProposal)
             self.propTree.model.setCStuff(partNum=theProposal.pNum)
             pf.p4_setPrams(self.propTree.cTree, theProposal.pNum)
-            for n in self.propTree.iterPostOrder():
-                if not n.isLeaf:
-                    pf.p4_setConditionalLikelihoodsOfInteriorNodePart(
-                        n.cNode, theProposal.pNum)
-            pf.p4_partLogLike(self.propTree.cTree,
-                              self.propTree.data.parts[theProposal.pNum].cPart,
-                              theProposal.pNum, 0)
+            self._updatePropTreeLogLike(pNum=theProposal.pNum, allNodes=True)
 
         elif theProposal.name == 'compDir':
             # print "theProposal.name = compDir, pNum=%i" % theProposal.pNum
             self.proposeCompWithDirichlet(theProposal)
             self.propTree.model.setCStuff(partNum=theProposal.pNum)
             pf.p4_setPrams(self.propTree.cTree, theProposal.pNum)
-            for n in self.propTree.iterPostOrder():
-                if not n.isLeaf:
-                    pf.p4_setConditionalLikelihoodsOfInteriorNodePart(
-                        n.cNode, theProposal.pNum)
-            pf.p4_partLogLike(self.propTree.cTree,
-                              self.propTree.data.parts[theProposal.pNum].cPart,
-                              theProposal.pNum, 0)
+            self._updatePropTreeLogLike(pNum=theProposal.pNum, allNodes=True)
 
         elif theProposal.name == 'allCompsDir':
             #print("theProposal.name = allCompsDir, pNum=%i" % theProposal.pNum)
@@ -296,13 +345,7 @@ class Chain(object):
             # This next line is needed, and it needs to go here.  At least
             # because of p4_calculateBigPDecksPart()
             pf.p4_setPrams(self.propTree.cTree, theProposal.pNum)  # "-1" means do all parts
-            for n in self.propTree.iterPostOrder():
-                if not n.isLeaf:
-                    pf.p4_setConditionalLikelihoodsOfInteriorNodePart(
-                        n.cNode, theProposal.pNum)
-            pf.p4_partLogLike(self.propTree.cTree,
-                              self.propTree.data.parts[theProposal.pNum].cPart,
-                              theProposal.pNum, 0)
+            self._updatePropTreeLogLike(pNum=theProposal.pNum, allNodes=True)
 
 
         elif theProposal.name == 'ndch2_leafCompsDir':
@@ -326,13 +369,7 @@ class Chain(object):
                            print('++++++ gen %i comp %2i %2i' % (self.mcmc.gen, mtPropNum,chNum), "%17.15f %17.15f %g" % (thisNp, thatNp, (thisNp - thatNp))) 
             
             pf.p4_setPrams(self.propTree.cTree, theProposal.pNum)  # "-1" means do all parts
-            for n in self.propTree.iterPostOrder():
-                if not n.isLeaf:
-                    pf.p4_setConditionalLikelihoodsOfInteriorNodePart(
-                        n.cNode, theProposal.pNum)
-            pf.p4_partLogLike(self.propTree.cTree,
-                              self.propTree.data.parts[theProposal.pNum].cPart,
-                              theProposal.pNum, 0)
+            self._updatePropTreeLogLike(pNum=theProposal.pNum, allNodes=True)
 
 
         elif theProposal.name == 'ndch2_internalCompsDir':
@@ -356,13 +393,7 @@ class Chain(object):
                            print('++++++ gen %i comp %2i %2i' % (self.mcmc.gen, mtPropNum,chNum), "%17.15f %17.15f %g" % (thisNp, thatNp, (thisNp - thatNp))) 
             
             pf.p4_setPrams(self.propTree.cTree, theProposal.pNum)  # "-1" means do all parts
-            for n in self.propTree.iterPostOrder():
-                if not n.isLeaf:
-                    pf.p4_setConditionalLikelihoodsOfInteriorNodePart(
-                        n.cNode, theProposal.pNum)
-            pf.p4_partLogLike(self.propTree.cTree,
-                              self.propTree.data.parts[theProposal.pNum].cPart,
-                              theProposal.pNum, 0)
+            self._updatePropTreeLogLike(pNum=theProposal.pNum, allNodes=True)
 
 
         elif theProposal.name == 'ndch2_leafCompsDirAlpha':
@@ -445,13 +476,7 @@ class Chain(object):
 
             self.propTree.model.setCStuff(partNum=theProposal.pNum)
             pf.p4_setPrams(self.propTree.cTree, theProposal.pNum)
-            for n in self.propTree.iterPostOrder():
-                if not n.isLeaf:
-                    pf.p4_setConditionalLikelihoodsOfInteriorNodePart(
-                        n.cNode, theProposal.pNum)
-            pf.p4_partLogLike(self.propTree.cTree,
-                              self.propTree.data.parts[theProposal.pNum].cPart,
-                              theProposal.pNum, 0)
+            self._updatePropTreeLogLike(pNum=theProposal.pNum, allNodes=True)
 
         # elif theProposal.name == 'rjRMatrix':
         #     # print "theProposal.name = rjRMatrix, pNum=%i" % theProposal.pNum
@@ -477,25 +502,13 @@ class Chain(object):
             # THis next line is not needed because gdasrv is a numpy array
             #self.propTree.model.setCStuff(partNum=theProposal.pNum)
             pf.p4_setPrams(self.propTree.cTree, theProposal.pNum)
-            for n in self.propTree.iterPostOrder():
-                if not n.isLeaf:
-                    pf.p4_setConditionalLikelihoodsOfInteriorNodePart(
-                        n.cNode, theProposal.pNum)
-            pf.p4_partLogLike(self.propTree.cTree,
-                              self.propTree.data.parts[theProposal.pNum].cPart,
-                              theProposal.pNum, 0)
+            self._updatePropTreeLogLike(pNum=theProposal.pNum, allNodes=True)
 
         elif theProposal.name == 'pInvar':
             self.proposePInvar(theProposal)
             self.propTree.model.setCStuff(partNum=theProposal.pNum)
             pf.p4_setPrams(self.propTree.cTree, theProposal.pNum)
-            for n in self.propTree.iterPostOrder():
-                if not n.isLeaf:
-                    pf.p4_setConditionalLikelihoodsOfInteriorNodePart(
-                        n.cNode, theProposal.pNum)
-            pf.p4_partLogLike(self.propTree.cTree,
-                              self.propTree.data.parts[theProposal.pNum].cPart,
-                              theProposal.pNum, 0)
+            self._updatePropTreeLogLike(pNum=theProposal.pNum, allNodes=True)
 
         elif theProposal.name == 'compLocation':
             self.proposeCompLocation(theProposal)
@@ -510,13 +523,7 @@ class Chain(object):
             # slots might remain in the state of saying that they need
             # resetting -- but they are not used.
             pf.p4_setPrams(self.propTree.cTree, theProposal.pNum)
-            for n in self.propTree.iterPostOrder():
-                if not n.isLeaf:
-                    pf.p4_setConditionalLikelihoodsOfInteriorNodePart(
-                        n.cNode, theProposal.pNum)
-            pf.p4_partLogLike(self.propTree.cTree,
-                              self.propTree.data.parts[theProposal.pNum].cPart,
-                              theProposal.pNum, 0)
+            self._updatePropTreeLogLike(pNum=theProposal.pNum, allNodes=True)
 
         elif theProposal.name == 'rMatrixLocation':
             self.proposeRMatrixLocation(theProposal)
@@ -524,13 +531,7 @@ class Chain(object):
                 return 0.0
             self.propTree.setCStuff()
             pf.p4_setPrams(self.propTree.cTree, theProposal.pNum)
-            for n in self.propTree.iterPostOrder():
-                if not n.isLeaf:
-                    pf.p4_setConditionalLikelihoodsOfInteriorNodePart(
-                        n.cNode, theProposal.pNum)
-            pf.p4_partLogLike(self.propTree.cTree,
-                              self.propTree.data.parts[theProposal.pNum].cPart,
-                              theProposal.pNum, 0)
+            self._updatePropTreeLogLike(pNum=theProposal.pNum, allNodes=True)
 
         elif theProposal.name == 'gdasrvLocation':
             self.proposeGdasrvLocation(theProposal)
@@ -538,13 +539,7 @@ class Chain(object):
                 return 0.0
             self.propTree.setCStuff()
             pf.p4_setPrams(self.propTree.cTree, theProposal.pNum)
-            for n in self.propTree.iterPostOrder():
-                if not n.isLeaf:
-                    pf.p4_setConditionalLikelihoodsOfInteriorNodePart(
-                        n.cNode, theProposal.pNum)
-            pf.p4_partLogLike(self.propTree.cTree,
-                              self.propTree.data.parts[theProposal.pNum].cPart,
-                              theProposal.pNum, 0)
+            self._updatePropTreeLogLike(pNum=theProposal.pNum, allNodes=True)
 
         elif theProposal.name == 'local':
             self.proposeLocal(theProposal)
@@ -554,28 +549,7 @@ class Chain(object):
                 if not self.propTree.preAndPostOrderAreValid:
                     self.propTree.setPreAndPostOrder()
                 self.propTree.setCStuff()
-
-                for n in self.propTree.iterNodesNoRoot():
-                    if n.br.lenChanged:
-                        pf.p4_calculateBigPDecks(n.cNode)
-                        p = n
-                        while p != self.propTree.root:
-                            p = p.parent
-                            p.flag = 1
-                        n.br.lenChanged = False
-                # for n in self.propTree.iterNodesNoRoot():
-                #    if n.flag:
-                #        print "    node %2i flag" % n.nodeNum
-                for n in self.propTree.iterPostOrder():
-                    if not n.isLeaf:
-                        if n.flag:
-                            for pNum in range(self.propTree.model.nParts):
-                                pf.p4_setConditionalLikelihoodsOfInteriorNodePart(
-                                    n.cNode, pNum)
-                        n.flag = 0
-                for pNum in range(self.propTree.model.nParts):
-                    pf.p4_partLogLike(
-                        self.propTree.cTree, self.propTree.data.parts[pNum].cPart, pNum, 0)
+                self._updatePropTreeLogLike()
 
                 if 0 and self.mcmc.gen == 0:
                     self.propTree.calcLogLike()
@@ -586,27 +560,7 @@ class Chain(object):
         elif theProposal.name == 'brLen':
             self.proposeBrLen(theProposal)
             self.propTree.setCStuff()
-            for n in self.propTree.iterNodesNoRoot():
-                if n.br.lenChanged:
-                    # print "node %i br.lenChanged" % n.nodeNum
-                    pf.p4_calculateBigPDecks(n.cNode)
-                    p = n
-                    while p != self.propTree.root:
-                        p = p.parent
-                        p.flag = 1
-                    n.br.lenChanged = False
-                    break
-            for pNum in range(self.propTree.model.nParts):
-                for n in self.propTree.iterPostOrder():
-                    if not n.isLeaf:
-                        if n.flag:
-                            pf.p4_setConditionalLikelihoodsOfInteriorNodePart(
-                                n.cNode, pNum)
-                pf.p4_partLogLike(
-                    self.propTree.cTree, self.propTree.data.parts[pNum].cPart, pNum, 0)
-            for n in self.propTree.iterInternalsNoRoot():
-                n.flag = 0
-            self.propTree.root.flag = 0
+            self._updatePropTreeLogLike()
 
             if 0:
                 logLike1 = sum(self.propTree.partLikes)
@@ -621,19 +575,10 @@ class Chain(object):
         elif theProposal.name == 'allBrLens':
             self.proposeAllBrLens(theProposal)
             self.propTree.setCStuff()
-            for n in self.propTree.iterNodesNoRoot():  
-                # all branch lengths have changed, 
-                # so no need to check whether n.br.lenChanged
-                pf.p4_calculateBigPDecks(n.cNode)
-            for pNum in range(self.propTree.model.nParts):
-                for n in self.propTree.iterPostOrder():
-                    if not n.isLeaf:
-                        # Normally we would check whether n.flag is set
-                        # but here they all need to recalc cond likes
-                        pf.p4_setConditionalLikelihoodsOfInteriorNodePart(
-                            n.cNode, pNum)
-                pf.p4_partLogLike(
-                    self.propTree.cTree, self.propTree.data.parts[pNum].cPart, pNum, 0)
+            # All branch lengths have changed, so no need to check
+            # whether n.br.lenChanged.
+            pf.p4_calculateAllBigPDecksAllParts(self.propTree.cTree)
+            self._updatePropTreeLogLike(allNodes=True)
             #for n in self.propTree.iterInternalsNoRoot():
             #    n.flag = 0
             #self.propTree.root.flag = 0
@@ -692,42 +637,11 @@ class Chain(object):
                             #n.br.textDrawSymbol = 'C'
                     # self.propTree.draw()
 
-                for n in self.propTree.iterNodesNoRoot():
-                    if n.br.lenChanged:
-                        # if 1:
-                        # This next line can generate
-                        # p4_calculateBigPDecksPart() pNum=0, compNum=1,
-                        # rMatrixNum=0, needsReset. Fix me.
-                        pf.p4_calculateBigPDecks(n.cNode)
-                        p = n
-                        while p != self.propTree.root:
-                            p = p.parent
-                            p.flag = 1
-                        n.br.lenChanged = False
-
-                # More debugging litter ...
-                if 0 and self.mcmc.gen == 270:
-                    for n in self.propTree.iterNodes():
-                        if n.flag:
-                            print("    node %2i flag" % n.nodeNum)
-                            # if n.br:
-                            #    n.br.textDrawSymbol = 'f'
-                    # self.propTree.draw()
-                    # for  n in self.propTree.iterNodesNoRoot():
-                    #    n.br.textDrawSymbol = '-'
-
-                # Recalculate condLikes for only the flagged nodes, in post
-                # order down to the root.
-                for n in self.propTree.iterPostOrder():
-                    if not n.isLeaf:
-                        if n.flag:
-                            for pNum in range(self.propTree.model.nParts):
-                                pf.p4_setConditionalLikelihoodsOfInteriorNodePart(
-                                    n.cNode, pNum)
-                        n.flag = 0
-                for pNum in range(self.propTree.model.nParts):
-                    pf.p4_partLogLike(
-                        self.propTree.cTree, self.propTree.data.parts[pNum].cPart, pNum, 0)
+                # New bigP's for the changed brLens, and recalculate
+                # condLikes for only the flagged nodes, in post order
+                # down to the root.  The p4_calculateBigPDecksPart() in
+                # there can say "needsReset. Fix me."
+                self._updatePropTreeLogLike()
 
         elif theProposal.name == 'polytomy':
             self.proposePolytomy(theProposal)
@@ -759,30 +673,13 @@ class Chain(object):
             else:
                 for n in self.propTree.iterNodesNoRoot():
                     if n.br.lenChanged:
-                        pf.p4_calculateBigPDecks(n.cNode)
                         # Need to recalculate condLikes of the newly
                         # added node, as well as its ancestors.
                         # (usually just need to do the ancestors of
                         # the changed brLen).
                         n.flag = 1
-                        p = n
-                        while p != self.propTree.root:
-                            p = p.parent
-                            p.flag = 1
-                        n.br.lenChanged = False
                         break
-                for pNum in range(self.propTree.model.nParts):
-                    for n in self.propTree.iterPostOrder():
-                        if not n.isLeaf:
-                            # print "node %i" % n.nodeNum
-                            if n.flag:
-                                pf.p4_setConditionalLikelihoodsOfInteriorNodePart(
-                                    n.cNode, pNum)
-                    pf.p4_partLogLike(
-                        self.propTree.cTree, self.propTree.data.parts[pNum].cPart, pNum, 0)
-                for n in self.propTree.iterInternalsNoRoot():
-                    n.flag = 0
-                self.propTree.root.flag = 0
+                self._updatePropTreeLogLike()
 
         elif theProposal.name == 'root3':
             self.proposeRoot3(theProposal)
@@ -790,13 +687,7 @@ class Chain(object):
                 self.propTree.setPreAndPostOrder()
             self.propTree.setCStuff()
             pf.p4_setPrams(self.propTree.cTree, -1)
-            for pNum in range(self.propTree.model.nParts):
-                for n in self.propTree.iterPostOrder():
-                    if not n.isLeaf:
-                        pf.p4_setConditionalLikelihoodsOfInteriorNodePart(
-                            n.cNode, pNum)
-                pf.p4_partLogLike(
-                    self.propTree.cTree, self.propTree.data.parts[pNum].cPart, pNum, 0)
+            self._updatePropTreeLogLike(allNodes=True)
 
         elif theProposal.name == 'relRate':
             # print "theProposal.name = relRate, pNum=%i" % theProposal.pNum
@@ -823,13 +714,7 @@ class Chain(object):
             pf.p4_calculateAllBigPDecksAllParts(self.propTree.cTree)
 
             # This is the time-consuming part.
-            for pNum in range(self.propTree.model.nParts):
-                for n in self.propTree.iterPostOrder():
-                    if not n.isLeaf:
-                        pf.p4_setConditionalLikelihoodsOfInteriorNodePart(
-                            n.cNode, pNum)
-                pf.p4_partLogLike(
-                    self.propTree.cTree, self.propTree.data.parts[pNum].cPart, pNum, 0)
+            self._updatePropTreeLogLike(allNodes=True)
 
         else:
             gm.append('Unlisted proposal.name=%s  Fix me.' % theProposal.name)
@@ -1051,16 +936,8 @@ class Chain(object):
                 aProposal.nAborts[self.tempNum] += 1
                 self.curTree.copyToTree(self.propTree)
                 self.curTree.model.copyBQETneedsResetTo(self.propTree.model)
-                # Slow check.
-                if 1:
-                    ret = self.verifyIdentityOfTwoTreesInChain(
-                        doSplitKeys=self.mcmc.constraints)
-                    if ret == var.DIFFERENT:
-                        gm.append("Bad restore of propTree after doAbort.")
-                        raise P4Error(gm)
-                    else:
-                        # print "ok"
-                        pass
+                if var.mcmc_debugCheckLevel:
+                    self.checkAbortRestore(gm, "Bad restore of propTree after doAbort.")
 
         if aProposal.doAbort and aProposal.name in ['compLocation', 'polytomy', 'rMatrixLocation',
                                                     'gdasrvLocation', 'rjComp', 'rjRMatrix']:
@@ -1094,16 +971,8 @@ class Chain(object):
                 # pf.p4_copyBigPDecks(a.cTree, b.cTree, 1) # 1 means do all
                 pf.p4_copyModelPrams(a.cTree, b.cTree)
 
-            # Slow check.
-            if 1:
-                ret = self.verifyIdentityOfTwoTreesInChain(
-                    doSplitKeys=self.mcmc.constraints)
-                if ret == var.DIFFERENT:
-                    gm.append("Trees differ after doAbort.")
-                    raise P4Error(gm)
-                else:
-                    # print "ok"
-                    pass
+            if var.mcmc_debugCheckLevel:
+                self.checkAbortRestore(gm, "Trees differ after doAbort.")
 
             return True  # ie failure
 
@@ -1531,6 +1400,44 @@ class Chain(object):
         #    print "verifyIdentityOfTwoTreesInChain() c stuff differs"
         return ret
 
+    def treeCheckSum(self, aTree):
+        """A quick Python-level summary of aTree, for comparing trees.
+
+        It is the node relations, the branch lengths, the model usage,
+        and the model parameters as in the prams file.  Unlike
+        verifyIdentityOfTwoTreesInChain(), it does not look at the
+        splitKeys or the c-structs.
+        """
+        nodeStuff = []
+        for n in aTree.nodes:
+            for m in [n.parent, n.leftChild, n.sibling]:
+                if m:
+                    nodeStuff.append(m.nodeNum)
+                else:
+                    nodeStuff.append(-1)
+            nodeStuff += [nP.compNum for nP in n.parts]
+            if n.br:
+                nodeStuff.append(n.br.len)
+                nodeStuff += [(bp.rMatrixNum, bp.gdasrvNum) for bp in n.br.parts]
+        return hash((aTree.root.nodeNum, tuple(nodeStuff), tuple(aTree.model.getPramsLineVals())))
+
+    def checkAbortRestore(self, gm, complaint):
+        """Check that the propTree is back to the curTree after an abort.
+
+        How closely is set by var.mcmc_debugCheckLevel.  If they
+        differ, complaint is added to gm, and a P4Error is raised.
+        """
+        if var.mcmc_debugCheckLevel >= 2:
+            ret = self.verifyIdentityOfTwoTreesInChain(
+                doSplitKeys=self.mcmc.constraints)
+        elif self.treeCheckSum(self.curTree) != self.treeCheckSum(self.propTree):
+            ret = var.DIFFERENT
+        else:
+            ret = var.SAME
+        if ret == var.DIFFERENT:
+            gm.append(complaint)
+            raise P4Error(gm)
+
     def proposeCompWithSlider(self, theProposal):
         gm = ['Chain.proposeCompWithSlider()']
 
@@ -1614,10 +1521,10 @@ class Chain(object):
         #dirichlet1(inSeq, alpha, theMin, theMax)
         #newVal = p4.func.dirichlet1(
         #    mt.val, theProposal.tuning, var.PIVEC_MIN, 1 - var.PIVEC_MIN)
-        # Now it uses scipy.
+        # Now it uses the chain's own NumPy generator.
         mtVal = numpy.array(mt.val)
-        myProposer = scipy.stats.dirichlet(theProposal.tuning[self.tempNum] * mtVal)
-        newVal = myProposer.rvs(size=1)[0]
+        alpha = theProposal.tuning[self.tempNum] * mtVal
+        newVal = self._drawDirichlet(alpha)
         while  newVal.min() < var.PIVEC_MIN:
             for i in range(dim):
                 if newVal[i] < var.PIVEC_MIN:
@@ -1649,11 +1556,9 @@ class Chain(object):
         # logProposalRatio = x - y
 
         # Calculate the proposal ratio
-        # We can re-use myProposer to get the log pdf
-        forwardLnPdf = myProposer.logpdf(newVal)
-        # Another dirichlet distribution for the reverse
-        spDist = scipy.stats.dirichlet(theProposal.tuning[self.tempNum] * newVal)
-        reverseLnPdf = spDist.logpdf(mtVal)
+        forwardLnPdf = pf.gsl_ran_dirichlet_lnpdf(dim, alpha, newVal)
+        reverseLnPdf = pf.gsl_ran_dirichlet_lnpdf(
+            dim, theProposal.tuning[self.tempNum] * newVal, mtVal)
         self.logProposalRatio = reverseLnPdf - forwardLnPdf
 
         # assert math.fabs(logProposalRatio - self.logProposalRatio) < 1.e-12 
@@ -1788,12 +1693,11 @@ class Chain(object):
             oldVal = numpy.array([0.0, 0.0])
             oldVal[0] = mtCur.val[0] / (mtCur.val[0] + 1.0)
             oldVal[1] = 1.0 - oldVal[0]
-            myProposer = scipy.stats.dirichlet(theProposal.tuning[self.tempNum] * oldVal)
-            newVal = myProposer.rvs(size=1)[0]
+            alpha = theProposal.tuning[self.tempNum] * oldVal
 
             safety = 0
             while 1:
-                newVal = myProposer.rvs(size=1)[0]
+                newVal = self._drawDirichlet(alpha)
                 if newVal.min() > var.KAPPA_MIN and newVal.max() < var.KAPPA_MAX:
                     break
                 safety += 1
@@ -1808,11 +1712,9 @@ class Chain(object):
             # print(mtProp.val, type(mtProp.val), mtProp.val.shape)
 
             # Calculate the proposal ratio
-            # We can re-use myProposer to get the log pdf
-            forwardLnPdf = myProposer.logpdf(newVal)
-            # Another dirichlet distribution for the reverse
-            spDist = scipy.stats.dirichlet(theProposal.tuning[self.tempNum] * newVal)
-            reverseLnPdf = spDist.logpdf(oldVal)
+            forwardLnPdf = pf.gsl_ran_dirichlet_lnpdf(2, alpha, newVal)
+            reverseLnPdf = pf.gsl_ran_dirichlet_lnpdf(
+                2, theProposal.tuning[self.tempNum] * newVal, oldVal)
             self.logProposalRatio = reverseLnPdf - forwardLnPdf
 
 
@@ -1821,10 +1723,10 @@ class Chain(object):
 
             # mt.val is a numpy array
             assert isinstance(mt.val, numpy.ndarray)
-            myProposer = scipy.stats.dirichlet(theProposal.tuning[self.tempNum] * mt.val)
+            alpha = theProposal.tuning[self.tempNum] * mt.val
 
             safety = 0
-            newVal = myProposer.rvs(size=1)[0]
+            newVal = self._drawDirichlet(alpha)
             while newVal.min() < var.RATE_MIN or newVal.max() > var.RATE_MAX:
                 for i in range(len(newVal)):
                     if newVal[i] < var.RATE_MIN:
@@ -1834,11 +1736,9 @@ class Chain(object):
                     newVal = newVal / newVal.sum()
                     
             # Calculate the proposal ratio
-            # We can re-use myProposer to get the log pdf
-            forwardLnPdf = myProposer.logpdf(newVal)
-            # Another dirichlet distribution for the reverse
-            spDist = scipy.stats.dirichlet(theProposal.tuning[self.tempNum] * newVal)
-            reverseLnPdf = spDist.logpdf(mt.val)
+            forwardLnPdf = pf.gsl_ran_dirichlet_lnpdf(len(newVal), alpha, newVal)
+            reverseLnPdf = pf.gsl_ran_dirichlet_lnpdf(
+                len(newVal), theProposal.tuning[self.tempNum] * newVal, mt.val)
             self.logProposalRatio = reverseLnPdf - forwardLnPdf
 
             mtProp = self.propTree.model.parts[theProposal.pNum].rMatrices[mtNum]
@@ -2059,6 +1959,30 @@ class Chain(object):
 
 
 
+    def _drawDirichlets(self, alphas):
+        """Draw from several Dirichlets at once, one for each row of alphas.
+
+        It is done with one call for gamma draws, from the chain's own
+        NumPy generator.
+        """
+        draws = self.numpyRandom.standard_gamma(alphas)
+        sums = draws.sum(axis=1)
+        if not sums.all():
+            for i in numpy.flatnonzero(sums == 0.0):
+                # All the gamma draws underflowed, which can happen
+                # when all the alphas are tiny.  Then it is nearly
+                # all in one, chosen in proportion to the alphas.
+                # (NumPy's own dirichlet() can hang on these.)
+                draws[i] = 0.0
+                draws[i][self.numpyRandom.choice(len(alphas[i]), p=alphas[i] / alphas[i].sum())] = 1.0
+                sums[i] = 1.0
+        draws /= sums[:, numpy.newaxis]
+        return draws
+
+    def _drawDirichlet(self, alpha):
+        """Draw from a Dirichlet, from the chain's own NumPy generator."""
+        return self._drawDirichlets(alpha[numpy.newaxis])[0]
+
     def proposeAllCompsDir(self, theProposal):
         gm = ['Chain.proposeAllCompsDir()']
         # all the comps in one go.
@@ -2068,13 +1992,17 @@ class Chain(object):
 
         assert not mpCur.ndch2, "allCompsDir proposal is not for ndch2"
 
-        # Make proposals, accumulate log proposal ratios in the same loop
+        # Draw all the proposals in one go
+        newVals = self._drawDirichlets(
+            theProposal.tuning[self.tempNum] * numpy.array([mt.val for mt in mpCur.comps]))
+
+        # Accumulate log proposal ratios
         self.logProposalRatio = 0.0
         for cNum in range(mpCur.nComps):
             mtCur = mpCur.comps[cNum]
             mtProp = mpProp.comps[cNum]
             # Result of the proposal goes into mtProp.val
-            p4.func.gsl_ran_dirichlet(theProposal.tuning[self.tempNum] * mtCur.val, mtProp.val)
+            mtProp.val[:] = newVals[cNum]
             while  mtProp.val.min() < var.PIVEC_MIN:
                 for i in range(mpCur.dim):
                     if mtProp.val[i] < var.PIVEC_MIN:
@@ -2104,13 +2032,17 @@ class Chain(object):
         self.logProposalRatio = 0.0
         self.logPriorRatio = 0.0
 
-        for nCur in self.curTree.iterLeavesNoRoot():
-            mtNum = nCur.parts[theProposal.pNum].compNum
+        mtNums = [nCur.parts[theProposal.pNum].compNum for nCur in self.curTree.iterLeavesNoRoot()]
+        # Draw all the proposals in one go
+        newVals = self._drawDirichlets(
+            theProposal.tuning[self.tempNum] * numpy.array([mpCur.comps[mtNum].val for mtNum in mtNums]))
+
+        for i, mtNum in enumerate(mtNums):
             mtCur = mpCur.comps[mtNum]
             mtProp = mpProp.comps[mtNum]
 
-            # Make proposals. Result of the proposal goes into mtProp.val
-            p4.func.gsl_ran_dirichlet(theProposal.tuning[self.tempNum] * mtCur.val, mtProp.val)
+            # Result of the proposal goes into mtProp.val
+            mtProp.val[:] = newVals[i]
             while  mtProp.val.min() < var.PIVEC_MIN:
                 for i in range(mpCur.dim):
                     if mtProp.val[i] < var.PIVEC_MIN:
@@ -2152,13 +2084,17 @@ class Chain(object):
         self.logProposalRatio = 0.0
         self.logPriorRatio = 0.0
 
-        for nCur in self.curTree.iterInternals():
-            mtNum = nCur.parts[theProposal.pNum].compNum
+        mtNums = [nCur.parts[theProposal.pNum].compNum for nCur in self.curTree.iterInternals()]
+        # Draw all the proposals in one go
+        newVals = self._drawDirichlets(
+            theProposal.tuning[self.tempNum] * numpy.array([mpCur.comps[mtNum].val for mtNum in mtNums]))
+
+        for i, mtNum in enumerate(mtNums):
             mtCur = mpCur.comps[mtNum]
             mtProp = mpProp.comps[mtNum]
 
-            # Make proposals. Result of the proposal goes into mtProp.val
-            p4.func.gsl_ran_dirichlet(theProposal.tuning[self.tempNum] * mtCur.val, mtProp.val)
+            # Result of the proposal goes into mtProp.val
+            mtProp.val[:] = newVals[i]
             while  mtProp.val.min() < var.PIVEC_MIN:
                 for i in range(mpCur.dim):
                     if mtProp.val[i] < var.PIVEC_MIN:
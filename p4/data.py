@@ -59,6 +59,11 @@ class Data:
         self.taxNames = []
         self.cData = None
         self.unconstrainedLogLikelihood = None
+        # Whether trees using this data store their conditional
+        # likelihoods as floats, to save memory.  Tree.clFloat, if it
+        # is set, overrides it.  Optimization then stops at float
+        # precision.  See Tree.checkClFloat().
+        self.clFloat = False
         if alignments:
             if isinstance(alignments, Alignment):
                 # Passed in a single alignment object not a list
@@ -689,7 +694,11 @@ class Data:
         It is a non-parametric bootstrap.  Data partitions are handled
         properly, that is if your data has a charpartition, the
         bootstrap has the same charpartition, and sites are sampled
-        only from the appropriate charpartition subset.  """
+        only from the appropriate charpartition subset.
+
+        If all you want is the likelihoods of the bootstrapped data,
+        bootstrapPatternCounts() is faster.
+        """
 
         gm = ['Data.bootstrap()']
 
@@ -717,6 +726,20 @@ class Data:
             d.dump()
             raise P4Error
 
+        self._checkGslRng(seed, gm)
+        pf.bootstrapData(self.cData, d.cData, var.gsl_rng)
+
+        # Data.resetSequencesFromParts() uses
+        # Alignment.resetSequencesFromParts(), which uses
+        # partSeq = pf.symbolSequences(self.parts[i].cPart)
+        # which uses thePart->sequences
+
+        d.resetSequencesFromParts()
+        return d
+
+    def _checkGslRng(self, seed, gm):
+        """Make var.gsl_rng if needed, seeded with seed or the process id."""
+
         isNewGSL_RNG = 0
         if not var.gsl_rng:
             var.gsl_rng = pf.get_gsl_rng()
@@ -737,15 +760,36 @@ class Data:
             else:
                 pf.gsl_rng_set(var.gsl_rng,  os.getpid())
 
-        pf.bootstrapData(self.cData, d.cData, var.gsl_rng)
+    def bootstrapPatternCounts(self, seed=None):
+        """Bootstrap self in place, by changing only the pattern counts.
+
+        The likelihood depends on the data only through the counts of
+        the site patterns.  So rather than making a new Data as
+        bootstrap() does, this draws the sites with replacement, and
+        sets the count of each existing pattern to the number of times
+        it was drawn.  Nothing is copied, and the patterns are not
+        re-made.  Trees with self as their data see the new counts in
+        their next likelihood calculation, as do the composition and
+        the unconstrained log like.  The sequences are unchanged.
+
+        The seed is used as in bootstrap().  To put the original
+        counts back, use resetPatternCounts().  See also
+        Tree.bootstrapOptLogLike().
+        """
 
-        # Data.resetSequencesFromParts() uses
-        # Alignment.resetSequencesFromParts(), which uses
-        # partSeq = pf.symbolSequences(self.parts[i].cPart)
-        # which uses thePart->sequences
+        gm = ['Data.bootstrapPatternCounts()']
+        if not self.cData:
+            self._setCStuff()
+        self._checkGslRng(seed, gm)
+        for p in self.parts:
+            pf.bootstrapPatternCounts(p.cPart, var.gsl_rng)
 
-        d.resetSequencesFromParts()
-        return d
+    def resetPatternCounts(self):
+        """Put back the pattern counts, after bootstrapPatternCounts()."""
+
+        if self.cData:
+            for p in self.parts:
+                pf.resetPatternCounts(p.cPart)
 
     def meanNCharsPerSite(self):
         """Mean number of different characters per site
@@ -2267,9 +2267,8 @@ def unPickleMcmc(runNum, theData, verbose=True):
     if verbose:
         print("...unpickling Mcmc in %s" % fName)
 
-    f = open(fName, 'rb')
-    m = pickle.load(f)
-    f.close()
+    from p4.mcmccheckpoint import readMcmcCheckPoint
+    m = readMcmcCheckPoint(fName)
 
     # 30 Aug 2011.  Fix for backward compatibility.  Need to add
     # modelPart.rjComp_k, comp.rj_f, and comp.rj_isInPool for pickles
@@ -2825,6 +2824,25 @@ def reseedCRandomizer(newSeed):
     pf.reseedCRandomizer(newSeed)
 
 
+def eigCacheStats(verbose=True):
+    """Hits and misses of the eigensystem cache.
+
+    Returns a tuple of (hits, misses, nEntries), counted since the
+    cache was last cleared, and prints them if verbose.  See
+    var.eigCacheSize."""
+
+    hits, misses, nEntries = pf.eigCacheStats()
+    if verbose:
+        tot = hits + misses
+        if tot:
+            pct = (100.0 * hits) / tot
+        else:
+            pct = 0.0
+        print("eig cache: %i hits, %i misses (%.1f%% hits), %i of %i entries used" % (
+            hits, misses, pct, nEntries, var.eigCacheSize))
+    return hits, misses, nEntries
+
+
 def gsl_meanVariance(seq, mean=None, variance=None):
     """Use gsl to compute both the mean and variance.
 
@@ -1,6 +1,8 @@
 from __future__ import print_function
 import p4.pf as pf
 import p4.func
+import p4.mcmccheckpoint
+from p4.mcmcdiagnostics import McmcOnlineDiagnostics
 from p4.var import var
 import math
 import random
@@ -9,14 +11,18 @@ import sys
 import time
 import copy
 import os
-import pickle
-from p4.chain import Chain
+from p4.chain import Chain, newChainNumpyRandom
 from p4.p4exceptions import P4Error
 from p4.treepartitions import TreePartitions
 from p4.constraints import Constraints
 import datetime
 import numpy
 import logging
+import multiprocessing
+import traceback
+
+# For timing proposals.  Not in Python 2.
+_timer = getattr(time, 'perf_counter', time.time)
 
 # for proposal probs
 fudgeFactor = {}
@@ -34,6 +40,261 @@ fudgeFactor['ndch2comp'] = 0.2
 fudgeFactor['ndch2alpha'] = 0.04
 
 
+def getForkContext(gm):
+    """The multiprocessing context for forking processes.
+
+    Forked processes start with a copy of everything, including the
+    c-structs, which could not be pickled and sent.  Arg gm is the
+    P4Error message list of the caller.
+    """
+    try:
+        return multiprocessing.get_context('fork')
+    except AttributeError:  # Python 2, which forks anyway
+        return multiprocessing
+    except ValueError:
+        gm.append("This needs to fork processes, which this platform does not do.")
+        raise P4Error(gm)
+
+
+def _chainTreeCopy(aTree):
+    """A copy of aTree, without its data or c-structs.
+
+    Unlike Tree.dupe(), it leaves the c-structs of aTree alone.
+    """
+    savedData = aTree._data
+    aTree._data = None
+    theCopy = copy.deepcopy(aTree)
+    aTree._data = savedData
+    # Those are aTree's c-pointers, so forget them without freeing
+    # them.
+    theCopy.cTree = None
+    for n in theCopy.nodes:
+        n.cNode = None
+    if theCopy.model:
+        theCopy.model.cModel = None
+    return theCopy
+
+
+def _chainWorker(theMcmc, chNum, conn, parentConns, equiProbableProposals, abortableProposals):
+    """The loop of a worker process.  See McmcChainWorkers."""
+
+    # Close the main process ends of the pipes, so that if the main
+    # process goes away recv() gets an EOFError.
+    for c in parentConns:
+        c.close()
+    ch = theMcmc.chains[chNum]
+    random.setstate(ch.randomState)
+    if var.gsl_rng:
+        # Otherwise all the workers would have the same GSL stream.
+        pf.gsl_rng_set(var.gsl_rng, os.getpid())
+
+    while True:
+        try:
+            msg = conn.recv()
+        except EOFError:
+            break
+        try:
+            if msg[0] == 'gen':
+                theMcmc.gen, ch.tempNum, theMcmc.chainTemp, chainTemps, tempState = msg[1:]
+                if chainTemps is not None:
+                    theMcmc.chainTemps = chainTemps
+                if tempState is not None:
+                    theMcmc._setTempState(ch.tempNum, tempState)
+                theMcmc._genChain(chNum, equiProbableProposals, abortableProposals)
+                reply = (ch.curTree.logLike, theMcmc._getTempState(ch.tempNum))
+            elif msg[0] == 'curTree':
+                reply = _chainTreeCopy(ch.curTree)
+            elif msg[0] == 'checkPoint':
+                reply = [random.getstate(), ch.numpyRandom,
+                         p4.mcmccheckpoint.getChainTreeState(ch.curTree)]
+            elif msg[0] == 'finish':
+                ch.curTree.data = None
+                ch.propTree.data = None
+                conn.send(('ok', [ch.curTree, ch.propTree, random.getstate(), ch.numpyRandom]))
+                break
+            conn.send(('ok', reply))
+        except Exception:
+            conn.send(('error', traceback.format_exc()))
+            break
+    conn.close()
+
+
+class McmcChainWorkers(object):
+    """Worker processes, one per chain, for Mcmc.run(parallelChains=True)
+
+    The workers are forked from the main process, so each starts with
+    a copy of the Mcmc, including the c-structs of its chain, and
+    after that only the worker does anything to that chain.  For each
+    generation the main process sends each worker its tempNum, and
+    gets back the logLike of its curTree, and the swaps are done in
+    the main process from those.  The chains in the main process keep
+    only their tempNums and logLikes up to date.  Trees come back to
+    the main process only when they are needed, for samples,
+    checkPoints, and at the end.
+
+    The proposal tunings and tallies belong to the temperature rather
+    than the chain (see Mcmc._getTempState()), so they are sent back
+    with each logLike, and sent to a worker when its tempNum changes.
+    """
+
+    def __init__(self, theMcmc, equiProbableProposals, abortableProposals):
+        gm = ['McmcChainWorkers()']
+
+        ctx = getForkContext(gm)
+        self.mcmc = theMcmc
+        self.conns = []
+        self.procs = []
+        # The tempNum that each worker last had.  None means that it
+        # needs to be sent the tunings and tallies.
+        self.tempNums = [None] * theMcmc.nChains
+        for chNum in range(theMcmc.nChains):
+            parentConn, childConn = ctx.Pipe()
+            proc = ctx.Process(target=_chainWorker,
+                               args=(theMcmc, chNum, childConn, self.conns + [parentConn],
+                                     equiProbableProposals, abortableProposals))
+            proc.daemon = True
+            proc.start()
+            childConn.close()
+            self.conns.append(parentConn)
+            self.procs.append(proc)
+
+        # The main process does not need the c-structs of the chains
+        # any more.
+        for ch in theMcmc.chains:
+            ch.curTree.data = None
+            ch.propTree.data = None
+
+    def _recv(self, chNum):
+        gm = ['McmcChainWorkers()']
+        try:
+            status, reply = self.conns[chNum].recv()
+        except EOFError:
+            gm.append("The worker process for chain %i went away." % chNum)
+            raise P4Error(gm)
+        if status == 'error':
+            gm.append("The worker process for chain %i failed, with" % chNum)
+            gm.append(reply)
+            raise P4Error(gm)
+        return reply
+
+    def gen(self):
+        """Do a generation in all the chains."""
+        m = self.mcmc
+        for chNum in range(m.nChains):
+            ch = m.chains[chNum]
+            tempState = None
+            if self.tempNums[chNum] != ch.tempNum:
+                tempState = m._getTempState(ch.tempNum)
+                self.tempNums[chNum] = ch.tempNum
+            self.conns[chNum].send(('gen', m.gen, ch.tempNum, m.chainTemp,
+                                    getattr(m, 'chainTemps', None), tempState))
+        for chNum in range(m.nChains):
+            ch = m.chains[chNum]
+            ch.curTree.logLike, tempState = self._recv(chNum)
+            m._setTempState(ch.tempNum, tempState)
+
+    def getCurTree(self, chNum):
+        """Get a copy of the curTree of a chain, with the data attached."""
+        self.conns[chNum].send(('curTree',))
+        aTree = self._recv(chNum)
+        aTree.data = self.mcmc.tree.data
+        return aTree
+
+    def checkPoint(self, writer=None):
+        """Get the chain states from the workers, and write a checkPoint."""
+        m = self.mcmc
+        for conn in self.conns:
+            conn.send(('checkPoint',))
+        chainStates = []
+        for chNum in range(m.nChains):
+            ch = m.chains[chNum]
+            ch.randomState, ch.numpyRandom, treeState = self._recv(chNum)
+            chainStates.append([ch.tempNum, ch.randomState, treeState, ch.numpyRandom])
+        m._checkPoint(chainStates=chainStates, writer=writer)
+        # The tallies are zeroed after a checkPoint.
+        self.tempNums = [None] * m.nChains
+
+    def finish(self):
+        """Get the chains back into the main process, and end the workers."""
+        m = self.mcmc
+        for conn in self.conns:
+            conn.send(('finish',))
+        for chNum in range(m.nChains):
+            ch = m.chains[chNum]
+            curTree, propTree, ch.randomState, ch.numpyRandom = self._recv(chNum)
+            ch.installTrees(curTree, propTree)
+        for chNum in range(m.nChains):
+            self.conns[chNum].close()
+            self.procs[chNum].join()
+
+
+
+class McmcSampleFile(object):
+    """A sample file of Mcmc.run(), kept open, with buffered writes.
+
+    It can be written to like a file, eg by Tree.writeNewick().
+    """
+
+    def __init__(self, fName):
+        self.fName = fName
+        self.f = None
+        self.buf = []
+
+    def write(self, theString):
+        self.buf.append(theString)
+
+    def flush(self):
+        if self.buf:
+            if not self.f:
+                self.f = open(self.fName, 'a')
+            self.f.write(''.join(self.buf))
+            self.f.flush()
+            self.buf = []
+
+    def close(self):
+        self.flush()
+        if self.f:
+            self.f.close()
+            self.f = None
+
+
+class McmcSampleWriters(object):
+    """The sample files of Mcmc.run()
+
+    Mcmc.run() used to open, write, and close the files for each
+    sample, which is slow on some file systems.  The samples are now
+    buffered, and flushed every var.mcmc_sampleFlushInterval samples
+    or after var.mcmc_sampleFlushSeconds, whichever is first, as well
+    as at checkPoints and when run() finishes or fails.
+    """
+
+    def __init__(self, theMcmc):
+        self.likesFile = McmcSampleFile(theMcmc.likesFileName)
+        self.treeFile = McmcSampleFile(theMcmc.treeFileName)
+        self.pramsFile = McmcSampleFile(theMcmc.pramsFileName)
+        self.hypersFile = McmcSampleFile(theMcmc.hypersFileName)
+        self.files = [self.likesFile, self.treeFile, self.pramsFile, self.hypersFile]
+        self.nSamples = 0
+        self.lastFlushTime = time.time()
+
+    def sampleDone(self):
+        """Flush, if it is time."""
+        self.nSamples += 1
+        if self.nSamples >= var.mcmc_sampleFlushInterval or \
+                time.time() - self.lastFlushTime >= var.mcmc_sampleFlushSeconds:
+            self.flush()
+
+    def flush(self):
+        for f in self.files:
+            f.flush()
+        self.nSamples = 0
+        self.lastFlushTime = time.time()
+
+    def close(self):
+        for f in self.files:
+            f.close()
+
+
 class McmcTuningsPart(object):
 
     def __init__(self, partNum):
@@ -201,6 +462,18 @@ class Proposal(object):
         self.tnFactorLo = None
         self.tnFactorVeryLo = None
 
+        # For adapting the weight during the burnin, by temperature.
+        # See Mcmc.adaptProposalWeightsBurnin.
+        self.weightFactor = [1.0] * theMcmc.nChains
+        self.adNProposals = [0] * theMcmc.nChains
+        self.adNAccepts = [0.0] * theMcmc.nChains
+        self.adSeconds = [0.0] * theMcmc.nChains
+
+        # For var.mcmc_profileProposals, by temperature.  See
+        # Mcmc.writeProposalProfile().
+        for name in Mcmc._profStateNames:
+            setattr(self, name, [0] * theMcmc.nChains)
+
     def dump(self):
         print("proposal name=%-10s pNum=%2s, weight=%s, tuning=%s" % (
             '%s,' % self.name, self.pNum, self.weight, self.tuning))
@@ -248,6 +521,9 @@ class Proposals(object):
         self.cumPropWeights = []
         self.totalPropWeights = 0.0
         self.intended = None
+        # Cumulative weights by tempNum, with the adapted
+        # Proposal.weightFactors.  Only made if the weights are adapted.
+        self.cumPropWeightsByTemp = {}
 
     def summary(self):
         print("There are %i proposals" % len(self.proposals))
@@ -277,13 +553,27 @@ class Proposals(object):
             raise P4Error("bad sum of intended proposal probs. %s" % sum(self.intended))
         #print(self.intended)
 
-    def chooseProposal(self, equiProbableProposals):
+    def calculateTempWeights(self, tempNum):
+        """Make the cumulative weights for tempNum, with the weightFactors."""
+        cumWeights = []
+        theSum = 0.0
+        for p in self.proposals:
+            theSum += p.weight * p.weightFactor[tempNum]
+            cumWeights.append(theSum)
+        self.cumPropWeightsByTemp[tempNum] = cumWeights
+
+    def chooseProposal(self, equiProbableProposals, tempNum=None):
         if equiProbableProposals:
             return random.choice(self.proposals)
         else:
-            theRan = random.uniform(0.0, self.totalPropWeights)
-            for i in range(len(self.cumPropWeights)):
-                if theRan < self.cumPropWeights[i]:
+            cumWeights = self.cumPropWeightsByTemp.get(tempNum)
+            if cumWeights:
+                theRan = random.uniform(0.0, cumWeights[-1])
+            else:
+                theRan = random.uniform(0.0, self.totalPropWeights)
+                cumWeights = self.cumPropWeights
+            for i in range(len(cumWeights)):
+                if theRan < cumWeights[i]:
                     break
             return self.proposals[i]
         
@@ -491,7 +781,7 @@ class Mcmc(object):
 
     checkPointInterval
                   Intervals at which the MCMC is checkpointed,
-                  meaning that the whole thing is written to a pickle
+                  meaning that the whole thing is written to a checkPoint
                   file.  You can re-start from a checkpoint, eg in the
                   event of a crash, or if you just want to make the
                   MCMC run longer.  You can turn off checkPointing by
@@ -544,13 +834,34 @@ class Mcmc(object):
 
     Whenever the current generation number is evenly divisible by the
     checkPointInterval it will write a checkPoint file.  A checkPoint
-    file is the whole MCMC without the data, and without C-structs.
-    Using a checkPoint, you can re-start an Mcmc from the point you
+    file is the whole MCMC without the data, and without C-structs,
+    with the chains and the tree partitions in a compact form (see
+    p4.mcmccheckpoint).  Using a checkPoint, you can re-start an Mcmc from the point you
     left off.  Or, in the event of a crash, you can restart from the
     latest checkPoint.  You can query checkPoints to get information
     about how the chain has been running, and about convergence
     diagnostics.
 
+    To have the checkPoints written in a background thread, so that
+    the run does not wait for them, set var.mcmc_checkPointAsync.
+    They can be compressed with var.mcmc_checkPointCompression = 'zlib'.
+
+    To follow ESSs, autocorrelations, and changes in split supports
+    while it runs, set var.mcmc_onlineDiagnostics (see
+    p4.mcmcdiagnostics.McmcOnlineDiagnostics).
+
+    The proposal weights can be adapted during a burnin, so that
+    proposals that get more acceptances per second of CPU time are
+    made more often, eg::
+
+        m.adaptProposalWeightsBurnin = 100000
+
+    After that gen they are fixed.  See Mcmc._adaptProposalWeights().
+
+    To see where the time goes, set var.mcmc_profileProposals.  Then
+    the wall time of each proposal, and the likelihood work that it
+    causes, are tallied, and can be had from writeProposalProfile().
+
     In order to restart the MCMC from the end of a previous run, you
     need the data::
 
@@ -749,6 +1060,9 @@ class Mcmc(object):
 
 
         self.treePartitions = None
+        # The finished treePartitions of the last checkPoint, for
+        # McmcMultiRun.  Not itself checkPointed.
+        self.checkPointTreePartitions = None
         self.likesFileName = "mcmc_likes_%i" % runNum
         self.treeFileName = "mcmc_trees_%i.nex" % runNum
         self.simFileName = "mcmc_sims_%i" % runNum
@@ -758,6 +1072,11 @@ class Mcmc(object):
         self.writeHypers = True
 
         self.lastTimeCheck = None
+        # See McmcOnlineDiagnostics, and var.mcmc_onlineDiagnostics
+        self.onlineDiagnostics = None
+        # The number of gens at the start during which the proposal
+        # weights are adapted.  See _adaptProposalWeights().
+        self.adaptProposalWeightsBurnin = 0
 
         if simulate:
             try:
@@ -1818,8 +2137,15 @@ class Mcmc(object):
                 p.dump()
             # return
 
-    def run(self, nGensToDo, verbose=True, equiProbableProposals=False, writeSamples=True):
-        """Start the Mcmc running."""
+    def run(self, nGensToDo, verbose=True, equiProbableProposals=False, writeSamples=True, parallelChains=False):
+        """Start the Mcmc running.
+
+        If arg *parallelChains* is set, and there is more than one
+        chain, each chain runs in its own forked process (see
+        McmcChainWorkers).  Each chain has its own random streams,
+        Python and NumPy (see Chain.numpyRandom), so the run does the
+        same thing either way.
+        """
 
         gm = ['Mcmc.run()']
 
@@ -1998,6 +2324,8 @@ class Mcmc(object):
                 print("Arg 'equiProbableProposals' is turned on")
             if self.checkPointInterval:
                 print("CheckPoints written every %i." % self.checkPointInterval)
+                if var.mcmc_checkPointAsync:
+                    print("CheckPoints are written in the background.")
             if nGensToDo <= 20000:
                 print("One dot is 100 generations.")
             else:
@@ -2013,428 +2341,636 @@ class Mcmc(object):
             # 1 means do all
             pf.p4_copyBigPDecks(ch.curTree.cTree, ch.propTree.cTree, 1)
             ch.verifyIdentityOfTwoTreesInChain()
+            # Each chain has its own random stream, so that the chains
+            # do the same thing whether or not they are parallel.
+            if getattr(ch, 'randomState', None) is None:
+                ch.randomState = random.Random(random.getrandbits(64)).getstate()
+            if getattr(ch, 'numpyRandom', None) is None:
+                # Seeded from the chain's own stream, without using it.
+                r = random.Random()
+                r.setstate(ch.randomState)
+                ch.numpyRandom = newChainNumpyRandom(r.getrandbits(32))
+        # And the swaps have their own, so that a re-start from a
+        # checkPoint carries on as if there had been no stop.
+        if getattr(self, 'randomState', None) is None:
+            self.randomState = random.Random(random.getrandbits(64)).getstate()
+
+        # Old checkPoints do not have the things for adapting the
+        # proposal weights.
+        if not hasattr(self, 'adaptProposalWeightsBurnin'):
+            self.adaptProposalWeightsBurnin = 0
+        if not hasattr(self.props, 'cumPropWeightsByTemp'):
+            self.props.cumPropWeightsByTemp = {}
+        for p in self.props.proposals:
+            if not hasattr(p, 'weightFactor'):
+                p.weightFactor = [1.0] * self.nChains
+                p.adNProposals = [0] * self.nChains
+                p.adNAccepts = [0.0] * self.nChains
+                p.adSeconds = [0.0] * self.nChains
+            if not hasattr(p, 'profSeconds'):
+                for name in self._profStateNames:
+                    setattr(p, name, [0] * self.nChains)
+        if self.adaptProposalWeightsBurnin:
+            for tempNum in range(self.nChains):
+                self.props.calculateTempWeights(tempNum)
+            if verbose and self.gen + 1 < self.adaptProposalWeightsBurnin:
+                print("Adapting the proposal weights until gen+1 %i." % self.adaptProposalWeightsBurnin)
 
         abortableProposals = ['local', 'polytomy', 'compLocation',
                               'rMatrixLocation', 'gdasrvLocation', 'rjComp', 'rjRMatrix']
 
+        workers = None
+        if parallelChains and self.nChains > 1:
+            workers = McmcChainWorkers(self, equiProbableProposals, abortableProposals)
+            if verbose:
+                print("Running the %i chains in parallel processes." % self.nChains)
+
         ##################################################
         ############### Main loop ########################
         ##################################################
 
-        for gNum in range(nGensToDo):
-            self.gen += 1
-
-            # Do an initial time estimate based on 100 gens
-            if nGensToDo > 100 and self.gen - firstGen == 100:
-                diff_secs = time.time() - realTimeStart
-                total_secs = (float(nGensToDo) / float(100)) * float(diff_secs)
-                deltaTime = datetime.timedelta(seconds=int(round(total_secs)))
-                print("Estimated completion time: %s days, %s" % (
-                    deltaTime.days, time.strftime("%H:%M:%S", time.gmtime(deltaTime.seconds))))
-
-            # Above is a list of proposals where it is possible to abort.
-            # When a gen(aProposal) is made, below, aProposal.doAbort
-            # might be set, in which case we want to skip it for this
-            # gen.  But we want to start each 'for chNum' loop with
-            # doAborts all turned off.
-
-            for chNum in range(self.nChains):
-                failure = True
-                nAttempts = 0
-                while failure:
-                    # Choose a proposal
-                    gotIt = False
-                    safety = 0
-                    while not gotIt:
-                        # equiProbableProposals is True or False.  Usually False.
-                        aProposal = self.props.chooseProposal(equiProbableProposals)
-                        if aProposal:
-                            gotIt = True
-
-                        if aProposal.name == 'local':
-                            # Can't do local on a star tree.
-                            if self.chains[chNum].curTree.nInternalNodes == 1:
-                                #aProposal = self.proposalsHash['brLen']
-                                gotIt = False
-
-                        elif aProposal.name == 'root3':
-                            # Can't do root3 on a star tree.
-                            if self.chains[chNum].curTree.nInternalNodes == 1:
-                                gotIt = False
-
-                        if aProposal.doAbort:
-                            gotIt = False
-
-                        safety += 1
-                        if safety > 1000:
-                            gm.append("Could not find a proposal after %i attempts." % safety)
-                            gm.append("Possibly a programming error.")
-                            gm.append("Or possibly it is just a pathologically frustrating Mcmc.")
-                            raise P4Error(gm)
-
-                    if 0:
-                        print("==== gNum=%i, chNum=%i, aProposal=%s (part %i)" % (
-                            gNum, chNum, aProposal.name, aProposal.pNum), end=' ')
-                        sys.stdout.flush()
-                        # print gNum,
-
-                    # success returns None
-                    failure = self.chains[chNum].gen(aProposal)
-
-                    if failure:
-                        myWarn = "Mcmc.run() main loop.  Proposal %s generated a 'failure'.  Why?" % aProposal.name
-                        self.logger.warning(myWarn)
-
-                    nAttempts += 1
-                    if nAttempts > 1000:
-                        gm.append("Was not able to do a successful generation after %i attempts." % nAttempts)
-                        raise P4Error(gm)
-
-                    # Continuous tuning.  We have a tuning, and propose/accept
-                    # tallies for each temperature, kept separately.  Note that
-                    # since chNum does not equal tempNum, the most recently
-                    # incremented values (and the ones we want to tune now) will
-                    # be aProposal.tnNSamples[tempNum] and
-                    # aProposal.tnNAccepts[tempNum], where tempNum will most
-                    # likely not be chNum.  So we get the tempNum from this
-                    # chNum, and tune it.
-                    
-                    # tunables = """allBrLens allCompsDir brLen compDir 
-                    # gdasrv local ndch2_internalCompsDir 
-                    # ndch2_internalCompsDirAlpha ndch2_leafCompsDir 
-                    # ndch2_leafCompsDirAlpha pInvar rMatrixDir relRate """.split()
-
-                    # maybeTunablesButNotNow  compLocation eTBR polytomy root3 rMatrixLocation
-
-                    if aProposal.name in self.tunableProps:
-                        tempNum = self.chains[chNum].tempNum
-                        if aProposal.tnNSamples[tempNum] >= aProposal.tnSampleSize:
-                            aProposal.tune(tempNum)
-
-                # print "   Mcmc.run(). finished a gen on chain %i" % (chNum)
-                for prNm in abortableProposals:
-                    ret = self.props.proposalsDict.get(prNm)
-                    if ret:
-                        ret.doAbort = False
-
-            # Do swap, if there is more than 1 chain.
-            if self.nChains == 1:
-                coldChain = 0
-            else:
-                if var.mcmc_swapVector:
-                    rTempNum1 = random.randrange(self.nChains - 1)
-                    rTempNum2 = rTempNum1 + 1
-                    chain1 = None
-                    chain2 = None
-                    for ch in self.chains:
-                        if ch.tempNum == rTempNum1:
-                            chain1 = ch
-                        elif ch.tempNum == rTempNum2:
-                            chain2 = ch
-                    assert chain1 and chain2
+        # The sample files are kept open while running, see
+        # McmcSampleWriters.
+        sampleWriters = McmcSampleWriters(self)
+        # Running convergence diagnostics, kept with the Mcmc so that
+        # they carry on after a re-start.
+        diagnostics = None
+        if var.mcmc_onlineDiagnostics:
+            if not getattr(self, 'onlineDiagnostics', None):
+                self.onlineDiagnostics = McmcOnlineDiagnostics(
+                    nBatches=var.mcmc_onlineDiagnosticsNBatches)
+            diagnostics = self.onlineDiagnostics
+        # Maybe the checkPoints are written in the background, see
+        # p4.mcmccheckpoint.McmcCheckPointWriter.
+        checkPointWriter = None
+        if self.checkPointInterval and var.mcmc_checkPointAsync:
+            checkPointWriter = p4.mcmccheckpoint.McmcCheckPointWriter(
+                maxPending=var.mcmc_checkPointMaxPending,
+                compression=var.mcmc_checkPointCompression)
+        try:
+            for gNum in range(nGensToDo):
+                self.gen += 1
+
+                # Do an initial time estimate based on 100 gens
+                if nGensToDo > 100 and self.gen - firstGen == 100:
+                    diff_secs = time.time() - realTimeStart
+                    total_secs = (float(nGensToDo) / float(100)) * float(diff_secs)
+                    deltaTime = datetime.timedelta(seconds=int(round(total_secs)))
+                    print("Estimated completion time: %s days, %s" % (
+                        deltaTime.days, time.strftime("%H:%M:%S", time.gmtime(deltaTime.seconds))))
+
+                if workers:
+                    workers.gen()
+                else:
+                    mainRandomState = random.getstate()
+                    for chNum in range(self.nChains):
+                        ch = self.chains[chNum]
+                        random.setstate(ch.randomState)
+                        self._genChain(chNum, equiProbableProposals, abortableProposals)
+                        ch.randomState = random.getstate()
+                    random.setstate(mainRandomState)
+
+                if self.gen + 1 == self.adaptProposalWeightsBurnin:
+                    self.logger.info("Proposal weights fixed from gen+1 %i" % (self.gen + 1))
+                    for tempNum in range(self.nChains):
+                        self.logger.info("  tempNum %i weightFactors %s" % (tempNum, ' '.join(
+                            ["%s=%.3f" % (p.name, p.weightFactor[tempNum]) for p in self.props.proposals])))
+
+                # Do swap, if there is more than 1 chain.
+                if self.nChains == 1:
+                    coldChain = 0
+                else:
+                    mainRandomState = random.getstate()
+                    random.setstate(self.randomState)
+                    if var.mcmc_swapVector:
+                        rTempNum1 = random.randrange(self.nChains - 1)
+                        rTempNum2 = rTempNum1 + 1
+                        chain1 = None
+                        chain2 = None
+                        for ch in self.chains:
+                            if ch.tempNum == rTempNum1:
+                                chain1 = ch
+                            elif ch.tempNum == rTempNum2:
+                                chain2 = ch
+                        assert chain1 and chain2
                     
-                    # Use the upper triangle of swapMatrix for nAttempts
-                    self.swapMatrix[chain1.tempNum][chain2.tempNum] += 1
-
-                    lnR = (1.0 / (1.0 + (self.chainTemps[chain1.tempNum]))
-                            ) * chain2.curTree.logLike
-                    lnR += (1.0 / (1.0 + (self.chainTemps[chain2.tempNum]))
-                            ) * chain1.curTree.logLike
-                    lnR -= (1.0 / (1.0 + (self.chainTemps[chain1.tempNum]))
-                            ) * chain1.curTree.logLike
-                    lnR -= (1.0 / (1.0 + (self.chainTemps[chain2.tempNum]))
-                            ) * chain2.curTree.logLike
-
-                    if lnR < -100.0:
-                        r = 0.0
-                    elif lnR >= 0.0:
-                        r = 1.0
-                    else:
-                        r = math.exp(lnR)
+                        # Use the upper triangle of swapMatrix for nAttempts
+                        self.swapMatrix[chain1.tempNum][chain2.tempNum] += 1
 
-                    acceptSwap = 0
-                    if random.random() < r:
-                        acceptSwap = 1
+                        lnR = (1.0 / (1.0 + (self.chainTemps[chain1.tempNum]))
+                                ) * chain2.curTree.logLike
+                        lnR += (1.0 / (1.0 + (self.chainTemps[chain2.tempNum]))
+                                ) * chain1.curTree.logLike
+                        lnR -= (1.0 / (1.0 + (self.chainTemps[chain1.tempNum]))
+                                ) * chain1.curTree.logLike
+                        lnR -= (1.0 / (1.0 + (self.chainTemps[chain2.tempNum]))
+                                ) * chain2.curTree.logLike
+
+                        if lnR < -100.0:
+                            r = 0.0
+                        elif lnR >= 0.0:
+                            r = 1.0
+                        else:
+                            r = math.exp(lnR)
+
+                        acceptSwap = 0
+                        if random.random() < r:
+                            acceptSwap = 1
+
+                        # for continuous temperature tuning with self.swapTuner
+                        if self.swapTuner:
+                            # Index the nAttempts and nSwaps with the lower of the two tempNum's, which would be chain1.tempNum
+                            self.swapTuner.nAttempts[chain1.tempNum] += 1
+                            if acceptSwap:
+                                self.swapTuner.nSwaps[chain1.tempNum] += 1
+                            if self.swapTuner.nAttempts[chain1.tempNum] >= var.mcmc_swapTunerSampleSize:
+                                self.swapTuner.tune(chain1.tempNum)
+                                # tune() zeros nAttempts and nSwaps counters
 
-                    # for continuous temperature tuning with self.swapTuner
-                    if self.swapTuner:
-                        # Index the nAttempts and nSwaps with the lower of the two tempNum's, which would be chain1.tempNum
-                        self.swapTuner.nAttempts[chain1.tempNum] += 1
                         if acceptSwap:
-                            self.swapTuner.nSwaps[chain1.tempNum] += 1
-                        if self.swapTuner.nAttempts[chain1.tempNum] >= var.mcmc_swapTunerSampleSize:
-                            self.swapTuner.tune(chain1.tempNum)
-                            # tune() zeros nAttempts and nSwaps counters
-
-                    if acceptSwap:
-                        # Use the lower triangle of swapMatrix to keep track of
-                        # nAccepted's
-                        assert chain1.tempNum < chain2.tempNum
-                        self.swapMatrix[chain2.tempNum][chain1.tempNum] += 1
-
-                        # Do the swap
-                        chain1.tempNum, chain2.tempNum = chain2.tempNum, chain1.tempNum
-
-                else:    # swap matrix
-                    # Chain swapping stuff was lifted from MrBayes.  Thanks again.
-                    chain1, chain2 = random.sample(self.chains, 2)
-
-                    thisCh1Temp = None
-                    thisCh2Temp = None
-                    # Use the upper triangle of swapMatrix for nProposed's
-                    if chain1.tempNum < chain2.tempNum:
-                        self.swapMatrix[chain1.tempNum][chain2.tempNum] += 1
-                        thisCh1Temp = chain1.tempNum
-                        thisCh2Temp = chain2.tempNum
-                    else:
-                        self.swapMatrix[chain2.tempNum][chain1.tempNum] += 1
-                        thisCh1Temp = chain2.tempNum
-                        thisCh2Temp = chain1.tempNum
-
-
-                    lnR = (1.0 / (1.0 + (self.chainTemp * chain1.tempNum))
-                            ) * chain2.curTree.logLike
-                    lnR += (1.0 / (1.0 + (self.chainTemp * chain2.tempNum))
-                            ) * chain1.curTree.logLike
-                    lnR -= (1.0 / (1.0 + (self.chainTemp * chain1.tempNum))
-                            ) * chain1.curTree.logLike
-                    lnR -= (1.0 / (1.0 + (self.chainTemp * chain2.tempNum))
-                            ) * chain2.curTree.logLike
-
-                    if lnR < -100.0:
-                        r = 0.0
-                    elif lnR >= 0.0:
-                        r = 1.0
-                    else:
-                        r = math.exp(lnR)
+                            # Use the lower triangle of swapMatrix to keep track of
+                            # nAccepted's
+                            assert chain1.tempNum < chain2.tempNum
+                            self.swapMatrix[chain2.tempNum][chain1.tempNum] += 1
 
-                    acceptSwap = 0
-                    if random.random() < r:
-                        acceptSwap = 1
+                            # Do the swap
+                            chain1.tempNum, chain2.tempNum = chain2.tempNum, chain1.tempNum
 
-                    # for continuous temperature tuning with self.swapTuner
-                    if self.swapTuner and thisCh1Temp == 0 and thisCh2Temp == 1:
-                        self.swapTuner.swaps01_nAttempts += 1
-                        if acceptSwap:
-                            self.swapTuner.swaps01_nSwaps += 1
-                        if self.swapTuner.swaps01_nAttempts >= self.swapTuner.sampleSize:
-                            self.swapTuner.tune(self)
-                            # tune() zeros nAttempts and nSwaps counters
-
-                    if acceptSwap:
-                        # Use the lower triangle of swapMatrix to keep track of
-                        # nAccepted's
+                    else:    # swap matrix
+                        # Chain swapping stuff was lifted from MrBayes.  Thanks again.
+                        chain1, chain2 = random.sample(self.chains, 2)
+
+                        thisCh1Temp = None
+                        thisCh2Temp = None
+                        # Use the upper triangle of swapMatrix for nProposed's
                         if chain1.tempNum < chain2.tempNum:
+                            self.swapMatrix[chain1.tempNum][chain2.tempNum] += 1
+                            thisCh1Temp = chain1.tempNum
+                            thisCh2Temp = chain2.tempNum
+                        else:
                             self.swapMatrix[chain2.tempNum][chain1.tempNum] += 1
+                            thisCh1Temp = chain2.tempNum
+                            thisCh2Temp = chain1.tempNum
+
+
+                        lnR = (1.0 / (1.0 + (self.chainTemp * chain1.tempNum))
+                                ) * chain2.curTree.logLike
+                        lnR += (1.0 / (1.0 + (self.chainTemp * chain2.tempNum))
+                                ) * chain1.curTree.logLike
+                        lnR -= (1.0 / (1.0 + (self.chainTemp * chain1.tempNum))
+                                ) * chain1.curTree.logLike
+                        lnR -= (1.0 / (1.0 + (self.chainTemp * chain2.tempNum))
+                                ) * chain2.curTree.logLike
+
+                        if lnR < -100.0:
+                            r = 0.0
+                        elif lnR >= 0.0:
+                            r = 1.0
                         else:
-                            self.swapMatrix[chain1.tempNum][chain2.tempNum] += 1
+                            r = math.exp(lnR)
 
-                        # Do the swap
-                        chain1.tempNum, chain2.tempNum = chain2.tempNum, chain1.tempNum
+                        acceptSwap = 0
+                        if random.random() < r:
+                            acceptSwap = 1
 
-                # Find the cold chain, the one where tempNum is 0
-                coldChainNum = -1
-                for i in range(len(self.chains)):
-                    if self.chains[i].tempNum == 0:
-                        coldChainNum = i
-                        break
-                if coldChainNum == -1:
-                    gm.append("Unable to find which chain is the cold chain.  Bad.")
-                    raise P4Error(gm)
+                        # for continuous temperature tuning with self.swapTuner
+                        if self.swapTuner and thisCh1Temp == 0 and thisCh2Temp == 1:
+                            self.swapTuner.swaps01_nAttempts += 1
+                            if acceptSwap:
+                                self.swapTuner.swaps01_nSwaps += 1
+                            if self.swapTuner.swaps01_nAttempts >= self.swapTuner.sampleSize:
+                                self.swapTuner.tune(self)
+                                # tune() zeros nAttempts and nSwaps counters
 
-            # If it is a writeInterval, write stuff
-            if (self.gen + 1) % self.sampleInterval == 0:
-                if writeSamples:
-                    likesFile = open(self.likesFileName, 'a')
-                    likesFile.write(
-                        '%11i %f\n' % (self.gen + 1, self.chains[coldChainNum].curTree.logLike))
-                    likesFile.close()
-
-                    # Check the likelihood every write interval
-                    if 0:
-                        oldLike = self.chains[coldChainNum].curTree.logLike
-                        print("gen+1 %11i  %f  " % (
-                            self.gen+1, 
-                            self.chains[coldChainNum].curTree.logLike), end=' ')
-                        self.chains[coldChainNum].curTree.calcLogLike(verbose=False)
-                        newLike = self.chains[coldChainNum].curTree.logLike
-                        print("%f" % self.chains[coldChainNum].curTree.logLike, end=' ')
-                        likeDiff = math.fabs(oldLike - newLike)
-                        if likeDiff > 1e-14:
-                            print("%f" % likeDiff)
-                        else:
-                            print()
+                        if acceptSwap:
+                            # Use the lower triangle of swapMatrix to keep track of
+                            # nAccepted's
+                            if chain1.tempNum < chain2.tempNum:
+                                self.swapMatrix[chain2.tempNum][chain1.tempNum] += 1
+                            else:
+                                self.swapMatrix[chain1.tempNum][chain2.tempNum] += 1
+
+                            # Do the swap
+                            chain1.tempNum, chain2.tempNum = chain2.tempNum, chain1.tempNum
+
+                    self.randomState = random.getstate()
+                    random.setstate(mainRandomState)
+
+                    # Find the cold chain, the one where tempNum is 0
+                    coldChainNum = -1
+                    for i in range(len(self.chains)):
+                        if self.chains[i].tempNum == 0:
+                            coldChainNum = i
+                            break
+                    if coldChainNum == -1:
+                        gm.append("Unable to find which chain is the cold chain.  Bad.")
+                        raise P4Error(gm)
+
+                # If it is a writeInterval, write stuff
+                if (self.gen + 1) % self.sampleInterval == 0:
+                    if workers:
+                        sampleTree = workers.getCurTree(coldChainNum)
+                    else:
+                        sampleTree = self.chains[coldChainNum].curTree
+                    if writeSamples:
+                        sampleWriters.likesFile.write(
+                            '%11i %f\n' % (self.gen + 1, sampleTree.logLike))
+
+                        # Check the likelihood every write interval
+                        if 0:
+                            oldLike = sampleTree.logLike
+                            print("gen+1 %11i  %f  " % (
+                                self.gen+1, 
+                                sampleTree.logLike), end=' ')
+                            sampleTree.calcLogLike(verbose=False)
+                            newLike = sampleTree.logLike
+                            print("%f" % sampleTree.logLike, end=' ')
+                            likeDiff = math.fabs(oldLike - newLike)
+                            if likeDiff > 1e-14:
+                                print("%f" % likeDiff)
+                            else:
+                                print()
                                                                   
 
-                    treeFile = open(self.treeFileName, 'a')
-                    treeFile.write("  tree t_%i = [&U] " % (self.gen + 1))
-                    if self.tree.model.parts[0].ndch2:     # and therefore all model parts
-                        if self.tree.model.parts[0].ndch2_writeComps:
-                            self.chains[coldChainNum].curTree.writeNewick(treeFile,
-                                                                          withTranslation=1,
-                                                                          translationHash=self.translationHash,
-                                                                          doMcmcCommandComments=True)
+                        treeFile = sampleWriters.treeFile
+                        treeFile.write("  tree t_%i = [&U] " % (self.gen + 1))
+                        if self.tree.model.parts[0].ndch2:     # and therefore all model parts
+                            if self.tree.model.parts[0].ndch2_writeComps:
+                                sampleTree.writeNewick(treeFile,
+                                                                              withTranslation=1,
+                                                                              translationHash=self.translationHash,
+                                                                              doMcmcCommandComments=True)
+                            else:
+                                sampleTree.writeNewick(treeFile,
+                                                                              withTranslation=1,
+                                                                              translationHash=self.translationHash,
+                                                                              doMcmcCommandComments=False)
+
                         else:
-                            self.chains[coldChainNum].curTree.writeNewick(treeFile,
+                            sampleTree.writeNewick(treeFile,
                                                                           withTranslation=1,
                                                                           translationHash=self.translationHash,
-                                                                          doMcmcCommandComments=False)
-
+                                                                          doMcmcCommandComments=self.tree.model.isHet)
+
+                    if writeSamples and self.writePrams:
+                        pramsFile = sampleWriters.pramsFile
+                        #pramsFile.write("%12i " % (self.gen + 1))
+                        pramsFile.write("%12i" % (self.gen + 1))
+                        sampleTree.model.writePramsLine(pramsFile)
+
+                    if writeSamples and self.writeHypers:
+                        hypersFile = sampleWriters.hypersFile
+                        hypersFile.write("%12i" % (self.gen + 1))
+                        sampleTree.model.writeHypersLine(hypersFile)
+                    sampleWriters.sampleDone()
+                    if diagnostics:
+                        diagnostics.addSample(sampleTree)
+
+                    # Do a simulation
+                    if self.simulate:
+                        # print "about to simulate..."
+                        self._doSimulate(sampleTree)
+                        # print "...finished simulate."
+
+                    # Do other stuff.
+                    if hasattr(self, 'hook'):
+                        self.hook(sampleTree)
+
+                    if 0 and self.constraints:
+                        print("Mcmc x1c")
+                        print(self.chains[0].verifyIdentityOfTwoTreesInChain())
+                        print("b checking curTree ..")
+                        self.chains[0].curTree.checkSplitKeys()
+                        print("b checking propTree ...")
+                        self.chains[0].propTree.checkSplitKeys()
+                        print("Mcmc xxx")
+
+                    # Add curTree to treePartitions
+                    if self.treePartitions:
+                        self.treePartitions._getSplitsFromTree(
+                            sampleTree)
                     else:
-                        self.chains[coldChainNum].curTree.writeNewick(treeFile,
-                                                                      withTranslation=1,
-                                                                      translationHash=self.translationHash,
-                                                                      doMcmcCommandComments=self.tree.model.isHet)
-                    treeFile.close()
-
-                if writeSamples and self.writePrams:
-                    pramsFile = open(self.pramsFileName, 'a')
-                    #pramsFile.write("%12i " % (self.gen + 1))
-                    pramsFile.write("%12i" % (self.gen + 1))
-                    self.chains[coldChainNum].curTree.model.writePramsLine(pramsFile)
-                    pramsFile.close()
-
-                if writeSamples and self.writeHypers:
-                    hypersFile = open(self.hypersFileName, 'a')
-                    hypersFile.write("%12i" % (self.gen + 1))
-                    self.chains[coldChainNum].curTree.model.writeHypersLine(hypersFile)
-                    hypersFile.close()
-
-                # Do a simulation
-                if self.simulate:
-                    # print "about to simulate..."
-                    self._doSimulate(self.chains[coldChainNum].curTree)
-                    # print "...finished simulate."
-
-                # Do other stuff.
-                if hasattr(self, 'hook'):
-                    self.hook(self.chains[coldChainNum].curTree)
-
-                if 0 and self.constraints:
-                    print("Mcmc x1c")
-                    print(self.chains[0].verifyIdentityOfTwoTreesInChain())
-                    print("b checking curTree ..")
-                    self.chains[0].curTree.checkSplitKeys()
-                    print("b checking propTree ...")
-                    self.chains[0].propTree.checkSplitKeys()
-                    print("Mcmc xxx")
-
-                # Add curTree to treePartitions
-                if self.treePartitions:
-                    self.treePartitions._getSplitsFromTree(
-                        self.chains[coldChainNum].curTree)
-                else:
-                    self.treePartitions = TreePartitions(
-                        self.chains[coldChainNum].curTree)
-                # After _getSplitsFromTree, need to follow, at some point,
-                # with _finishSplits().  Do that when it is pickled, or at the
-                # end of the run.
-
-                # Checking and debugging constraints
-                if 0 and self.constraints:
-                    print("Mcmc x1d")
-                    print(self.chains[coldChainNum].verifyIdentityOfTwoTreesInChain())
-                    print("c checking curTree ...")
-                    self.chains[coldChainNum].curTree.checkSplitKeys()
-                    print("c checking propTree ...")
-                    self.chains[coldChainNum].propTree.checkSplitKeys()
-                    # print "c checking that all constraints are present"
-                    #theSplits = [n.br.splitKey for n in self.chains[0].curTree.iterNodesNoRoot()]
-                    # for sk in self.constraints.constraints:
-                    #    if sk not in theSplits:
-                    #        gm.append("split %i is not present in the curTree." % sk)
-                    #        raise P4Error(gm)
-                    print("Mcmc zzz")
-
-                # Check that the curTree has all the constraints
-                if self.constraints:
-                    splitsInCurTree = [
-                        n.br.splitKey for n in self.chains[coldChainNum].curTree.iterInternalsNoRoot()]
-                    for sk in self.constraints.constraints:
-                        if sk not in splitsInCurTree:
-                            gm.append("Programming error.")
-                            gm.append(
-                                "The current tree (the last tree sampled) does not contain constraint")
-                            gm.append(
-                                "%s" % p4.func.getSplitStringFromKey(sk, self.tree.nTax))
-                            raise P4Error(gm)
-
-                # If it is a checkPointInterval, pickle
-                if self.checkPointInterval and (self.gen + 1) % self.checkPointInterval == 0:
-                    self._checkPoint()
-
-                    # The stuff below needs to be done in a re-start as well.
-                    # See above "if self.proposals:"
-                    self.startMinusOne = self.gen
-
-                    # Start the tree partitions over.
-                    self.treePartitions = None
-                    # Zero the proposal counts
-                    for p in self.props.proposals:
-                        p.nProposals = [0] * self.nChains
-                        p.nAcceptances = [0] * self.nChains
-                        p.nTopologyChangeAttempts = [0] * self.nChains
-                        p.nTopologyChanges = [0] * self.nChains
-                        p.nAborts = [0] * self.nChains
-                    # Zero the swap matrix
-                    if self.nChains > 1:
-                        self.swapMatrix = []
-                        for i in range(self.nChains):
-                            self.swapMatrix.append([0] * self.nChains)
+                        self.treePartitions = TreePartitions(
+                            sampleTree)
+                    # After _getSplitsFromTree, need to follow, at some point,
+                    # with _finishSplits().  Do that when it is pickled, or at the
+                    # end of the run.
+
+                    # Checking and debugging constraints
+                    if 0 and self.constraints:
+                        print("Mcmc x1d")
+                        print(self.chains[coldChainNum].verifyIdentityOfTwoTreesInChain())
+                        print("c checking curTree ...")
+                        sampleTree.checkSplitKeys()
+                        print("c checking propTree ...")
+                        self.chains[coldChainNum].propTree.checkSplitKeys()
+                        # print "c checking that all constraints are present"
+                        #theSplits = [n.br.splitKey for n in self.chains[0].curTree.iterNodesNoRoot()]
+                        # for sk in self.constraints.constraints:
+                        #    if sk not in theSplits:
+                        #        gm.append("split %i is not present in the curTree." % sk)
+                        #        raise P4Error(gm)
+                        print("Mcmc zzz")
+
+                    # Check that the curTree has all the constraints
+                    if self.constraints:
+                        splitsInCurTree = [
+                            n.br.splitKey for n in sampleTree.iterInternalsNoRoot()]
+                        for sk in self.constraints.constraints:
+                            if sk not in splitsInCurTree:
+                                gm.append("Programming error.")
+                                gm.append(
+                                    "The current tree (the last tree sampled) does not contain constraint")
+                                gm.append(
+                                    "%s" % p4.func.getSplitStringFromKey(sk, self.tree.nTax))
+                                raise P4Error(gm)
+
+                    # If it is a checkPointInterval, write a checkPoint
+                    if self.checkPointInterval and (self.gen + 1) % self.checkPointInterval == 0:
+                        sampleWriters.flush()
+                        if workers:
+                            workers.checkPoint(writer=checkPointWriter)
+                        else:
+                            self._checkPoint(writer=checkPointWriter)
+
+                        # The stuff below needs to be done in a re-start as well.
+                        # See above "if self.proposals:"
+                        self.startMinusOne = self.gen
+
+                        # Start the tree partitions over.
+                        self.treePartitions = None
+                        # Zero the proposal counts
+                        for p in self.props.proposals:
+                            p.nProposals = [0] * self.nChains
+                            p.nAcceptances = [0] * self.nChains
+                            p.nTopologyChangeAttempts = [0] * self.nChains
+                            p.nTopologyChanges = [0] * self.nChains
+                            p.nAborts = [0] * self.nChains
+                        # Zero the swap matrix
+                        if self.nChains > 1:
+                            self.swapMatrix = []
+                            for i in range(self.nChains):
+                                self.swapMatrix.append([0] * self.nChains)
 
                     
 
-            # Reassuring pips ...
-            # We want to skip the first gen of every call to run()
-            if firstGen != self.gen:
-                if nGensToDo <= 20000:
-                    if (self.gen - firstGen) % 1000 == 0:
-                        if verbose:
-                            deltaTime = self._doTimeCheck(
-                                nGensToDo, firstGen, 1000)
-                            if deltaTime.days:
-                                timeString = "%s days, %s" % (
-                                    deltaTime.days, time.strftime("%H:%M:%S", time.gmtime(deltaTime.seconds)))
-                            else:
-                                timeString = time.strftime(
-                                    "%H:%M:%S", time.gmtime(deltaTime.seconds))
-                            print("%10i - %s" % (self.gen, timeString))
+                # Reassuring pips ...
+                # We want to skip the first gen of every call to run()
+                if firstGen != self.gen:
+                    if nGensToDo <= 20000:
+                        if (self.gen - firstGen) % 1000 == 0:
+                            if verbose:
+                                deltaTime = self._doTimeCheck(
+                                    nGensToDo, firstGen, 1000)
+                                if deltaTime.days:
+                                    timeString = "%s days, %s" % (
+                                        deltaTime.days, time.strftime("%H:%M:%S", time.gmtime(deltaTime.seconds)))
+                                else:
+                                    timeString = time.strftime(
+                                        "%H:%M:%S", time.gmtime(deltaTime.seconds))
+                                print("%10i - %s" % (self.gen, timeString))
+                                if diagnostics:
+                                    diagnostics.write(self.treePartitions)
 
-                        else:
+                            else:
+                                sys.stdout.write(".")
+                                sys.stdout.flush()
+                        elif (self.gen - firstGen) % 100 == 0:
                             sys.stdout.write(".")
                             sys.stdout.flush()
-                    elif (self.gen - firstGen) % 100 == 0:
-                        sys.stdout.write(".")
-                        sys.stdout.flush()
-                else:
-                    if (self.gen - firstGen) % 50000 == 0:
-                        if verbose:
-                            deltaTime = self._doTimeCheck(
-                                nGensToDo, firstGen, 50000)
-                            if deltaTime.days:
-                                timeString = "%s days, %s" % (
-                                    deltaTime.days, time.strftime("%H:%M:%S", time.gmtime(deltaTime.seconds)))
+                    else:
+                        if (self.gen - firstGen) % 50000 == 0:
+                            if verbose:
+                                deltaTime = self._doTimeCheck(
+                                    nGensToDo, firstGen, 50000)
+                                if deltaTime.days:
+                                    timeString = "%s days, %s" % (
+                                        deltaTime.days, time.strftime("%H:%M:%S", time.gmtime(deltaTime.seconds)))
+                                else:
+                                    timeString = time.strftime(
+                                        "%H:%M:%S", time.gmtime(deltaTime.seconds))
+                                print("%10i - %s" % (self.gen, timeString))
+                                if diagnostics:
+                                    diagnostics.write(self.treePartitions)
                             else:
-                                timeString = time.strftime(
-                                    "%H:%M:%S", time.gmtime(deltaTime.seconds))
-                            print("%10i - %s" % (self.gen, timeString))
-                        else:
+                                sys.stdout.write(".")
+                                sys.stdout.flush()
+                        elif (self.gen - firstGen) % 1000 == 0:
                             sys.stdout.write(".")
                             sys.stdout.flush()
-                    elif (self.gen - firstGen) % 1000 == 0:
-                        sys.stdout.write(".")
-                        sys.stdout.flush()
 
-        # End of the Main loop.  Gens finished.  Clean up.
-        print()
-        if verbose:
-            print("Finished %s generations." % nGensToDo)
+            # End of the Main loop.  Gens finished.  Clean up.
+            if workers:
+                workers.finish()
+            print()
+            if verbose:
+                print("Finished %s generations." % nGensToDo)
+                if var.mcmc_profileProposals:
+                    self.writeProposalProfile()
+
+            sampleWriters.treeFile.write('end;\n\n')
+        finally:
+            sampleWriters.close()
+            if checkPointWriter:
+                checkPointWriter.close()
+
+    # The attributes of proposals that are lists indexed by tempNum.
+    _tempStateNames = ['tuning', 'tnNSamples', 'tnNAccepts', 'nProposals', 'nAcceptances',
+                       'nTopologyChangeAttempts', 'nTopologyChanges', 'nAborts',
+                       'weightFactor', 'adNProposals', 'adNAccepts', 'adSeconds']
+    # More of them, for var.mcmc_profileProposals.  The counters are
+    # in the same order as pf.p4WorkCounters() gives them.
+    _profStateNames = ['profNProposals', 'profSeconds', 'profNCLRecalcs', 'profNBigPRecalcs',
+                       'profNEigSolves', 'profNCopyBytes']
+    _profCounterNames = _profStateNames[2:]
+
+    def _getTempStateNames(self):
+        if var.mcmc_profileProposals:
+            return self._tempStateNames + self._profStateNames
+        return self._tempStateNames
+
+    def _getTempState(self, tempNum):
+        """The tunings and tallies of the proposals for tempNum, in a flat list."""
+        state = []
+        names = self._getTempStateNames()
+        for p in self.props.proposals:
+            for name in names:
+                val = getattr(p, name)
+                if val is None:
+                    state.append(None)
+                else:
+                    state.append(val[tempNum])
+        return state
 
-        treeFile = open(self.treeFileName, 'a')
-        treeFile.write('end;\n\n')
-        treeFile.close()
+    def _setTempState(self, tempNum, state):
+        """The reverse of _getTempState()."""
+        i = 0
+        names = self._getTempStateNames()
+        for p in self.props.proposals:
+            for name in names:
+                if state[i] is not None:
+                    getattr(p, name)[tempNum] = state[i]
+                i += 1
+        if self.adaptProposalWeightsBurnin:
+            self.props.calculateTempWeights(tempNum)
+
+    def _genChain(self, chNum, equiProbableProposals, abortableProposals):
+        """Do one generation of chain chNum.
+
+        This uses the random module as it finds it.  Mcmc.run() sets
+        the state of the random module to the chain's own stream
+        first, see Chain.randomState.
+        """
 
+        gm = ['Mcmc._genChain()']
+
+        # abortableProposals is a list of proposals where it is
+        # possible to abort.  When a gen(aProposal) is made, below,
+        # aProposal.doAbort might be set, in which case we want to
+        # skip it for this gen.  But we want to start each chain gen
+        # with doAborts all turned off.
+
+        tempNum = self.chains[chNum].tempNum
+        adapting = self.gen < self.adaptProposalWeightsBurnin
+        profiling = var.mcmc_profileProposals
+
+        failure = True
+        nAttempts = 0
+        while failure:
+            # Choose a proposal
+            gotIt = False
+            safety = 0
+            while not gotIt:
+                # equiProbableProposals is True or False.  Usually False.
+                aProposal = self.props.chooseProposal(equiProbableProposals, tempNum)
+                if aProposal:
+                    gotIt = True
+
+                if aProposal.name == 'local':
+                    # Can't do local on a star tree.
+                    if self.chains[chNum].curTree.nInternalNodes == 1:
+                        #aProposal = self.proposalsHash['brLen']
+                        gotIt = False
+
+                elif aProposal.name == 'root3':
+                    # Can't do root3 on a star tree.
+                    if self.chains[chNum].curTree.nInternalNodes == 1:
+                        gotIt = False
+
+                if aProposal.doAbort:
+                    gotIt = False
+
+                safety += 1
+                if safety > 1000:
+                    gm.append("Could not find a proposal after %i attempts." % safety)
+                    gm.append("Possibly a programming error.")
+                    gm.append("Or possibly it is just a pathologically frustrating Mcmc.")
+                    raise P4Error(gm)
+
+            if 0:
+                print("==== gen=%i, chNum=%i, aProposal=%s (part %i)" % (
+                    self.gen, chNum, aProposal.name, aProposal.pNum), end=' ')
+                sys.stdout.flush()
+                # print gNum,
+
+            # success returns None
+            if adapting:
+                nAcceptances = aProposal.nAcceptances[tempNum]
+                startTime = _timer()
+            if profiling:
+                counts = pf.p4WorkCounters()
+                profStartTime = _timer()
+            failure = self.chains[chNum].gen(aProposal)
+            if profiling:
+                aProposal.profSeconds[tempNum] += _timer() - profStartTime
+                aProposal.profNProposals[tempNum] += 1
+                for name, before, after in zip(self._profCounterNames, counts, pf.p4WorkCounters()):
+                    getattr(aProposal, name)[tempNum] += after - before
+            if adapting:
+                aProposal.adSeconds[tempNum] += _timer() - startTime
+                aProposal.adNProposals[tempNum] += 1
+                aProposal.adNAccepts[tempNum] += aProposal.nAcceptances[tempNum] - nAcceptances
+
+            if failure:
+                myWarn = "Mcmc.run() main loop.  Proposal %s generated a 'failure'.  Why?" % aProposal.name
+                self.logger.warning(myWarn)
+
+            nAttempts += 1
+            if nAttempts > 1000:
+                gm.append("Was not able to do a successful generation after %i attempts." % nAttempts)
+                raise P4Error(gm)
+
+            # Continuous tuning.  We have a tuning, and propose/accept
+            # tallies for each temperature, kept separately.  Note that
+            # since chNum does not equal tempNum, the most recently
+            # incremented values (and the ones we want to tune now) will
+            # be aProposal.tnNSamples[tempNum] and
+            # aProposal.tnNAccepts[tempNum], where tempNum will most
+            # likely not be chNum.  So we get the tempNum from this
+            # chNum, and tune it.
+
+            # tunables = """allBrLens allCompsDir brLen compDir 
+            # gdasrv local ndch2_internalCompsDir 
+            # ndch2_internalCompsDirAlpha ndch2_leafCompsDir 
+            # ndch2_leafCompsDirAlpha pInvar rMatrixDir relRate """.split()
+
+            # maybeTunablesButNotNow  compLocation eTBR polytomy root3 rMatrixLocation
+
+            if aProposal.name in self.tunableProps:
+                if aProposal.tnNSamples[tempNum] >= aProposal.tnSampleSize:
+                    aProposal.tune(tempNum)
+
+        if adapting and (self.gen + 1) % var.mcmc_adaptProposalWeightsInterval == 0:
+            self._adaptProposalWeights(tempNum)
+
+        # print "   Mcmc.run(). finished a gen on chain %i" % (chNum)
+        for prNm in abortableProposals:
+            ret = self.props.proposalsDict.get(prNm)
+            if ret:
+                ret.doAbort = False
+
+    def _adaptProposalWeights(self, tempNum):
+        """Re-weight the proposals for tempNum, by accepts per second.
+
+        This is done during the first adaptProposalWeightsBurnin gens,
+        every var.mcmc_adaptProposalWeightsInterval gens.  The
+        efficiency of a proposal is its acceptances per second of CPU
+        time, as measured at that temperature.  Its weightFactor is
+        the square root of its efficiency relative to the
+        weight-averaged efficiency, bounded by
+        var.mcmc_adaptProposalWeightsMinFactor and
+        var.mcmc_adaptProposalWeightsMaxFactor, and it multiplies the
+        usual weight.  The tallies are then halved, so that the early
+        part of the burnin is forgotten.
+
+        After the burnin the weightFactors do not change, as they need
+        to be fixed for the chain to sample correctly.  As they depend
+        on timings, a run with adapted weights is not exactly
+        repeatable.
+        """
 
+        props = [p for p in self.props.proposals if p.weight and p.adNProposals[tempNum] >= 10]
+        if len(props) < 2:
+            return
+        efficiencies = []
+        for p in props:
+            efficiencies.append((p.adNAccepts[tempNum] + 1.0) / max(p.adSeconds[tempNum], 1.e-9))
+        sumOfWeights = sum([p.weight for p in props])
+        meanEfficiency = sum([props[i].weight * efficiencies[i] for i in range(len(props))]) / sumOfWeights
+        message = "adapt proposal weights gen=%i tempNum=%i" % (self.gen, tempNum)
+        for i in range(len(props)):
+            p = props[i]
+            theFactor = math.sqrt(efficiencies[i] / meanEfficiency)
+            theFactor = max(var.mcmc_adaptProposalWeightsMinFactor,
+                            min(var.mcmc_adaptProposalWeightsMaxFactor, theFactor))
+            p.weightFactor[tempNum] = theFactor
+            message += " %s=%.3f" % (p.name, theFactor)
+        for p in self.props.proposals:
+            p.adNProposals[tempNum] //= 2
+            p.adNAccepts[tempNum] /= 2.0
+            p.adSeconds[tempNum] /= 2.0
+        self.props.calculateTempWeights(tempNum)
+        self.logger.info(message)
 
     def _doTimeCheck(self, nGensToDo, firstGen, genInterval):
         """Time check 
@@ -2520,72 +3056,27 @@ class Mcmc(object):
         simFile.write('\n')
         simFile.close()
 
-    def _checkPoint(self):
+    def _checkPoint(self, chainStates=None, writer=None):
+        """Write a checkPoint file, in the format of p4.mcmccheckpoint.
 
-        if 0:
-            for chNum in range(self.nChains):
-                ch = self.chains[chNum]
-                print("chain %i ==================" % chNum)
-                ch.curTree.summarizeModelThingsNNodes()
-
-        #print("Before removing data", end=' ')
-        #self.chains[0].curTree.calcLogLike(verbose=True, resetEmpiricalComps=False)
-
-        # Make a copy of self, but with no cStuff.
-        # But we don't want to copy data or logger.  So detach them.
-        savedData = self.tree.data
-        self.tree.data = None
-        savedLogger = self.logger
-        self.logger = None
-        if self.simulate:
-            savedSimData = self.simTree.data
-            self.simTree.data = None
-        for chNum in range(self.nChains):
-            ch = self.chains[chNum]
-            ch.curTree.data = None
-            ch.propTree.data = None
-        
-        
-
-
-        theCopy = copy.deepcopy(self)
+        If the chains are in McmcChainWorkers, their states are given
+        as chainStates.  If there is a writer, an McmcCheckPointWriter,
+        the file is written by that, in the background.
+        """
 
-        # Re-attach data and logger to self.
-        self.tree.data = savedData
-        self.logger = savedLogger
-        self.tree.calcLogLike(verbose=False, resetEmpiricalComps=False)
-        if self.simulate:
-            self.simTree.data = savedSimData
-            self.simTree.calcLogLike(verbose=False, resetEmpiricalComps=False)
-        for chNum in range(self.nChains):
-            ch = self.chains[chNum]
-            ch.curTree.data = savedData
-            #print("After restoring data", end=' ')
-            ch.curTree.calcLogLike(verbose=False, resetEmpiricalComps=False)
-            ch.propTree.data = savedData
-            ch.propTree.calcLogLike(verbose=False, resetEmpiricalComps=False)
-
-        # Get rid of c-pointers in the copy
-        theCopy.tree.deleteCStuff()
-        theCopy.tree.data = None
-        if self.simulate:
-            theCopy.simTree.deleteCStuff()
-            theCopy.simTree.data = None
-        theCopy.treePartitions._finishSplits()
-        theCopy.likesFile = None
-        theCopy.treeFile = None
-        for chNum in range(theCopy.nChains):
-            ch = theCopy.chains[chNum]
-            ch.curTree.deleteCStuff()
-            #ch.curTree.data = None
-            ch.propTree.deleteCStuff()
-            #ch.propTree.data = None
-
-        # Pickle it.
         fName = "mcmc_checkPoint_%i.%i" % (self.runNum, self.gen + 1)
-        f = open(fName, 'wb')
-        pickle.dump(theCopy, f, pickle.HIGHEST_PROTOCOL)
-        f.close()
+        state = p4.mcmccheckpoint.getMcmcCheckPointState(self, chainStates)
+        if writer:
+            writer.put(self, fName, state)
+        else:
+            p4.mcmccheckpoint.writeMcmcCheckPoint(self, fName, state,
+                                                  compression=var.mcmc_checkPointCompression)
+
+        # The treePartitions is started over after a checkPoint, so
+        # it can be finished and kept, for McmcMultiRun.
+        if self.treePartitions:
+            self.treePartitions._finishSplits()
+        self.checkPointTreePartitions = self.treePartitions
 
     def writeProposalProbs(self, makeDict=False):
         """(Another) Pretty-print the proposal probabilities.
@@ -2672,3 +3163,78 @@ class Mcmc(object):
             return rd
 
 
+
+    def writeProposalProfile(self, makeDict=False, tempNum=None):
+        """Pretty-print where the time goes, by proposal.
+
+        This needs var.mcmc_profileProposals to have been set during
+        the run.  For each proposal it gives the wall time, and the
+        likelihood work done -- the conditional likelihood
+        recalculations (one per node per data part), the bigP matrix
+        recalculations (one per branch per category), the eigensystem
+        solves, and the bytes copied between curTree and propTree.
+        The times include the likelihood calculations.
+
+        These are tallied by temperature, and arg tempNum picks one.
+        The default, None, sums over all of them.  Unlike the proposal
+        acceptances, they are not zeroed at checkPoints.
+
+        If makeDict is set, it returns a dict, keyed by proposal name
+        (with the part number, as in writeProposalProbs()), of dicts
+        of lists by tempNum, and does not print.
+        """
+
+        if makeDict:
+            rd = {}
+            for p in self.props.proposals:
+                if p.pNum != -1:
+                    pname = p.name + "_%i" % p.pNum
+                else:
+                    pname = p.name
+                rd[pname] = {}
+                for name in self._profStateNames:
+                    # eg profNCLRecalcs becomes nCLRecalcs
+                    key = name[4].lower() + name[5:]
+                    rd[pname][key] = list(getattr(p, name))
+            return rd
+
+        if tempNum is None:
+            tempNums = list(range(self.nChains))
+        else:
+            tempNums = [tempNum]
+        rows = []
+        for p in self.props.proposals:
+            row = [sum([getattr(p, name)[tNum] for tNum in tempNums]) for name in self._profStateNames]
+            rows.append((p, row))
+        totSeconds = sum([row[1] for p, row in rows])
+        if not sum([row[0] for p, row in rows]):
+            print("Mcmc.writeProposalProfile().  Nothing tallied.  Was var.mcmc_profileProposals set?")
+            return
+
+        print("\nProposal profile", end=' ')
+        if tempNum is None:
+            print("(all temperatures)")
+        else:
+            print("(tempNum %i)" % tempNum)
+        print("Per proposal, the mean time, CL and bigP recalcs, eig solves, and KB copied.")
+        print("%30s %5s %10s %9s %7s %10s %8s %7s %9s %7s" % (
+            'proposal', 'part', 'nProposals', 'seconds', 'time(%)', 'us/prop',
+            'CLs', 'bigPs', 'eigs', 'KB'))
+        for p, row in rows:
+            nProps, seconds, nCLs, nBigPs, nEigs, nBytes = row
+            print("%30s" % p.name, end=' ')
+            if p.pNum != -1:
+                print(" %3i " % p.pNum, end=' ')
+            else:
+                print("   - ", end=' ')
+            print("%10i %9.2f" % (nProps, seconds), end=' ')
+            if totSeconds:
+                print("%7.1f" % (100.0 * seconds / totSeconds), end=' ')
+            else:
+                print("%7s" % '-', end=' ')
+            if nProps:
+                print("%10.1f %8.2f %7.2f %9.4f %7.1f" % (
+                    1.e6 * seconds / nProps, float(nCLs) / nProps, float(nBigPs) / nProps,
+                    float(nEigs) / nProps, nBytes / (1024.0 * nProps)))
+            else:
+                print("%10s %8s %7s %9s %7s" % ('-', '-', '-', '-', '-'))
@@ -0,0 +1,465 @@
+"""Reading and writing Mcmc checkPoint files.
+
+A checkPoint file starts with a line like::
+
+    p4McmcCheckPoint 1 none
+
+giving the format version and the compression, 'none' or 'zlib', and
+after that is a pickle of a dict, compressed or not.  It holds the Mcmc, but without its chains, its
+data, or its treePartitions.  The chains are kept as compact
+per-chain states, made by getChainTreeState(), and the treePartitions
+as its split counts.  Making it needs no copy of the Mcmc, and no
+likelihood recalculation.
+
+Files are written to a temporary file first, and then renamed, so
+that a checkPoint file is never half-written.  With
+McmcCheckPointWriter, that, and the compression, are done in a
+background thread.
+
+Old checkPoints, which are simply pickled Mcmc objects, can still be
+read by readMcmcCheckPoint().
+"""
+from __future__ import print_function
+import os
+import io
+import pickle
+import zlib
+import threading
+import numpy
+try:
+    from queue import Queue
+except ImportError:
+    from Queue import Queue
+from p4.data import Data
+from p4.treepartitions import TreePartitions, Split
+from p4.p4exceptions import P4Error
+
+checkPointMagic = b'p4McmcCheckPoint'
+checkPointVersion = 1
+checkPointCompressions = ['none', 'zlib']
+
+# The parts of TreePartitions.Split that are counted.
+_splitCountNames = ['count', 'rootCount', 'rootCount2', 'cumBrLen', 'biRootCumBrLen']
+
+
+def getChainTreeState(aTree):
+    """The state of a chain tree, as arrays.
+
+    It is what Tree.copyToTree() and Model.copyValsTo() would copy
+    from one tree of a chain to the other, and so enough to make a
+    copy of the tree from the Mcmc.tree.  The logLike is not part of
+    it; it is recalculated when the data are attached.
+    """
+
+    nNodes = len(aTree.nodes)
+    nParts = aTree.model.nParts
+    parent = numpy.zeros(nNodes, numpy.int32) - 1
+    leftChild = numpy.zeros(nNodes, numpy.int32) - 1
+    sibling = numpy.zeros(nNodes, numpy.int32) - 1
+    brLens = numpy.zeros(nNodes, numpy.float64)
+    lenChanged = numpy.zeros(nNodes, numpy.int8)
+    compNums = numpy.zeros((nParts, nNodes), numpy.int32) - 1
+    rMatrixNums = numpy.zeros((nParts, nNodes), numpy.int32) - 1
+    gdasrvNums = numpy.zeros((nParts, nNodes), numpy.int32) - 1
+    splitKeys = [None] * nNodes
+    rawSplitKeys = [None] * nNodes
+    for n in aTree.nodes:
+        nNum = n.nodeNum
+        if n.parent:
+            parent[nNum] = n.parent.nodeNum
+        if n.leftChild:
+            leftChild[nNum] = n.leftChild.nodeNum
+        if n.sibling:
+            sibling[nNum] = n.sibling.nodeNum
+        for pNum in range(nParts):
+            compNums[pNum][nNum] = n.parts[pNum].compNum
+        if n != aTree.root:
+            brLens[nNum] = n.br.len
+            lenChanged[nNum] = n.br.lenChanged
+            splitKeys[nNum] = n.br.splitKey
+            rawSplitKeys[nNum] = n.br.rawSplitKey
+            for pNum in range(nParts):
+                rMatrixNums[pNum][nNum] = n.br.parts[pNum].rMatrixNum
+                gdasrvNums[pNum][nNum] = n.br.parts[pNum].gdasrvNum
+
+    modelParts = []
+    for mp in aTree.model.parts:
+        modelParts.append(dict(
+            comps=[numpy.array(mt.val) for mt in mp.comps],
+            compNNodes=[mt.nNodes for mt in mp.comps],
+            rMatrices=[(None if mt.val is None else numpy.array(mt.val)) for mt in mp.rMatrices],
+            rMatrixNNodes=[mt.nNodes for mt in mp.rMatrices],
+            gdasrvs=[float(mt.val[0]) for mt in mp.gdasrvs],
+            gdasrvNNodes=[mt.nNodes for mt in mp.gdasrvs],
+            pInvar=mp.pInvar.val,
+            relRate=mp.relRate,
+            ndch2_leafAlpha=mp.ndch2_leafAlpha,
+            ndch2_internalAlpha=mp.ndch2_internalAlpha))
+
+    return dict(root=aTree.root.nodeNum, parent=parent, leftChild=leftChild,
+                sibling=sibling, brLens=brLens, lenChanged=lenChanged,
+                splitKeys=splitKeys, rawSplitKeys=rawSplitKeys,
+                compNums=compNums, rMatrixNums=rMatrixNums, gdasrvNums=gdasrvNums,
+                preOrder=numpy.array(aTree.preOrder), postOrder=numpy.array(aTree.postOrder),
+                preAndPostOrderAreValid=aTree.preAndPostOrderAreValid,
+                nInternalNodes=aTree._nInternalNodes, modelParts=modelParts)
+
+
+def setChainTreeFromState(aTree, state):
+    """Set aTree, eg a dupe of the Mcmc.tree, to a chain tree state.
+
+    aTree should have no c-structs, ie no data.  This does the same
+    as Tree.copyToTree() and Model.copyValsTo() would do.
+    """
+
+    gm = ['setChainTreeFromState()']
+    nodes = aTree.nodes
+    if len(nodes) != len(state['parent']):
+        gm.append('Different number of nodes.')
+        raise P4Error(gm)
+    for n in nodes:
+        nNum = n.nodeNum
+        i = state['parent'][nNum]
+        n.parent = (nodes[i] if i >= 0 else None)
+        i = state['leftChild'][nNum]
+        n.leftChild = (nodes[i] if i >= 0 else None)
+        i = state['sibling'][nNum]
+        n.sibling = (nodes[i] if i >= 0 else None)
+
+    # root, as in copyToTree()
+    rootNum = state['root']
+    aTree.root.br = nodes[rootNum].br
+    nodes[rootNum].br = None
+    aTree.root = nodes[rootNum]
+
+    nParts = aTree.model.nParts
+    for n in nodes:
+        nNum = n.nodeNum
+        for pNum in range(nParts):
+            n.parts[pNum].compNum = int(state['compNums'][pNum][nNum])
+        if n != aTree.root:
+            n.br.len = float(state['brLens'][nNum])
+            n.br.lenChanged = bool(state['lenChanged'][nNum])
+            n.br.splitKey = state['splitKeys'][nNum]
+            n.br.rawSplitKey = state['rawSplitKeys'][nNum]
+            for pNum in range(nParts):
+                n.br.parts[pNum].rMatrixNum = int(state['rMatrixNums'][pNum][nNum])
+                n.br.parts[pNum].gdasrvNum = int(state['gdasrvNums'][pNum][nNum])
+
+    for i in range(len(aTree.preOrder)):
+        aTree.preOrder[i] = state['preOrder'][i]
+        aTree.postOrder[i] = state['postOrder'][i]
+    aTree.preAndPostOrderAreValid = state['preAndPostOrderAreValid']
+    aTree._nInternalNodes = state['nInternalNodes']
+
+    for pNum in range(nParts):
+        mp = aTree.model.parts[pNum]
+        sp = state['modelParts'][pNum]
+        for mtNum in range(mp.nComps):
+            mp.comps[mtNum].val = sp['comps'][mtNum]
+            mp.comps[mtNum].nNodes = sp['compNNodes'][mtNum]
+        for mtNum in range(mp.nRMatrices):
+            if sp['rMatrices'][mtNum] is not None:
+                mt = mp.rMatrices[mtNum]
+                for i in range(len(mt.val)):
+                    mt.val[i] = sp['rMatrices'][mtNum][i]
+            mp.rMatrices[mtNum].nNodes = sp['rMatrixNNodes'][mtNum]
+        for mtNum in range(mp.nGdasrvs):
+            # As in copyValsTo(), without calcRates(), which is done
+            # when the c-structs are made.
+            mp.gdasrvs[mtNum].val[0] = sp['gdasrvs'][mtNum]
+            mp.gdasrvs[mtNum].nNodes = sp['gdasrvNNodes'][mtNum]
+        mp.pInvar.val = sp['pInvar']
+        mp.relRate = sp['relRate']
+        mp.ndch2_leafAlpha = sp['ndch2_leafAlpha']
+        mp.ndch2_internalAlpha = sp['ndch2_internalAlpha']
+
+
+def _getTreePartitionsState(tp):
+    """The split counts of an unfinished TreePartitions."""
+
+    if tp is None:
+        return None
+    state = dict(nTrees=tp.nTrees, taxNames=tp.taxNames, isBiRoot=tp.isBiRoot)
+    for splitsName in ['splits', 'biSplits']:
+        splits = getattr(tp, splitsName)
+        state[splitsName] = dict(keys=[s.key for s in splits])
+        for name in _splitCountNames:
+            state[splitsName][name] = numpy.array([getattr(s, name) for s in splits], numpy.float64)
+    return state
+
+
+def _makeTreePartitionsFromState(state):
+    """Make a finished TreePartitions from split counts."""
+
+    if state is None:
+        return None
+    tp = TreePartitions()
+    tp.nTrees = state['nTrees']
+    tp.taxNames = state['taxNames']
+    tp.nTax = len(tp.taxNames)
+    tp.isBiRoot = state['isBiRoot']
+    for splitsName, hashName in [['splits', 'splitsHash'], ['biSplits', 'biSplitsHash']]:
+        sState = state[splitsName]
+        splits = getattr(tp, splitsName)
+        splitsHash = getattr(tp, hashName)
+        for i in range(len(sState['keys'])):
+            s = Split()
+            s.key = sState['keys'][i]
+            for name in _splitCountNames:
+                setattr(s, name, float(sState[name][i]))
+            splits.append(s)
+            splitsHash[s.key] = s
+    tp._finishSplits()
+    return tp
+
+
+def _zeroTreeCPointers(aTree):
+    """Forget the c-pointers that came with an unpickled tree."""
+
+    aTree.cTree = None
+    for n in aTree.nodes:
+        n.cNode = None
+    if aTree.model:
+        aTree.model.cModel = None
+        for mp in aTree.model.parts:
+            for mt in mp.gdasrvs:
+                mt.c = None
+
+
+class _CheckPointPickler(pickle.Pickler):
+    """A Pickler that leaves out the Data, and the Mcmc itself.
+
+    The Mcmc is pickled as its __dict__; references to it, eg from
+    proposals, become persistent ids, as do any Data objects, which
+    come back as None.
+    """
+
+    def __init__(self, f, theMcmc):
+        pickle.Pickler.__init__(self, f, pickle.HIGHEST_PROTOCOL)
+        self.mcmc = theMcmc
+
+    def persistent_id(self, obj):
+        if obj is self.mcmc:
+            return 'mcmc'
+        if isinstance(obj, Data):
+            return 'data'
+        return None
+
+
+class _CheckPointUnpickler(pickle.Unpickler):
+
+    def __init__(self, f, theMcmc):
+        pickle.Unpickler.__init__(self, f)
+        self.mcmc = theMcmc
+
+    def persistent_load(self, pid):
+        if pid == 'mcmc':
+            return self.mcmc
+        if pid == 'data':
+            return None
+        raise pickle.UnpicklingError("Unknown persistent id '%s'" % pid)
+
+
+def getMcmcCheckPointState(theMcmc, chainStates=None):
+    """Gather the state of theMcmc for writeMcmcCheckPoint().
+
+    Nothing is copied (except the arrays of the chain states), so the
+    state should be written before theMcmc goes on.  If the chains are
+    elsewhere, eg in McmcChainWorkers, give their states as
+    chainStates, a list of [tempNum, randomState, chainTreeState,
+    numpyRandom].
+    """
+
+    if chainStates is None:
+        chainStates = []
+        for ch in theMcmc.chains:
+            chainStates.append([ch.tempNum, ch.randomState, getChainTreeState(ch.curTree),
+                                ch.numpyRandom])
+    mcmcDict = dict(theMcmc.__dict__)
+    mcmcDict['chains'] = None
+    mcmcDict['logger'] = None
+    mcmcDict['treePartitions'] = None
+    mcmcDict['checkPointTreePartitions'] = None
+    return dict(mcmc=mcmcDict, chains=chainStates,
+                treePartitions=_getTreePartitionsState(theMcmc.treePartitions))
+
+
+def dumpMcmcCheckPointState(theMcmc, state):
+    """Pickle a state from getMcmcCheckPointState() to bytes.
+
+    This is the snapshot; after it, theMcmc can go on.
+    """
+
+    f = io.BytesIO()
+    _CheckPointPickler(f, theMcmc).dump(state)
+    return f.getvalue()
+
+
+def writeMcmcCheckPointBytes(fName, pickledState, compression='none'):
+    """Write a pickled state, from dumpMcmcCheckPointState(), to a file.
+
+    It is written to a temporary file, which is then renamed to fName.
+    """
+
+    gm = ['writeMcmcCheckPointBytes()']
+    if compression not in checkPointCompressions:
+        gm.append("Unknown compression '%s'.  Use one of %s" % (compression, checkPointCompressions))
+        raise P4Error(gm)
+    if compression == 'zlib':
+        pickledState = zlib.compress(pickledState)
+    # The temporary file starts with a dot, so it is not seen as a
+    # checkPoint.
+    dirName, baseName = os.path.split(fName)
+    tmpName = os.path.join(dirName, '.%s.tmp' % baseName)
+    f = open(tmpName, 'wb')
+    f.write(checkPointMagic + (' %i %s\n' % (checkPointVersion, compression)).encode('ascii'))
+    f.write(pickledState)
+    f.flush()
+    os.fsync(f.fileno())
+    f.close()
+    if hasattr(os, 'replace'):
+        os.replace(tmpName, fName)
+    else:
+        os.rename(tmpName, fName)
+
+
+def writeMcmcCheckPoint(theMcmc, fName, state=None, compression='none'):
+    """Write a checkPoint file.
+
+    The state is from getMcmcCheckPointState(), and is got if it is
+    not supplied.
+    """
+
+    if state is None:
+        state = getMcmcCheckPointState(theMcmc)
+    writeMcmcCheckPointBytes(fName, dumpMcmcCheckPointState(theMcmc, state), compression)
+
+
+def _checkPointWriterThread(theQueue, errors):
+    while True:
+        item = theQueue.get()
+        try:
+            if item is None:
+                break
+            if not errors:
+                writeMcmcCheckPointBytes(*item)
+        except Exception as e:
+            errors.append("%s: %s" % (item[0], e))
+        finally:
+            theQueue.task_done()
+
+
+class McmcCheckPointWriter(object):
+    """Write checkPoint files in a background thread.
+
+    Mcmc.run() uses this if var.mcmc_checkPointAsync is set.  The
+    snapshot, a pickle in memory, is made by put(), and the thread
+    compresses it, writes it, and does the rename.  The queue holds
+    at most maxPending snapshots; if it is full, put() waits, so that
+    checkPoints do not pile up if the disk is slow.
+
+    An error in the thread is raised as a P4Error at the next put()
+    or at close(), and no more files are written.
+    """
+
+    def __init__(self, maxPending=1, compression='none'):
+        gm = ['McmcCheckPointWriter()']
+        if compression not in checkPointCompressions:
+            gm.append("Unknown compression '%s'.  Use one of %s" % (compression, checkPointCompressions))
+            raise P4Error(gm)
+        self.compression = compression
+        self.queue = Queue(max(1, maxPending))
+        self.errors = []
+        self.thread = threading.Thread(target=_checkPointWriterThread,
+                                       args=(self.queue, self.errors))
+        self.thread.daemon = True
+        self.thread.start()
+
+    def _checkErrors(self):
+        if self.errors:
+            gm = ['McmcCheckPointWriter']
+            gm.append("Failed to write a checkPoint.")
+            gm += self.errors
+            raise P4Error(gm)
+
+    def put(self, theMcmc, fName, state):
+        """Snapshot the state, and queue it to be written to fName."""
+        self._checkErrors()
+        self.queue.put((fName, dumpMcmcCheckPointState(theMcmc, state), self.compression))
+
+    def close(self):
+        """Wait for the queued checkPoints to be written, and end the thread."""
+        if self.thread is None:
+            return
+        self.queue.put(None)
+        self.thread.join()
+        self.thread = None
+        self._checkErrors()
+
+
+def readMcmcCheckPoint(fName):
+    """Read a checkPoint file, returning an Mcmc with no data.
+
+    This reads both the compact format and old pickled Mcmc objects.
+    To get an Mcmc ready to go, use func.unPickleMcmc().
+    """
+
+    gm = ['readMcmcCheckPoint()']
+    from p4.mcmc import Mcmc
+    from p4.chain import Chain
+
+    f = open(fName, 'rb')
+    firstLine = f.readline()
+    if not firstLine.startswith(checkPointMagic):
+        # An old checkPoint, a pickled Mcmc.
+        f.seek(0)
+        m = pickle.load(f)
+        f.close()
+        return m
+
+    splitLine = firstLine.split()
+    try:
+        version = int(splitLine[1])
+        compression = splitLine[2].decode('ascii')
+    except (IndexError, ValueError):
+        gm.append("Bad first line in checkPoint file %s" % fName)
+        raise P4Error(gm)
+    if version > checkPointVersion:
+        gm.append("CheckPoint file %s is version %i, from a newer p4." % (fName, version))
+        gm.append("This p4 reads up to version %i." % checkPointVersion)
+        raise P4Error(gm)
+    if compression not in checkPointCompressions:
+        gm.append("CheckPoint file %s has unknown compression '%s'." % (fName, compression))
+        raise P4Error(gm)
+
+    m = Mcmc.__new__(Mcmc)
+    if compression == 'zlib':
+        f2 = io.BytesIO(zlib.decompress(f.read()))
+        f.close()
+        f = f2
+    state = _CheckPointUnpickler(f, m).load()
+    f.close()
+
+    m.__dict__.update(state['mcmc'])
+    _zeroTreeCPointers(m.tree)
+    if m.simulate:
+        _zeroTreeCPointers(m.simTree)
+    m.treePartitions = _makeTreePartitionsFromState(state['treePartitions'])
+
+    m.chains = []
+    for chainState in state['chains']:
+        tempNum, randomState, treeState, numpyRandom = chainState
+        ch = Chain.__new__(Chain)
+        ch.mcmc = m
+        ch.tempNum = tempNum
+        ch.randomState = randomState
+        ch.numpyRandom = numpyRandom
+        ch.curTree = m.tree.dupe()
+        setChainTreeFromState(ch.curTree, treeState)
+        ch.propTree = m.tree.dupe()
+        setChainTreeFromState(ch.propTree, treeState)
+        ch.logProposalRatio = 0.0
+        ch.logPriorRatio = 0.0
+        m.chains.append(ch)
+    return m
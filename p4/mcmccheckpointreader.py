@@ -1,7 +1,7 @@
 from __future__ import print_function
 import os
 import p4.func
-import pickle
+import p4.mcmccheckpoint
 import math
 import numpy
 import glob
@@ -76,26 +76,20 @@ class McmcCheckPointReader(object):
                         if mtime > mostRecent:
                             mostRecent = mtime
                             mostRecentFileName = fName
-                f = open(mostRecentFileName, 'rb')
-                m = pickle.load(f)
-                f.close()
+                m = p4.mcmccheckpoint.readMcmcCheckPoint(mostRecentFileName)
                 self.mm.append(m)
 
             else:
                 # get all the files
                 for fName in fList:
-                    f = open(fName, 'rb')
-                    m = pickle.load(f)
-                    f.close()
+                    m = p4.mcmccheckpoint.readMcmcCheckPoint(fName)
                     self.mm.append(m)
 
                 self.mm = p4.func.sortListOfObjectsOn2Attributes(
                     self.mm, "gen", 'runNum')
         else:
             # get the file by name
-            f = open(fName, 'rb')
-            m = pickle.load(f)
-            f.close()
+            m = p4.mcmccheckpoint.readMcmcCheckPoint(fName)
             self.mm.append(m)
         if verbose:
             self.dump()
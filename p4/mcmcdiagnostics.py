@@ -0,0 +1,179 @@
+"""Convergence diagnostics that are updated as Mcmc.run() goes.
+
+See McmcOnlineDiagnostics.
+"""
+from __future__ import print_function
+import numpy
+from p4.p4exceptions import P4Error
+
+
+class McmcOnlineDiagnostics(object):
+    """Running ESS and autocorrelation, and changes in split supports.
+
+    Mcmc.run() makes one of these if var.mcmc_onlineDiagnostics is
+    set, and keeps it as Mcmc.onlineDiagnostics.  Each sample of the
+    cold chain is added with addSample(), and the numbers are written
+    with the time checks of a verbose run().
+
+    The things followed are the logLike, the tree length, and the
+    model parameters of the mcmc_prams file.  For each of them only
+    a fixed amount is kept, whatever the length of the run:
+
+    - the mean and variance, by Welford's method,
+    - the lag 1 autocorrelation, from a running co-moment of
+      successive samples,
+    - the batch means, in nBatches batches.  When the batches are
+      full, neighbouring pairs are merged, so the batch size doubles.
+      The ESS is the number of samples times the sample variance over
+      the batch means estimate of the variance of the mean.  It is
+      like the ESS of func.summarizeMcmcPrams(), but not the same.
+
+    The split support delta is the biggest change in the support of
+    a split in the treePartitions since the last time check.  The
+    treePartitions is started over at each checkPoint, and after that
+    there is no delta until the next time check.
+
+    All samples are included, so the burnin is as well.  To start
+    over, eg after the burnin, call reset().
+    """
+
+    def __init__(self, nBatches=32):
+        gm = ['McmcOnlineDiagnostics()']
+        if nBatches < 8 or nBatches % 2:
+            gm.append("nBatches should be even, and at least 8.  Got %s" % nBatches)
+            raise P4Error(gm)
+        self.nBatches = nBatches
+        self.reset()
+
+    def reset(self):
+        """Forget all samples."""
+        self.names = None
+        self.nSamples = 0
+        self.mean = None
+        self.m2 = None
+        self.prev = None
+        self.pairMeanA = None
+        self.pairMeanB = None
+        self.pairCoMoment = None
+        self.batchSums = None
+        self.batchSize = 1
+        self.nFullBatches = 0
+        self.nInBatch = 0
+        self.splitSupports = None
+        self.splitNTrees = None
+
+    def addSample(self, sampleTree):
+        """Add the logLike, tree length, and model prams of sampleTree."""
+        vals = [sampleTree.logLike, sampleTree.getLen()] + sampleTree.model.getPramsLineVals()
+        x = numpy.array(vals, numpy.float64)
+        if self.mean is None or len(x) != len(self.mean):
+            self.reset()
+            self.names = ['logLike', 'treeLen'] + ['prams col %i' % (i + 1) for i in range(len(x) - 2)]
+            nVals = len(x)
+            self.mean = numpy.zeros(nVals)
+            self.m2 = numpy.zeros(nVals)
+            self.pairMeanA = numpy.zeros(nVals)
+            self.pairMeanB = numpy.zeros(nVals)
+            self.pairCoMoment = numpy.zeros(nVals)
+            self.batchSums = numpy.zeros((self.nBatches, nVals))
+
+        self.nSamples += 1
+        delta = x - self.mean
+        self.mean += delta / self.nSamples
+        self.m2 += delta * (x - self.mean)
+
+        if self.prev is not None:
+            nPairs = self.nSamples - 1
+            deltaA = self.prev - self.pairMeanA
+            self.pairMeanA += deltaA / nPairs
+            self.pairMeanB += (x - self.pairMeanB) / nPairs
+            self.pairCoMoment += deltaA * (x - self.pairMeanB)
+        self.prev = x
+
+        self.batchSums[self.nFullBatches] += x
+        self.nInBatch += 1
+        if self.nInBatch == self.batchSize:
+            self.nFullBatches += 1
+            self.nInBatch = 0
+            if self.nFullBatches == self.nBatches:
+                half = self.nBatches // 2
+                self.batchSums[:half] = self.batchSums[0::2] + self.batchSums[1::2]
+                self.batchSums[half:] = 0.0
+                self.nFullBatches = half
+                self.batchSize *= 2
+
+    def getVariances(self):
+        if self.nSamples < 2:
+            return None
+        return self.m2 / (self.nSamples - 1)
+
+    def getAutoCorrelations(self):
+        """Lag 1 autocorrelations, or None if there are too few samples."""
+        if self.nSamples < 3:
+            return None
+        nPairs = self.nSamples - 1
+        variances = self.m2 / self.nSamples
+        r = numpy.zeros(len(variances))
+        ok = variances > 0.0
+        r[ok] = (self.pairCoMoment[ok] / nPairs) / variances[ok]
+        return r
+
+    def getEsses(self):
+        """Batch means ESSs, or None if there are fewer than 4 full batches.
+
+        A constant has an ESS of zero.
+        """
+        if self.nFullBatches < 4:
+            return None
+        nUsed = self.nFullBatches * self.batchSize
+        batchMeans = self.batchSums[:self.nFullBatches] / self.batchSize
+        varOfMean = self.batchSize * numpy.var(batchMeans, axis=0, ddof=1)
+        variances = self.getVariances()
+        esses = numpy.zeros(len(variances))
+        ok = varOfMean > 0.0
+        esses[ok] = numpy.minimum(nUsed * variances[ok] / varOfMean[ok], self.nSamples)
+        return esses
+
+    def getSplitSupportDelta(self, treePartitions):
+        """The biggest change in split support since the last call.
+
+        Returns None the first time, and after the treePartitions is
+        started over.
+        """
+        if not treePartitions or not treePartitions.nTrees:
+            self.splitSupports = None
+            return None
+        nTrees = float(treePartitions.nTrees)
+        supports = {}
+        for s in treePartitions.splits:
+            supports[s.key] = s.count / nTrees
+        theDelta = None
+        if self.splitSupports is not None and nTrees > self.splitNTrees:
+            theDelta = 0.0
+            for k in set(supports) | set(self.splitSupports):
+                d = abs(supports.get(k, 0.0) - self.splitSupports.get(k, 0.0))
+                if d > theDelta:
+                    theDelta = d
+        self.splitSupports = supports
+        self.splitNTrees = nTrees
+        return theDelta
+
+    def write(self, treePartitions=None):
+        """Print a summary line.  Mcmc.run() does this at the time checks."""
+        esses = self.getEsses()
+        autoCorrs = self.getAutoCorrelations()
+        theDelta = self.getSplitSupportDelta(treePartitions)
+        if esses is None or autoCorrs is None:
+            print("%12s  %i samples, too few for ESS" % (' ', self.nSamples))
+        else:
+            line = "%12s " % ' '
+            for i in [0, 1]:
+                line += " %s ess %.1f r1 %.3f;" % (self.names[i], esses[i], autoCorrs[i])
+            # Model prams that do not change are left out.
+            notConstant = [i for i in range(2, len(esses)) if self.m2[i] > 0.0]
+            if notConstant:
+                i = min(notConstant, key=lambda j: esses[j])
+                line += " min ess %.1f (%s, r1 %.3f);" % (esses[i], self.names[i], autoCorrs[i])
+            print(line)
+        if theDelta is not None:
+            print("%12s  split support delta %.4f" % (' ', theDelta))
@@ -0,0 +1,247 @@
+from __future__ import print_function
+import sys
+import math
+import random
+import traceback
+import p4.func
+import p4.pf as pf
+from p4.var import var
+from p4.mcmc import getForkContext
+from p4.p4exceptions import P4Error
+
+
+def _runWorker(theMcmc, conn, parentConns, seed):
+    """The loop of a worker process.  See McmcMultiRun."""
+
+    for c in parentConns:
+        c.close()
+    # The runs were forked from the same process, so they need their
+    # own random numbers.  They are all from the seed, so that the
+    # runs can be repeated.
+    random.seed(seed)
+    p4.func.reseedCRandomizer(seed % 2 ** 31)
+    if not var.gsl_rng:
+        var.gsl_rng = pf.get_gsl_rng()
+    pf.gsl_rng_set(var.gsl_rng, seed % 2 ** 31)
+
+    while True:
+        try:
+            msg = conn.recv()
+        except EOFError:
+            break
+        if msg[0] == 'finish':
+            break
+        try:
+            nGensToDo, runArgs = msg[1:]
+            theMcmc.run(nGensToDo, **runArgs)
+            sys.stdout.flush()
+            conn.send(('ok', (theMcmc.gen, theMcmc.checkPointTreePartitions)))
+        except Exception:
+            conn.send(('error', traceback.format_exc()))
+            break
+    conn.close()
+
+
+class McmcMultiRun(object):
+
+    """Do several independent Mcmc runs at once, and watch for convergence.
+
+    Make the Mcmc objects as usual, each with its own runNum and all
+    with the same checkPointInterval, and then do eg::
+
+        var.strictRunNumberChecking = False
+        mm = []
+        for runNum in range(4):
+            t = func.randomTree(taxNames=d.taxNames)
+            t.data = d
+            # ... set up the model ...
+            mm.append(Mcmc(t, nChains=4, runNum=runNum, sampleInterval=100,
+                           checkPointInterval=50000))
+        mr = McmcMultiRun(mm)
+        mr.run(1000000, stopAsdoss=0.01)
+
+    Each run goes in its own forked process.  The runs are done in
+    stretches of checkPointInterval gens.  After each stretch, each
+    run has written its checkPoint as usual, and the driver computes
+    the average standard deviation of split supports (asdoss) between
+    the runs, from the TreePartitions of that last stretch, which is
+    what McmcCheckPointReader.compareSplitsAll() would get from the
+    checkPoint files.  The values are kept in self.asdosses, a list
+    of [gen+1, asdoss] pairs.
+
+    If *stopAsdoss* is set in run(), all the runs are stopped at the
+    first checkPoint where the asdoss is at or below it.  Then
+    self.converged is set.
+
+    The Mcmc objects in the driver process are not advanced by run(),
+    and run() can only be done once.  To carry on, or to look at the
+    results, read the checkPoints with func.unPickleMcmc() or
+    McmcCheckPointReader as usual.
+    """
+
+    def __init__(self, mcmcs, minimumProportion=0.1):
+        gm = ['McmcMultiRun()']
+        if len(mcmcs) < 2:
+            gm.append("Need at least 2 Mcmc runs.")
+            raise P4Error(gm)
+        runNums = [m.runNum for m in mcmcs]
+        if len(set(runNums)) != len(runNums):
+            gm.append("The runNums are not all different: %s" % runNums)
+            raise P4Error(gm)
+        cpi = mcmcs[0].checkPointInterval
+        if not cpi:
+            gm.append("The Mcmc runs need a checkPointInterval.")
+            raise P4Error(gm)
+        for m in mcmcs[1:]:
+            if m.checkPointInterval != cpi:
+                gm.append("The Mcmc runs should all have the same checkPointInterval.")
+                raise P4Error(gm)
+            if m.tree.taxNames != mcmcs[0].tree.taxNames:
+                gm.append("The Mcmc runs should all have the same taxNames.")
+                raise P4Error(gm)
+        self.mcmcs = mcmcs
+        self.minimumProportion = minimumProportion
+        self.asdosses = []
+        self.converged = False
+
+    def asdoss(tpList, minimumProportion=0.1):
+        """Average standard deviation of split supports over several TreePartitions
+
+        Leaf splits are not included, nor are splits where none of the
+        supports reach minimumProportion.  A split missing from a
+        TreePartitions has a support of zero there.  For two
+        TreePartitions this is the same as
+        McmcCheckPointReader.compareSplitsBetweenTwoTreePartitions().
+
+        Returns None if there are no splits to compare.
+        """
+
+        gm = ['McmcMultiRun.asdoss()']
+        nTax = tpList[0].nTax
+        for tp in tpList[1:]:
+            if tp.taxNames != tpList[0].taxNames:
+                gm.append("Mismatched taxa.")
+                raise P4Error(gm)
+
+        theKeys = []
+        seen = set()
+        for tp in tpList:
+            for s in tp.splits:
+                if s.key in seen:
+                    continue
+                seen.add(s.key)
+                theStarCount = s.string.count('*')
+                if theStarCount == 1 or theStarCount == nTax - 1:
+                    continue
+                theKeys.append(s.key)
+
+        sumOfStdDevs = 0.0
+        nSplits = 0
+        for theKey in theKeys:
+            supports = []
+            for tp in tpList:
+                if theKey in tp.splitsHash:
+                    supports.append(tp.splitsHash[theKey].proportion)
+                else:
+                    supports.append(0.0)
+            if max(supports) < minimumProportion:
+                continue
+            # func.variance() can go very slightly negative
+            sumOfStdDevs += math.sqrt(max(0.0, p4.func.variance(supports)))
+            nSplits += 1
+        if not nSplits:
+            return None
+        return sumOfStdDevs / nSplits
+
+    asdoss = staticmethod(asdoss)
+
+    def run(self, nGensToDo, stopAsdoss=None, verbose=True, equiProbableProposals=False,
+            writeSamples=True, parallelChains=False):
+        """Do nGensToDo gens in each of the runs, in parallel.
+
+        The other args are passed on to Mcmc.run(), which is done
+        quietly in the workers.  See the class docstring.
+
+        The random numbers of each run, from Python, the C randomizer,
+        and the GSL, are seeded from the Python random module, so
+        doing random.seed() first makes the runs repeatable.
+        """
+
+        gm = ['McmcMultiRun.run()']
+        if self.asdosses:
+            gm.append("This McmcMultiRun has been run already.  To carry on, start from the checkPoints.")
+            raise P4Error(gm)
+        cpi = self.mcmcs[0].checkPointInterval
+        if nGensToDo % cpi:
+            gm.append("nGensToDo (%i) should be a multiple of the checkPointInterval (%i)." % (
+                nGensToDo, cpi))
+            raise P4Error(gm)
+        runArgs = dict(verbose=False, equiProbableProposals=equiProbableProposals,
+                       writeSamples=writeSamples, parallelChains=parallelChains)
+
+        ctx = getForkContext(gm)
+        nRuns = len(self.mcmcs)
+        seeds = [random.getrandbits(64) for rNum in range(nRuns)]
+        conns = []
+        procs = []
+        for rNum in range(nRuns):
+            parentConn, childConn = ctx.Pipe()
+            # Not daemonic, as parallelChains would start processes
+            # of its own.
+            proc = ctx.Process(target=_runWorker,
+                               args=(self.mcmcs[rNum], childConn, conns + [parentConn],
+                                     seeds[rNum]))
+            proc.start()
+            childConn.close()
+            conns.append(parentConn)
+            procs.append(proc)
+        if verbose:
+            print("McmcMultiRun: %i runs, checking every %i gens." % (nRuns, cpi))
+            if stopAsdoss is not None:
+                print("Stopping when the asdoss is at or below %s" % stopAsdoss)
+
+        self.converged = False
+        finishedOk = False
+        try:
+            for stretchNum in range(nGensToDo // cpi):
+                for conn in conns:
+                    conn.send(('run', cpi, runArgs))
+                tpList = []
+                for rNum in range(nRuns):
+                    try:
+                        status, reply = conns[rNum].recv()
+                    except EOFError:
+                        gm.append("The worker process for run %i went away." % self.mcmcs[rNum].runNum)
+                        raise P4Error(gm)
+                    if status == 'error':
+                        gm.append("The worker process for run %i failed, with" % self.mcmcs[rNum].runNum)
+                        gm.append(reply)
+                        raise P4Error(gm)
+                    gen, tp = reply
+                    tpList.append(tp)
+                theAsdoss = self.asdoss(tpList, minimumProportion=self.minimumProportion)
+                self.asdosses.append([gen + 1, theAsdoss])
+                if verbose:
+                    if theAsdoss is None:
+                        print("%12i  no splits > %s" % (gen + 1, self.minimumProportion))
+                    else:
+                        print("%12i  asdoss %.5f" % (gen + 1, theAsdoss))
+                    sys.stdout.flush()
+                if stopAsdoss is not None and theAsdoss is not None and theAsdoss <= stopAsdoss:
+                    self.converged = True
+                    if verbose:
+                        print("Converged at gen+1 %i.  Stopping all runs." % (gen + 1))
+                    break
+            finishedOk = True
+        finally:
+            if finishedOk:
+                for conn in conns:
+                    conn.send(('finish',))
+            else:
+                # The others may be in the middle of a stretch.
+                for proc in procs:
+                    proc.terminate()
+            for conn in conns:
+                conn.close()
+            for proc in procs:
+                proc.join()
@@ -593,15 +593,15 @@ class Model(object):
         f.write("nPrams = %i\n" % nPrams)
         f.close()
 
-    def writePramsLine(self, flob):
-        """Write a line of model parameters for mcmc output."""
+    def _pramsLineItems(self):
+        """The (format, value) pairs of a line of model parameters."""
 
         profile1 = "\t%12.6f"
         profile2 = "\t%10.8f"
         for pNum in range(self.nParts):
             mp = self.parts[pNum]
             if self.doRelRates and self.relRatesAreFree:
-                flob.write(profile1 % mp.relRate)
+                yield profile1, mp.relRate
             if mp.nComps:
                 if mp.ndch2 and not mp.ndch2_writeComps:
                     pass
@@ -610,22 +610,33 @@ class Model(object):
                         mt = mp.comps[i]
                         if mt.free:
                             for j in mt.val:
-                                flob.write(profile2 % j)
+                                yield profile2, j
             if mp.nRMatrices:
                 for i in range(mp.nRMatrices):
                     mt = mp.rMatrices[i]
                     if mt.free:
                         for j in mt.val:
-                            flob.write(profile2 % j)
+                            yield profile2, j
             if mp.nGdasrvs:
                 for i in range(mp.nGdasrvs):
                     mt = mp.gdasrvs[i]
                     if mt.free:
-                        flob.write(profile1 % mt.val[0])
+                        yield profile1, mt.val[0]
             if mp.pInvar and mp.pInvar.free:
-                flob.write(profile2 % mp.pInvar.val)
+                yield profile2, mp.pInvar.val
+
+    def writePramsLine(self, flob):
+        """Write a line of model parameters for mcmc output."""
+
+        for profile, val in self._pramsLineItems():
+            flob.write(profile % val)
         flob.write("\n")
 
+    def getPramsLineVals(self):
+        """The model parameters of writePramsLine(), as a list of floats."""
+
+        return [float(val) for profile, val in self._pramsLineItems()]
+
     def writeHypersLine(self, flob):
         """Write a line of model hyperparameters for mcmc output."""
 
@@ -143,7 +143,9 @@ class Tree(object):
 
         ~Tree.calcLogLike
         ~Tree.optLogLike
+        ~Tree.bootstrapOptLogLike
         ~Tree.simulate
+        ~Tree.simulatePatternCounts
         ~Tree.getSiteLikes
         ~Tree.ancestralStateDraw
         ~Tree.getSiteRates
@@ -226,7 +228,7 @@ class Tree(object):
     """
 
     from p4.tree_manip import node, rotateAround, reRoot, removeRoot, removeNode, removeAboveNode, collapseNode, pruneSubTreeWithoutParent, reconnectSubTreeWithoutParent, addNodeBetweenNodes, allBiRootedTrees, ladderize, randomizeTopology, readBipartitionsFromPaupLogFile, renameForPhylip, restoreNamesFromRenameForPhylip, restoreDupeTaxa, lineUpLeaves, removeEverythingExceptCladeAtNode, dupeSubTree, addSubTree, addLeaf, addSibLeaf, subTreeIsFullyBifurcating, nni, checkThatAllSelfNodesAreInTheTree, spr, randomSpr, inputTreesToSuperTreeDistances
-    from p4.tree_optsim import __del__, deleteCStuff, _allocCStuff, setCStuff, _commonCStuff, calcLogLike, optLogLike, optTest, simulate, ancestralStateDraw, getSiteLikes, getSiteRates
+    from p4.tree_optsim import __del__, deleteCStuff, _useClFloat, _allocCStuff, setCStuff, _commonCStuff, calcLogLike, checkClFloat, optLogLike, bootstrapOptLogLike, optTest, simulate, simulatePatternCounts, ancestralStateDraw, getSiteLikes, getSiteRates
     from p4.tree_model import data, model, _checkModelThing, newComp, newRMatrix, newGdasrv, setPInvar, setRelRate, setRjComp, setRjRMatrix, setModelThing, setModelThingsRandomly, setModelThingsNNodes, summarizeModelThingsNNodes, setTextDrawSymbol, setNGammaCat, modelSanityCheck, setEmpiricalComps
     from p4.tree_write import patristicDistanceMatrix, tPickle, writeNexus, write, writePhylip, writeNewick, _getMcmcCommandComment, draw, textDrawList, eps
     from p4.tree_fit import simsForModelFitTests, modelFitTests, compoTestUsingSimulations, bigXSquaredSubM, compStatFromCharFreqs, getEuclideanDistanceFromSelfDataToExpectedComposition
@@ -261,6 +263,10 @@ class Tree(object):
         self.doDataPart = 0
         self.nexusSets = None
         self.nodeForSplitKeyDict = None
+        # Whether to store the conditional likelihoods as floats, to
+        # save memory, and optimize only to float precision.  If None,
+        # it is self.data.clFloat.
+        self.clFloat = None
 
     #########################################################
     # Properties: data, model in Tree_model
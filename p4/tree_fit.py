@@ -18,6 +18,65 @@ from p4.model import Model
 from p4.data import Data
 from p4.alignment import Part
 import random
+import traceback
+
+
+def _simWorker(oneRep, nReps, workerSeed, conn):
+    """The work of one process of _repsInProcesses()."""
+    try:
+        pf.reseedCRandomizer(workerSeed)
+        random.seed(workerSeed)
+        conn.send(('ok', [oneRep() for i in range(nReps)]))
+    except Exception:
+        conn.send(('error', traceback.format_exc()))
+    conn.close()
+
+
+def _repsInProcesses(oneRep, nReps, nProcesses, seed, gm):
+    """Do nReps calls of oneRep(), spread over nProcesses processes.
+
+    The processes are forked, so each starts with a copy of
+    everything, including the c-structs of the trees and data, and can
+    simulate into its own copy without disturbing the others.  The C
+    randomizer and the random module of each process are seeded with
+    seeds made from seed.  The return values of oneRep() are returned
+    in a list, by process, in order.  Arg gm is the P4Error message
+    list of the caller.
+    """
+    from p4.mcmc import getForkContext
+    ctx = getForkContext(gm)
+    nProcesses = min(nProcesses, nReps)
+    seeder = random.Random(seed)
+    procs = []
+    for i in range(nProcesses):
+        n = nReps // nProcesses
+        if i < nReps % nProcesses:
+            n += 1
+        parentConn, childConn = ctx.Pipe()
+        p = ctx.Process(target=_simWorker,
+                        args=(oneRep, n, seeder.randrange(1, 2 ** 31), childConn))
+        p.start()
+        childConn.close()
+        procs.append((p, parentConn))
+
+    results = []
+    errors = []
+    for p, conn in procs:
+        try:
+            status, ret = conn.recv()
+        except EOFError:
+            status, ret = 'error', 'The process went away.'
+        conn.close()
+        p.join()
+        if status == 'ok':
+            results += ret
+        else:
+            errors.append(ret)
+    if errors:
+        gm.append("A simulation process failed.")
+        gm.append(errors[0])
+        raise P4Error(gm)
+    return results
 
 
 def _fixFileName(fName):
@@ -64,7 +123,7 @@ Tree- and model-based composition fit test
 
 
 if True:
-    def simsForModelFitTests(self, reps=10, seed=None):
+    def simsForModelFitTests(self, reps=10, seed=None, nProcesses=1):
         """Do simulations for model fit tests.
 
         The model fit tests are the Goldman-Cox test, and the tree- and
@@ -86,6 +145,12 @@ if True:
         runs of this method will have different output file names.
         Hopefully.
 
+        On a single machine with several cores, you can instead set
+        nProcesses, and the reps will be shared among that many forked
+        processes, each with its own copy of the tree and data, and its
+        own random seed, made from seed.  The stats from all of them
+        are collected into the one pair of output files.
+
         When your model uses empirical comps, simulation uses the
         empirical comp of the original data for simulation (good), then
         the optimization part uses the empirical comp of the
@@ -97,7 +162,7 @@ if True:
         which uses all the stats files to make null distributions to
         assess significance of the same stats from self."""
 
-        #gm = ['Tree.simsForModelFitTests()']
+        gm = ['Tree.simsForModelFitTests()']
 
         # Make a new data object in which to do the sims, so we do not over-write self
         # print "a self.data = %s" % self.data
@@ -159,16 +224,6 @@ if True:
             seed = os.getpid()
         pf.reseedCRandomizer(int(seed))
 
-        # Open up some output files in which to put the sim data
-        outfileBaseName = 'sims'  # Could be an argument, user-assignable.
-        if doGoldmanCox:
-            f2Name = outfileBaseName + '_GoldmanStats_%s' % seed
-            f2 = open(f2Name, 'w')
-            f2.write('# part\tunconstr L\t log like \tGoldman-Cox stat\n')
-
-        f3Name = outfileBaseName + '_CompStats_%s' % seed
-        f3 = open(f3Name, 'w')
-
         # When sims are done when the comp is empirical (whether or not
         # free) we need to re-set the comps based on the newly-simulated
         # data.  So first find out if any comps are empirical.
@@ -180,8 +235,11 @@ if True:
                     break
         # print "hasEmpiricalComps=%s" % hasEmpiricalComps
 
-        # Do the sims
-        for i in range(reps):
+        def oneRep():
+            # One sim.  Returns the lines for the Goldman-Cox and
+            # composition stats files.
+            goldmanLines = []
+            compLines = []
             self.simulate()
             if hasEmpiricalComps:
                 # Set empirical comps based on newly-simulated data
@@ -193,7 +251,7 @@ if True:
                     self.data.calcUnconstrainedLogLikelihood2()
                     diff = self.data.unconstrainedLogLikelihood - \
                         evalTree.logLike
-                    f2.write(
+                    goldmanLines.append(
                         '-1\t%f\t%f\t%f\n' % (self.data.unconstrainedLogLikelihood, evalTree.logLike, diff))
                 for pNum in range(self.data.nParts):
                     unc = pf.getUnconstrainedLogLike(
@@ -202,7 +260,7 @@ if True:
                     like = pf.p4_partLogLike(
                         evalTree.cTree, self.data.parts[pNum].cPart, pNum, 0)
                     diff = unc - like
-                    f2.write('%i\t%f\t%f\t%f\n' % (pNum, unc, like, diff))
+                    goldmanLines.append('%i\t%f\t%f\t%f\n' % (pNum, unc, like, diff))
 
             for pNum in range(self.data.nParts):
                 h = statsHashList[pNum]
@@ -239,11 +297,33 @@ if True:
                                     seqNum] += ((dif * dif) / h['expectedIndividualCounts'][seqNum][j])
                         h['overallSimStat'] += h['individualSimStats'][seqNum]
 
-                f3.write('%i\t' % pNum)
+                line = '%i\t' % pNum
                 for seqNum in range(self.data.nTax):
-                    f3.write('%f\t' % h['individualSimStats'][seqNum])
-                f3.write('%f\n' % h['overallSimStat'])
+                    line += '%f\t' % h['individualSimStats'][seqNum]
+                line += '%f\n' % h['overallSimStat']
+                compLines.append(line)
                 # print h['overallSimStat']
+            return goldmanLines, compLines
+
+        # Open up some output files in which to put the sim data
+        outfileBaseName = 'sims'  # Could be an argument, user-assignable.
+        if doGoldmanCox:
+            f2Name = outfileBaseName + '_GoldmanStats_%s' % seed
+            f2 = open(f2Name, 'w')
+            f2.write('# part\tunconstr L\t log like \tGoldman-Cox stat\n')
+
+        f3Name = outfileBaseName + '_CompStats_%s' % seed
+        f3 = open(f3Name, 'w')
+
+        # Do the sims
+        if nProcesses > 1:
+            results = _repsInProcesses(oneRep, reps, nProcesses, int(seed), gm)
+        else:
+            results = (oneRep() for i in range(reps))
+        for goldmanLines, compLines in results:
+            if doGoldmanCox:
+                f2.write(''.join(goldmanLines))
+            f3.write(''.join(compLines))
 
         if doGoldmanCox:
             f2.close()
@@ -773,7 +853,7 @@ if True:
             fRaw.close()
         return theRet
 
-    def compoTestUsingSimulations(self, nSims=100, doIndividualSequences=0, doChiSquare=0, verbose=1):
+    def compoTestUsingSimulations(self, nSims=100, doIndividualSequences=0, doChiSquare=0, verbose=1, nProcesses=1):
         """Compositional homogeneity test using a null distribution from simulations.
 
         This does a compositional homogeneity test on each data partition.
@@ -821,6 +901,10 @@ if True:
         so that the analysis is robust against data with zero or low
         values for some characters.
 
+        The sims can be shared among nProcesses forked processes.  Their
+        random seeds come from the random module, so to repeat a run,
+        set random.seed() first.
+
         For example::
 
             # First, do a homog opt, and pickle the optimized tree.
@@ -937,13 +1021,18 @@ if True:
                     onePartRows.append([])
                 rows.append(onePartRows)
 
-        # Do the sims
-        for i in range(nSims):
-            # if i < 5:
-            # print "%i simComp = %s" % (i, self.model.parts[0].comps[0].val)
+        def oneSim():
             self.simulate()
-            ret = self.data.compoChiSquaredTest(skipColumnZeros=1,
-                                                skipTaxNums=skips, getRows=doIndividualSequences, verbose=0)
+            return self.data.compoChiSquaredTest(skipColumnZeros=1,
+                                                 skipTaxNums=skips, getRows=doIndividualSequences, verbose=0)
+
+        # Do the sims
+        if nProcesses > 1:
+            # The seeds of the processes come from the random module.
+            results = _repsInProcesses(oneSim, nSims, nProcesses, random.getrandbits(31), gm)
+        else:
+            results = (oneSim() for i in range(nSims))
+        for ret in results:
             # print "%i ret=%s" % (i, ret)
             for pNum in range(self.data.nParts):
                 full[pNum].append(ret[pNum][0])
@@ -73,6 +73,14 @@ if True:
             pf.p4_freeModel(self.model.cModel)
             self.model.cModel = 0
 
+    def _useClFloat(self):
+        """Whether the cl's are to be floats, from self or self.data."""
+        # Trees and Data from old pickles might not have clFloat.
+        clFloat = getattr(self, 'clFloat', None)
+        if clFloat is None:
+            clFloat = getattr(self.data, 'clFloat', False)
+        return bool(clFloat)
+
     def _allocCStuff(self, resetEmpiricalComps=True):
         """Allocate c-memory for self and its nodes."""
 
@@ -115,8 +123,13 @@ if True:
                 if n.isLeaf:
                     nLeaves += 1
             self.partLikes = numpy.zeros(self.model.nParts, numpy.float)
+            if self._useClFloat():
+                clFloat = 1
+            else:
+                clFloat = 0
             self.cTree = pf.p4_newTree(len(self.nodes), nLeaves, self.preOrder,
-                                       self.postOrder, self.partLikes, self.data.cData, self.model.cModel)
+                                       self.postOrder, self.partLikes, self.data.cData, self.model.cModel,
+                                       clFloat)
             if not self.cTree:
                 gm.append("Unable to allocate a cTree")
                 raise P4Error(gm)
@@ -231,6 +244,40 @@ if True:
         if verbose:
             print("Tree.calcLogLike(). %f" % self.logLike)
 
+    def checkClFloat(self, verbose=1):
+        """Compare the log like with float cl's to that with double cl's.
+
+        The conditional likelihoods can be stored as floats rather than
+        doubles, by setting self.clFloat, or self.data.clFloat.  That
+        halves the memory that they use, but it is less accurate.  The
+        log like is then only good to about float precision, and so
+        optimization with float cl's stops there, rather than at the
+        precision of doubles.  This calculates the log like both ways, without optimization,
+        and returns the difference, float minus double.  Afterwards
+        self.logLike is as it would be with the current setting.
+        """
+
+        savedClFloat = getattr(self, 'clFloat', None)
+        logLikes = []
+        for clFloat in [False, True]:
+            self.deleteCStuff()
+            self.clFloat = clFloat
+            self.calcLogLike(verbose=0)
+            logLikes.append(self.logLike)
+        self.deleteCStuff()
+        self.clFloat = savedClFloat
+        diff = logLikes[1] - logLikes[0]
+        if self._useClFloat():
+            self.logLike = logLikes[1]
+        else:
+            self.logLike = logLikes[0]
+        if verbose:
+            print("Tree.checkClFloat()")
+            print("    double cl's: %.8f" % logLikes[0])
+            print("     float cl's: %.8f" % logLikes[1])
+            print("     difference: %g" % diff)
+        return diff
+
     def optLogLike(self, verbose=1, newtAndBrentPowell=1, allBrentPowell=0):
         """Calculate the likelihood of the tree, with optimization.
 
@@ -279,6 +326,63 @@ if True:
             theEndTime = time.clock()
             print("cpu time %s seconds." % (theEndTime - theStartTime))
 
+    def bootstrapOptLogLike(self, nReps=100, seed=None, verbose=False):
+        """Optimize on nReps bootstraps of the data, by pattern counts.
+
+        The bootstraps are made with Data.bootstrapPatternCounts(), so
+        the data is not copied or re-patterned.  Each optimization
+        starts from the branch lengths and model parameters that self
+        has to start with, and empirical comps are set from each
+        bootstrap.  Afterwards the original pattern counts, branch
+        lengths, and model parameters are put back, and the logLike is
+        re-calculated.  The seed is used as in Data.bootstrap().
+
+        The topology is not changed, so this is for eg the variance of
+        branch lengths and model parameters, not for clade supports.
+
+        It returns a list, one for each rep, of dicts with the
+        'logLike', the 'brLens' (indexed by nodeNum, with None for the
+        root), and the 'prams' (as in the mcmc prams file, see
+        Model.getPramsLineVals()).
+        """
+
+        gm = ['Tree.bootstrapOptLogLike()']
+        self._commonCStuff()
+        startBrLens = [n.br.len if n != self.root else None for n in self.nodes]
+        # A copy of the model, without its c-struct.
+        savedCModel = self.model.cModel
+        self.model.cModel = None
+        startModel = copy.deepcopy(self.model)
+        self.model.cModel = savedCModel
+        # Optimizing makes their spec 'optimized'.
+        empiricalComps = [c for mp in self.model.parts for c in mp.comps if c.spec == 'empirical']
+
+        def restore():
+            for n in self.iterNodesNoRoot():
+                n.br.len = startBrLens[n.nodeNum]
+            startModel.copyValsTo(self.model)
+            if empiricalComps:
+                for c in empiricalComps:
+                    c.spec = 'empirical'
+                self.setEmpiricalComps()
+
+        results = []
+        try:
+            for repNum in range(nReps):
+                self.data.bootstrapPatternCounts(seed=seed)
+                restore()
+                self.optLogLike(verbose=0)
+                results.append({'logLike': self.logLike,
+                                'brLens': [n.br.len if n != self.root else None for n in self.nodes],
+                                'prams': self.model.getPramsLineVals()})
+                if verbose:
+                    print("%s rep %i, logLike %f" % (gm[0], repNum, self.logLike))
+        finally:
+            self.data.resetPatternCounts()
+            restore()
+            self.calcLogLike(verbose=0)
+        return results
+
     def optTest(self):
         self._commonCStuff()
         theStartTime = time.clock()
@@ -406,6 +510,35 @@ if True:
                 gm.append("which is probably not going to work as you want.")
                 raise P4Error(gm)
 
+    def simulatePatternCounts(self, nReps=1):
+        """Simulate nReps data sets, and get their site pattern counts.
+
+        This is for when only the pattern counts of the simulations are
+        needed, eg for the unconstrained log like, or constant sites
+        counts.  The data attached to self is not changed.  The bigP
+        matrices are made once for all the reps, and the sequences are
+        never made, so it is much faster than nReps calls to
+        simulate().  It uses the C randomizer, as simulate() does, but
+        not in the same order, so the sims are different.  There is no
+        refTree.
+
+        It returns a list, one for each data part, of lists of nReps
+        dicts.  The keys of the dicts are the patterns, as bytes of char
+        state numbers (not symbols) in the order of the sequences, and
+        the values are the counts.  For example::
+
+            for counts in t.simulatePatternCounts(nReps=100)[0]:
+                nChar = float(sum(counts.values()))
+                unc = sum([c * math.log(c / nChar) for c in counts.values()])
+
+        and list(bytearray(aPattern)) gives the char state numbers of a
+        pattern.
+        """
+
+        self._commonCStuff()
+        return [pf.p4_simulatePatternCounts(self.cTree, pNum, nReps)
+                for pNum in range(self.data.nParts)]
+
     def ancestralStateDraw(self):
         """Make a draw from the inferred root character state distribution
 
@@ -446,13 +579,21 @@ if True:
                     
 
     def getSiteLikes(self):
-        """Likelihoods, not log likes. Placed in self.siteLikes, a list."""
+        """Likelihoods, not log likes. Placed in self.siteLikes, a list.
+
+        The log likes are also placed in self.siteLogLikes.  For big
+        trees the site likelihoods may underflow to zero, even though
+        the calculation itself is scaled, so the log likes are the
+        ones to use in that case.
+        """
         self._commonCStuff()
         # second arg is getSiteLikes
         self.logLike = pf.p4_treeLogLike(self.cTree, 1)
         self.siteLikes = []
+        self.siteLogLikes = []
         for p in self.data.parts:
             self.siteLikes += pf.getSiteLikes(p.cPart)
+            self.siteLogLikes += pf.getSiteLogLikes(p.cPart)
 
     def getSiteRates(self):
         """Get posterior mean site rate, and gamma category.
@@ -2,12 +2,29 @@ from __future__ import print_function
 import sys
 import os
 import math
+import traceback
+import numpy
 import p4.func
+import p4.treetests
 from p4.var import var
 from p4.tree import Tree
 from p4.p4exceptions import P4Error
 
 
+def _siteLogLikesWorker(theTrees, fName, treeNums, optimize, conn):
+    """The work of one process of Trees.writeSiteLogLikes()."""
+    try:
+        theMatrix = numpy.lib.format.open_memmap(fName, mode='r+')
+        for i in treeNums:
+            theMatrix[i] = theTrees._siteLogLikesRow(i, optimize)
+            theMatrix.flush()
+        del theMatrix
+        conn.send(('ok', None))
+    except Exception:
+        conn.send(('error', traceback.format_exc()))
+    conn.close()
+
+
 class Trees(object):
 
     """A bunch of trees, all with the same taxNames.
@@ -753,6 +770,173 @@ class Trees(object):
             t = self.trees[i]
             print("%3i   %20s  %1.3f" % (i, t.name, (float(winners[i]) / float(bootCount))))
 
+    def treeTests(self, nBoots=10000, scales=None, seed=None, nThreads=1, verbose=True):
+        """Compare the trees with AU, SH, KH, and RELL bp tests, without consel.
+
+        The trees in self should all be optimized, and all should have
+        models attached.  If they do not have data, self.data is used.
+
+        The tests are done by p4.treetests.siteLogLikeTests(), which
+        see for the args.  It is a numpy multiscale RELL bootstrap of
+        the site log likes, like consel but without the external
+        programs or files.
+
+        Unless verbose is turned off it prints a table, in the order
+        of the trees.  It returns the dict of numpy arrays from
+        siteLogLikeTests().
+        """
+
+        gm = ['Trees.treeTests()']
+
+        if not self.trees or len(self.trees) < 2:
+            gm.append("Need at least 2 trees.")
+            raise P4Error(gm)
+        for t in self.trees:
+            if not t.model:
+                gm.append("Tree %s has no model." % t.name)
+                raise P4Error(gm)
+            if not t.data:
+                if not self.data:
+                    gm.append("You need to 'myTreesObject.data = myDataObject'")
+                    raise P4Error(gm)
+                t.data = self.data
+
+        siteLogLikes = []
+        for t in self.trees:
+            t.getSiteLikes()
+            t.deleteCStuff()
+            siteLogLikes.append(numpy.array(t.siteLogLikes))
+        siteLogLikes = numpy.array(siteLogLikes)
+
+        results = p4.treetests.siteLogLikeTests(siteLogLikes, nBoots=nBoots, scales=scales,
+                                                seed=seed, nThreads=nThreads)
+        if verbose:
+            print("\n%3s   %20s  %10s  %6s  %6s  %6s  %6s" % (
+                ' ', 'tree', 'obs', 'au', 'bp', 'kh', 'sh'))
+            for i in range(len(self.trees)):
+                print("%3i   %20s  %10.3f  %6.3f  %6.3f  %6.3f  %6.3f" % (
+                    i, self.trees[i].name, results['obs'][i], results['au'][i],
+                    results['bp'][i], results['kh'][i], results['sh'][i]))
+        return results
+
+    def _siteLogLikesRow(self, treeNum, optimize):
+        t = self.trees[treeNum]
+        if optimize:
+            t.optLogLike(verbose=0)
+        t.getSiteLikes()
+        # Be memory efficient
+        t.deleteCStuff()
+        row = numpy.array(t.siteLogLikes)
+        # A bad row is not written, so that a resume would re-do it.
+        if not numpy.all(numpy.isfinite(row)):
+            gm = ['Trees.writeSiteLogLikes()']
+            gm.append("The site log likes of tree %i (%s) are not all finite." % (treeNum, t.name))
+            raise P4Error(gm)
+        return row
+
+    def writeSiteLogLikes(self, fName, optimize=False, nProcesses=1, resume=True):
+        """Write the site log likes of the trees to a numpy .npy file.
+
+        The file holds a float64 matrix, nTrees by nSites, with the
+        rows in the order of the trees and the sites in the order of
+        the parts.  Each row is written to the file as soon as it is
+        made, through a memory map, so the whole matrix is never in
+        memory.  It can be read zero-copy with::
+
+            m = numpy.load(fName, mmap_mode='r')
+
+        and used eg in p4.treetests.siteLogLikeTests().
+
+        The trees should all have models attached.  If they do not have
+        data, self.data is used.  If optimize is set, each tree is
+        optimized first, otherwise its logLike is calculated as it is.
+
+        Rows that are not done yet are NaN.  If a tree gives site log
+        likes that are not finite, it is an error, and its row is left
+        as NaN.  If the file exists and
+        resume is set (the default), only those rows are done, so an
+        interrupted run can be picked up again.  If resume is turned
+        off, an existing file is not overwritten.
+
+        With nProcesses more than 1, the rows are shared out among
+        that many forked processes, each writing its own rows to the
+        file.  When trees are optimized in other processes, the
+        optimized trees are not seen in this process.
+
+        It returns the matrix, memory-mapped read-only.
+        """
+
+        gm = ['Trees.writeSiteLogLikes()']
+
+        if not self.trees:
+            gm.append("No trees?")
+            raise P4Error(gm)
+        for t in self.trees:
+            if not t.model:
+                gm.append("Tree %s has no model." % t.name)
+                raise P4Error(gm)
+            if not t.data:
+                if not self.data:
+                    gm.append("You need to 'myTreesObject.data = myDataObject'")
+                    raise P4Error(gm)
+                t.data = self.data
+        nTrees = len(self.trees)
+        nSites = sum([p.nChar for p in self.trees[0].data.parts])
+        theShape = (nTrees, nSites)
+
+        if os.path.exists(fName):
+            if not resume:
+                gm.append("Refusing to overwrite file %s" % fName)
+                raise P4Error(gm)
+            theMatrix = numpy.lib.format.open_memmap(fName, mode='r+')
+            if theMatrix.shape != theShape or theMatrix.dtype != numpy.float64:
+                gm.append("Can't resume from file %s" % fName)
+                gm.append("It has a %s matrix of shape %s, but this needs float64 of shape %s" % (
+                    theMatrix.dtype, theMatrix.shape, theShape))
+                raise P4Error(gm)
+        else:
+            theMatrix = numpy.lib.format.open_memmap(fName, mode='w+', dtype=numpy.float64,
+                                                     shape=theShape)
+            theMatrix[:] = numpy.nan
+            theMatrix.flush()
+        treeNums = [i for i in range(nTrees) if numpy.isnan(theMatrix[i]).any()]
+
+        nProcesses = min(nProcesses, len(treeNums))
+        if nProcesses > 1:
+            # The workers open the file themselves.
+            del theMatrix
+            from p4.mcmc import getForkContext
+            ctx = getForkContext(gm)
+            procs = []
+            for procNum in range(nProcesses):
+                parentConn, childConn = ctx.Pipe()
+                p = ctx.Process(target=_siteLogLikesWorker,
+                                args=(self, fName, treeNums[procNum::nProcesses], optimize, childConn))
+                p.start()
+                childConn.close()
+                procs.append((p, parentConn))
+            errors = []
+            for p, conn in procs:
+                try:
+                    status, ret = conn.recv()
+                except EOFError:
+                    status, ret = 'error', 'The process went away.'
+                conn.close()
+                p.join()
+                if status != 'ok':
+                    errors.append(ret)
+            if errors:
+                gm.append("A site log likes process failed.  The rows that it did are kept.")
+                gm.append(errors[0])
+                raise P4Error(gm)
+        else:
+            for i in treeNums:
+                theMatrix[i] = self._siteLogLikesRow(i, optimize)
+                theMatrix.flush()
+            del theMatrix
+
+        return numpy.load(fName, mmap_mode='r')
+
     def trackSplitsFromTree(self, theTree, windowSize=200, stride=100, fName='trackSplitsOut.py'):
         """See how slits from theTree changes over the trees in self.
 
@@ -0,0 +1,200 @@
+"""Tree topology tests from site log likes, without consel.
+
+See siteLogLikeTests(), and Trees.treeTests().
+"""
+from __future__ import print_function
+import math
+import numpy
+from multiprocessing.pool import ThreadPool
+from p4.p4exceptions import P4Error
+
+# The scales of the multiscale bootstrap, as in consel.
+defaultScales = [0.5, 0.6, 0.7, 0.8, 0.9, 1.0, 1.1, 1.2, 1.3, 1.4]
+
+
+def _normalCdf(x):
+    return 0.5 * math.erfc(-x / math.sqrt(2.0))
+
+
+def _normalQuantile(p):
+    """The inverse of _normalCdf(), for 0 < p < 1.
+
+    Acklam's rational approximation, then one Halley step.
+    """
+    a = [-3.969683028665376e+01, 2.209460984245205e+02, -2.759285104469687e+02,
+         1.383577518672690e+02, -3.066479806614716e+01, 2.506628277459239e+00]
+    b = [-5.447609879822406e+01, 1.615858368580409e+02, -1.556989798598866e+02,
+         6.680131188771972e+01, -1.328068155288572e+01]
+    c = [-7.784894002430293e-03, -3.223964580411365e-01, -2.400758277161838e+00,
+         -2.549732539343734e+00, 4.374664141464968e+00, 2.938163982698783e+00]
+    d = [7.784695709041462e-03, 3.224671290700398e-01, 2.445134137142996e+00,
+         3.754408661907416e+00]
+    if p < 0.02425:
+        q = math.sqrt(-2.0 * math.log(p))
+        x = (((((c[0] * q + c[1]) * q + c[2]) * q + c[3]) * q + c[4]) * q + c[5]) / \
+            ((((d[0] * q + d[1]) * q + d[2]) * q + d[3]) * q + 1.0)
+    elif p > 1.0 - 0.02425:
+        q = math.sqrt(-2.0 * math.log(1.0 - p))
+        x = -(((((c[0] * q + c[1]) * q + c[2]) * q + c[3]) * q + c[4]) * q + c[5]) / \
+            ((((d[0] * q + d[1]) * q + d[2]) * q + d[3]) * q + 1.0)
+    else:
+        q = p - 0.5
+        r = q * q
+        x = (((((a[0] * r + a[1]) * r + a[2]) * r + a[3]) * r + a[4]) * r + a[5]) * q / \
+            (((((b[0] * r + b[1]) * r + b[2]) * r + b[3]) * r + b[4]) * r + 1.0)
+    e = _normalCdf(x) - p
+    u = e * math.sqrt(2.0 * math.pi) * math.exp(x * x / 2.0)
+    return x - u / (1.0 + x * u / 2.0)
+
+
+def _bootChunk(args):
+    """Do nReps bootstrap reps of nDraws sites, in a thread.
+
+    It returns the number of wins of each tree, and if doCentered
+    the number of times the centered KH and SH stats are at least the
+    observed.
+    """
+    siteLogLikes, totals, obs, best, nDraws, nReps, seed, doCentered = args
+    nSites = siteLogLikes.shape[1]
+    rng = numpy.random.RandomState(seed)
+    # The site counts of all the reps in one bincount, which is faster
+    # than rng.multinomial().
+    draws = rng.randint(0, nSites, size=(nReps, nDraws))
+    draws += (numpy.arange(nReps) * nSites)[:, numpy.newaxis]
+    counts = numpy.bincount(draws.ravel(), minlength=nReps * nSites).reshape(nReps, nSites)
+    # nReps x nTrees, with numpy dot, which releases the GIL
+    repTotals = numpy.dot(counts.astype(numpy.float64), siteLogLikes.T)
+    nWins = numpy.bincount(numpy.argmax(repTotals, axis=1), minlength=len(totals))
+    if not doCentered:
+        return nWins, None, None
+    centered = repTotals - totals
+    # KH, against the best tree
+    khStats = centered[:, best][:, numpy.newaxis] - centered
+    nKh = (khStats >= obs).sum(axis=0)
+    # SH, against the best of the centered reps
+    shStats = centered.max(axis=1)[:, numpy.newaxis] - centered
+    nSh = (shStats >= obs).sum(axis=0)
+    return nWins, nKh, nSh
+
+
+def _auFit(scales, bps, nBoots):
+    """Fit z = v sqrt(r) + c / sqrt(r) to the bps, and return the au.
+
+    The fit is weighted least squares, as in Shimodaira 2002.  Scales
+    where the bp is 0 or 1 are left out.
+    """
+    xx = []
+    yy = []
+    ww = []
+    for r, bp in zip(scales, bps):
+        if 0.0 < bp < 1.0:
+            z = -_normalQuantile(bp)
+            dens = math.exp(-z * z / 2.0) / math.sqrt(2.0 * math.pi)
+            # The inverse of the binomial variance of z
+            w = nBoots * dens * dens / (bp * (1.0 - bp))
+            xx.append([math.sqrt(r), 1.0 / math.sqrt(r)])
+            yy.append(z)
+            ww.append(w)
+    if len(yy) < 2:
+        # Too few to fit; it is all or nothing.
+        bpsMean = sum(bps) / len(bps)
+        if bpsMean >= 0.5:
+            return 1.0
+        return 0.0
+    xx = numpy.array(xx)
+    sw = numpy.sqrt(numpy.array(ww))
+    v, c = numpy.linalg.lstsq(xx * sw[:, numpy.newaxis], numpy.array(yy) * sw, rcond=-1)[0]
+    return 1.0 - _normalCdf(v - c)
+
+
+def siteLogLikeTests(siteLogLikes, nBoots=10000, scales=None, seed=None, nThreads=1):
+    """AU, SH, KH, and RELL bp tests from a matrix of site log likes.
+
+    The siteLogLikes is a numpy array, nTrees by nSites, eg the
+    Tree.siteLogLikes from Tree.getSiteLikes() for each tree.
+
+    The bootstraps are RELL, resampling the columns of the matrix.
+    There are nBoots reps for each of the scales (the number of sites
+    drawn over the number of sites), which by default are the same as
+    in consel, 0.5 to 1.4.  Scale 1.0 is always done.
+
+    The reps are done in chunks on a pool of nThreads threads.  The
+    chunks have their own seeds, made from the seed, so the result
+    does not depend on nThreads.
+
+    It returns a dict of numpy arrays, each in the order of the trees,
+    with
+
+    - 'obs', the logLike of the best tree minus the logLike of the tree
+    - 'au', the approximately unbiased test p-value
+    - 'bp', the RELL bootstrap probability
+    - 'kh', the Kishino-Hasegawa test p-value, against the best tree
+    - 'sh', the Shimodaira-Hasegawa test p-value
+    """
+
+    gm = ['siteLogLikeTests()']
+    siteLogLikes = numpy.asarray(siteLogLikes, dtype=numpy.float64)
+    if siteLogLikes.ndim != 2 or siteLogLikes.shape[0] < 2 or siteLogLikes.shape[1] < 1:
+        gm.append("The siteLogLikes should be nTrees by nSites, with at least 2 trees.")
+        gm.append("Got shape %s" % (siteLogLikes.shape,))
+        raise P4Error(gm)
+    if not numpy.all(numpy.isfinite(siteLogLikes)):
+        gm.append("The siteLogLikes are not all finite.")
+        raise P4Error(gm)
+    if nBoots < 1 or nThreads < 1:
+        gm.append("nBoots and nThreads should be at least 1.")
+        raise P4Error(gm)
+    if scales is None:
+        scales = defaultScales
+    scales = sorted(set([float(r) for r in scales] + [1.0]))
+    if scales[0] <= 0.0:
+        gm.append("The scales should be positive.")
+        raise P4Error(gm)
+
+    nTrees, nSites = siteLogLikes.shape
+    totals = siteLogLikes.sum(axis=1)
+    best = int(numpy.argmax(totals))
+    obs = totals[best] - totals
+
+    # Keep the draws of a chunk to about a million numbers.
+    chunkSize = max(1, min(nBoots, 1000000 // int(round(scales[-1] * nSites))))
+    jobs = []
+    jobScales = []
+    for r in scales:
+        nDraws = max(1, int(round(r * nSites)))
+        nDone = 0
+        while nDone < nBoots:
+            nReps = min(chunkSize, nBoots - nDone)
+            jobs.append([siteLogLikes, totals, obs, best, nDraws, nReps, None, r == 1.0])
+            jobScales.append(r)
+            nDone += nReps
+    seeder = numpy.random.RandomState(seed)
+    for job, s in zip(jobs, seeder.randint(0, 2 ** 31 - 1, size=len(jobs))):
+        job[6] = int(s)
+
+    if nThreads > 1:
+        pool = ThreadPool(nThreads)
+        try:
+            results = pool.map(_bootChunk, jobs)
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        results = [_bootChunk(job) for job in jobs]
+
+    nWins = dict((r, numpy.zeros(nTrees)) for r in scales)
+    nKh = numpy.zeros(nTrees)
+    nSh = numpy.zeros(nTrees)
+    for r, (w, kh, sh) in zip(jobScales, results):
+        nWins[r] += w
+        if kh is not None:
+            nKh += kh
+            nSh += sh
+
+    bps = numpy.array([nWins[r] / nBoots for r in scales])   # nScales x nTrees
+    au = numpy.array([_auFit(scales, bps[:, i], nBoots) for i in range(nTrees)])
+    return {'obs': obs,
+            'au': au,
+            'bp': nWins[1.0] / nBoots,
+            'kh': nKh / nBoots,
+            'sh': nSh / nBoots}
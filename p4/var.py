@@ -316,6 +316,46 @@ class Var(object):
 
         self.mcmc_swapVector = False  # (old) matrix or (new) vector
         self.mcmc_swapTunerSampleSize = 250
+        # Mcmc.run() keeps the sample files open, and buffers the
+        # samples.  They are written out every this many samples, or
+        # when this many seconds have gone by since the last time, and
+        # at checkPoints and at the end.
+        self.mcmc_sampleFlushInterval = 100
+        self.mcmc_sampleFlushSeconds = 60.0
+        # Mcmc checkPoints can be compressed, 'none' or 'zlib'.  If
+        # mcmc_checkPointAsync is set, they are written in a background
+        # thread while the run goes on, with at most
+        # mcmc_checkPointMaxPending waiting to be written.
+        self.mcmc_checkPointCompression = 'none'
+        self.mcmc_checkPointAsync = False
+        self.mcmc_checkPointMaxPending = 1
+        # Running ESSs, autocorrelations, and split support changes,
+        # written at the time checks of Mcmc.run().  See
+        # p4.mcmcdiagnostics.McmcOnlineDiagnostics.
+        self.mcmc_onlineDiagnostics = False
+        self.mcmc_onlineDiagnosticsNBatches = 32
+        # If Mcmc.adaptProposalWeightsBurnin is set, the proposal
+        # weights are adapted every this many gens, within these
+        # bounds.  See Mcmc._adaptProposalWeights().
+        self.mcmc_adaptProposalWeightsInterval = 1000
+        self.mcmc_adaptProposalWeightsMinFactor = 0.25
+        self.mcmc_adaptProposalWeightsMaxFactor = 4.0
+        # Tally the wall time of each Mcmc proposal, and the likelihood
+        # work it causes.  See Mcmc.writeProposalProfile().
+        self.mcmc_profileProposals = False
+        # How closely Chain.gen() checks that the propTree is put back
+        # the way it was after a proposal aborts.  0 does not check, 1
+        # compares quick checksums of the two trees, and 2 does the full
+        # (slow) Chain.verifyIdentityOfTwoTreesInChain().
+        self.mcmc_debugCheckLevel = 0
+
+        # The number of threads for likelihood calculations (var.nThreads
+        # is a property).  Needs pf built with OpenMP.
+        self._nThreads = 1
+
+        # The number of eigensystems kept in the eig cache
+        # (var.eigCacheSize is a property).  Zero turns it off.
+        self._eigCacheSize = 64
 
 
     def _del_nothing(self):
@@ -421,6 +461,65 @@ class Var(object):
     rMatrixNormalizeTo1 = property(_get_rMatrixNormalizeTo1,
                                    _set_rMatrixNormalizeTo1, _del_nothing)
 
+    def _get_nThreads(self):
+        return self._nThreads
+
+    def _set_nThreads(self, newVal):
+        gm = ["Var._set_nThreads()"]
+        try:
+            newVal = int(newVal)
+        except (ValueError, TypeError):
+            gm.append('This property should be set to an int.')
+            raise P4Error(gm)
+        if newVal < 1:
+            gm.append('This property should be 1 or more.  Got %i' % newVal)
+            raise P4Error(gm)
+        import p4.pf as pf
+        if newVal > 1 and not pf.haveOpenMP():
+            gm.append("The pf module was built without OpenMP, so nThreads can only be 1.")
+            raise P4Error(gm)
+        pf.setNThreads(newVal)
+        self._nThreads = newVal
+
+    nThreads = property(_get_nThreads, _set_nThreads, _del_nothing)
+    """The number of threads used to calculate likelihoods.
+
+    With more than one data partition the parts are done in parallel,
+    otherwise the patterns of the one part are split among the
+    threads.  The likelihood does not depend on the number of threads.
+    This applies to Tree.calcLogLike(), Tree.optLogLike(), and
+    Mcmc.run().  It needs the pf module to be built with OpenMP, which
+    setup.py does if it can."""
+
+    def _get_eigCacheSize(self):
+        return self._eigCacheSize
+
+    def _set_eigCacheSize(self, newVal):
+        gm = ["Var._set_eigCacheSize()"]
+        try:
+            newVal = int(newVal)
+        except (ValueError, TypeError):
+            gm.append('This property should be set to an int.')
+            raise P4Error(gm)
+        if newVal < 0:
+            gm.append('This property should be zero or more.  Got %i' % newVal)
+            raise P4Error(gm)
+        import p4.pf as pf
+        pf.eigCacheSetMaxSize(newVal)
+        self._eigCacheSize = newVal
+
+    eigCacheSize = property(_get_eigCacheSize, _set_eigCacheSize, _del_nothing)
+    """The number of eigensystems of bigQ's kept for re-use.
+
+    The eigensystem for a comp and rMatrix is needed every time either
+    of them changes, and the same values come up again and again in an
+    Mcmc, eg after rejected proposals, and in the other chains.  The
+    eigensystems are cached, keyed on the comp and rMatrix values, and
+    the least recently used are dropped when it is full.  There is one
+    cache for the whole process, so it is shared by all trees and
+    chains.  Setting this empties the cache, and zero turns it off.
+    See func.eigCacheStats()."""
+
     def _get_interactiveHelper(self):
         return self._interactiveHelper
 
@@ -107,6 +107,37 @@ else:
     print("So that is not going to work.")
     sys.exit()
 
+# OpenMP is optional.  If the compiler can do it, the pf module is
+# built with it, so that likelihoods can be calculated in threads (see
+# var.nThreads).  Set P4_NO_OPENMP in the environment to not use it.
+def compilerDoesOpenMP():
+    if os.environ.get('P4_NO_OPENMP'):
+        return False
+    import tempfile
+    from distutils.ccompiler import new_compiler
+    from distutils.sysconfig import customize_compiler
+    cc = new_compiler()
+    customize_compiler(cc)
+    tmpDir = tempfile.mkdtemp()
+    try:
+        srcName = os.path.join(tmpDir, 'omptest.c')
+        f = open(srcName, 'w')
+        f.write("#include <omp.h>\nint main(void) { return omp_get_max_threads() < 1; }\n")
+        f.close()
+        objs = cc.compile([srcName], output_dir=tmpDir, extra_postargs=['-fopenmp'])
+        cc.link_executable(objs, os.path.join(tmpDir, 'omptest'), extra_postargs=['-fopenmp'])
+    except Exception:
+        return False
+    finally:
+        shutil.rmtree(tmpDir)
+    return True
+
+if compilerDoesOpenMP():
+    my_openmp_args = ['-fopenmp']
+else:
+    print("The compiler does not appear to do OpenMP, so the pf module will use only one thread.")
+    my_openmp_args = []
+
 pfSources = []
 sourceDir = 'Pf'
 allFiles = os.listdir(os.path.join(os.curdir, sourceDir))
@@ -203,8 +234,11 @@ setup(name="p4",
                              pfSources,
                              include_dirs = my_include_dirs,
                              library_dirs = my_lib_dirs,
-                             # If you need to link the gsl stuff statically, uncomment the extra_link_args line below,
-                             # and adjust the rpath to the location of your gsl libs.
+                             # If you need to link the gsl stuff statically, add the rpath from the line
+                             # below to the extra_link_args further down, and adjust it to the location of
+                             # your gsl libs.
                              #extra_link_args = ['-Wl,-rpath=/home/peter/Secret/lib' ],
+                             extra_compile_args = my_openmp_args,
+                             extra_link_args = my_openmp_args,
                              libraries=["gsl", "gslcblas"])])
     